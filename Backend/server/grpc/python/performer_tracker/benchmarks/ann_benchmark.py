@@ -0,0 +1,144 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+Benchmark of exact gallery search against the HNSW index at different
+gallery sizes.
+
+Galleries are filled with synthetic descriptors clustered around one centre
+per identity, similar to the crops saved over a show run. For each gallery
+size and HNSW search depth the benchmark reports the query latency, the
+recall of the nearest neighbour found by exact search, and how often the
+nearest neighbour still belongs to the same identity, which is what matching
+depends on.
+
+Usage:
+    python benchmarks/ann_benchmark.py --sizes 1000 10000 50000
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from reid.ann_index import ANN_AVAILABLE  # noqa: E402
+from reid.gallery import Gallery  # noqa: E402
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def make_descriptors(rng, size, identities, dim, spread):
+    """
+    Generate descriptors clustered around one centre per identity.
+
+    Parameters:
+    rng (np.random.Generator): Random number generator
+    size (int): Number of descriptors
+    identities (int): Number of identities
+    dim (int): Length of a descriptor
+    spread (float): Standard deviation around each centre
+
+    Returns:
+    tuple: Descriptors of shape (size, dim) and their identity labels
+    """
+    centres = rng.normal(size=(identities, dim)).astype(np.float32)
+    labels = rng.integers(0, identities, size)
+    noise = rng.normal(scale=spread, size=(size, dim)).astype(np.float32)
+    return centres[labels] + noise, labels
+
+
+def time_search(gallery, queries, exact, repeats):
+    """
+    Time a nearest neighbour search of every query.
+
+    Parameters:
+    gallery (Gallery): The gallery to search
+    queries (np.ndarray): Query descriptors
+    exact (bool): Use exact search
+    repeats (int): Number of timed repetitions
+
+    Returns:
+    tuple: Milliseconds per query and the nearest row of every query
+    """
+    gallery.search(queries, k=1, exact=exact)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        _, rows = gallery.search(queries, k=1, exact=exact)
+    elapsed = (time.perf_counter() - start) / repeats
+    return elapsed * 1000 / len(queries), rows[:, 0]
+
+
+def run(args):
+    """
+    Run the benchmark for every gallery size and search depth.
+
+    Parameters:
+    args (argparse.Namespace): Parsed command line arguments
+    """
+    if not ANN_AVAILABLE:
+        logger.error("hnswlib is not installed, only exact search can run")
+
+    rng = np.random.default_rng(args.seed)
+    print(
+        f"{'size':>8} {'ef':>6} {'exact ms/q':>11} {'ann ms/q':>9} "
+        f"{'recall@1':>9} {'identity':>9} {'build s':>8}"
+    )
+    for size in args.sizes:
+        descriptors, labels = make_descriptors(
+            rng, size, args.identities, args.dim, args.spread
+        )
+        queries, _ = make_descriptors(
+            rng, args.queries, args.identities, args.dim, args.spread
+        )
+        gallery = Gallery(dim=args.dim, metric=args.metric)
+        for label in range(args.identities):
+            gallery.add(f"user_{label}", descriptors[labels == label])
+        exact_ms, exact_rows = time_search(
+            gallery, queries, True, args.repeats
+        )
+
+        if not ANN_AVAILABLE:
+            print(f"{size:>8} {'-':>6} {exact_ms:>11.3f}")
+            continue
+
+        start = time.perf_counter()
+        gallery.build_ann_index()
+        build_time = time.perf_counter() - start
+        for ef_search in args.ef:
+            gallery.ann_index.ef_search = ef_search
+            ann_ms, ann_rows = time_search(
+                gallery, queries, False, args.repeats
+            )
+            recall = np.mean(ann_rows == exact_rows)
+            identity_recall = np.mean(
+                gallery.label_ids[ann_rows] == gallery.label_ids[exact_rows]
+            )
+            print(
+                f"{size:>8} {ef_search:>6} {exact_ms:>11.3f} "
+                f"{ann_ms:>9.3f} {recall:>9.3f} {identity_recall:>9.3f} "
+                f"{build_time:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 5000, 20000]
+    )
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 64, 128])
+    parser.add_argument("--identities", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument(
+        "--metric", choices=["euclidean", "cosine"], default="euclidean"
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    run(parser.parse_args())
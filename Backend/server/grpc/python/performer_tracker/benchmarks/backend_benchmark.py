@@ -0,0 +1,231 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+Benchmark of the YOLO and OSNet inference backends on recorded video.
+
+Every backend runs the detector over the same frames and OSNet over the
+person crops found by the reference backend, the first one listed. For each
+backend the benchmark reports detector FPS, ReID crops per second, the share
+of reference detections it reproduces (IoU of at least 0.5) and the mean
+cosine similarity of its ReID features to the reference features. int8
+detectors are calibrated on the benchmark frames, and int8 OSNet models on
+the images of --calibration-folder.
+
+Usage:
+    python benchmarks/backend_benchmark.py --video rehearsal.mp4 \
+        --backends pytorch onnxruntime openvino --int8
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from model_backends import load_detector  # noqa: E402
+from reid.identity_cache import box_iou  # noqa: E402
+from reid.reid_model import PersonReID  # noqa: E402
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PERSON_CLASS = 0
+
+
+def read_frames(path, count):
+    """
+    Read frames from a video file.
+
+    Parameters:
+    path (str): Path of the video file
+    count (int): Maximum number of frames to read
+
+    Returns:
+    list: The frames read
+    """
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def benchmark_detector(model, frames):
+    """
+    Time the detector over every frame.
+
+    Parameters:
+    model (YOLO): The detector
+    frames (list): Frames to run on
+
+    Returns:
+    tuple: Frames per second and the person boxes found in each frame
+    """
+    model.predict(frames[0], verbose=False)
+    boxes = []
+    start = time.perf_counter()
+    for frame in frames:
+        result = model.predict(frame, classes=[PERSON_CLASS], verbose=False)
+        boxes.append(result[0].boxes.xyxy.cpu().numpy())
+    return len(frames) / (time.perf_counter() - start), boxes
+
+
+def benchmark_reid(reid, crops):
+    """
+    Time feature extraction over every crop.
+
+    Parameters:
+    reid (PersonReID): The ReID model
+    crops (list): Person crops
+
+    Returns:
+    tuple: Crops per second and the extracted features
+    """
+    reid.extract_reid_features_batch(crops[:1])
+    start = time.perf_counter()
+    features = reid.extract_reid_features_batch(crops)
+    return len(crops) / (time.perf_counter() - start), features
+
+
+def detection_agreement(reference, boxes):
+    """
+    Get the share of reference boxes matched by a box with an IoU of at
+    least 0.5.
+
+    Parameters:
+    reference (list): Reference boxes per frame
+    boxes (list): Boxes per frame to compare
+
+    Returns:
+    float: Share of matched reference boxes
+    """
+    matched = total = 0
+    for reference_boxes, frame_boxes in zip(reference, boxes):
+        total += len(reference_boxes)
+        if len(reference_boxes) and len(frame_boxes):
+            iou = box_iou(reference_boxes, frame_boxes)
+            matched += int(np.sum(iou.max(axis=1) >= 0.5))
+    return matched / total if total else 1.0
+
+
+def cosine_similarity(reference, features):
+    """
+    Get the mean cosine similarity of features to reference features.
+
+    Parameters:
+    reference (np.ndarray): Reference features of shape (N, 512)
+    features (np.ndarray): Features of shape (N, 512)
+
+    Returns:
+    float: Mean cosine similarity
+    """
+    if len(reference) == 0:
+        return 1.0
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    features = features / np.linalg.norm(features, axis=1, keepdims=True)
+    return float(np.mean(np.sum(reference * features, axis=1)))
+
+
+def crop_people(frames, boxes):
+    """
+    Crop every detected person out of the frames.
+
+    Parameters:
+    frames (list): Frames
+    boxes (list): Person boxes per frame
+
+    Returns:
+    list: Person crops
+    """
+    crops = []
+    for frame, frame_boxes in zip(frames, boxes):
+        for x1, y1, x2, y2 in frame_boxes.astype(int):
+            crop = frame[max(y1, 0): y2, max(x1, 0): x2]
+            if crop.size:
+                crops.append(crop)
+    return crops
+
+
+def run(args):
+    """
+    Run the benchmark for every backend.
+
+    Parameters:
+    args (argparse.Namespace): Parsed command line arguments
+    """
+    frames = read_frames(args.video, args.frames)
+    if not frames:
+        logger.error(f"No frames could be read from {args.video}")
+        return
+
+    reference_boxes = reference_features = crops = None
+    rows = []
+    for backend in args.backends:
+        for int8 in [False, True] if args.int8 else [False]:
+            if backend == "pytorch" and int8:
+                continue
+            detector = load_detector(
+                args.detector,
+                backend,
+                int8,
+                calibration_frames=lambda: frames,
+            )
+            detection_fps, boxes = benchmark_detector(detector, frames)
+            reid = PersonReID(
+                args.reid_model,
+                backend=backend,
+                int8=int8,
+                calibration_folder=args.calibration_folder,
+            )
+            if reference_boxes is None:
+                reference_boxes = boxes
+                crops = crop_people(frames, boxes)
+            reid_fps, features = benchmark_reid(reid, crops)
+            if reference_features is None:
+                reference_features = features
+            rows.append(
+                (
+                    backend + (" int8" if int8 else ""),
+                    detection_fps,
+                    reid_fps,
+                    detection_agreement(reference_boxes, boxes),
+                    cosine_similarity(reference_features, features),
+                )
+            )
+
+    print(
+        f"{'backend':<18} {'detector fps':>12} {'reid crops/s':>12} "
+        f"{'det agree':>9} {'reid cos':>8}"
+    )
+    for name, detection_fps, reid_fps, agreement, similarity in rows:
+        print(
+            f"{name:<18} {detection_fps:>12.1f} {reid_fps:>12.1f} "
+            f"{agreement:>9.3f} {similarity:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--video", required=True)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        choices=["pytorch", "onnxruntime", "openvino"],
+        default=["pytorch", "onnxruntime", "openvino"],
+    )
+    parser.add_argument("--int8", action="store_true")
+    parser.add_argument("--detector", default="yolov8n.pt")
+    parser.add_argument("--reid-model", default="models/osnet_x1_0.pth")
+    parser.add_argument("--calibration-folder", default="users")
+    run(parser.parse_args())
@@ -0,0 +1,145 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+Benchmark of the compiled FramePreprocessor against process_frame.
+
+Both run over the same frames with the camera settings of a settings file,
+or with every adjustment enabled when no file is given. The benchmark
+reports the time per frame of each and the largest pixel difference
+between their outputs.
+
+Usage:
+    python benchmarks/preprocess_benchmark.py \
+        --settings ../../../../settings.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from video_processing import FramePreprocessor, process_frame  # noqa: E402
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "brightness": 60,
+    "exposure": 45,
+    "contrast": 65,
+    "saturation": 70,
+    "mirror_x": 1,
+    "mirror_y": 0,
+    "clahe": 1,
+    "clahe_clip_limit": 40,
+    "rotation": 0,
+    "resolution": [1280, 720],
+}
+
+
+def load_frames(video, count, size):
+    """
+    Read frames from a video file, or generate random frames.
+
+    Parameters:
+    video (str): Path of the video file, or None for random frames
+    count (int): Number of frames
+    size (tuple): Width and height of generated frames
+
+    Returns:
+    list: The frames
+    """
+    if video is None:
+        rng = np.random.default_rng(0)
+        return [
+            rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+            for _ in range(count)
+        ]
+    cap = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def time_per_frame(function, frames):
+    """
+    Time a preprocessing function over every frame.
+
+    Parameters:
+    function (callable): Function taking a frame
+    frames (list): Frames to process
+
+    Returns:
+    tuple: Milliseconds per frame and the processed frames
+    """
+    function(frames[0])
+    outputs = []
+    start = time.perf_counter()
+    for frame in frames:
+        outputs.append(function(frame))
+    return (time.perf_counter() - start) * 1000 / len(frames), outputs
+
+
+def run(args):
+    """
+    Run the benchmark.
+
+    Parameters:
+    args (argparse.Namespace): Parsed command line arguments
+    """
+    camera_settings = DEFAULT_SETTINGS
+    if args.settings is not None:
+        with open(args.settings) as file:
+            camera_settings = json.load(file)["camera"]
+    frames = load_frames(args.video, args.frames, (1920, 1080))
+    if not frames:
+        logger.error(f"No frames could be read from {args.video}")
+        return
+
+    logging.getLogger("video_processing").setLevel(logging.WARNING)
+    preprocessor = FramePreprocessor(camera_settings)
+    kwargs = {
+        name: camera_settings[name]
+        for name in FramePreprocessor.SETTING_KEYS
+        if name in camera_settings
+    }
+    if kwargs.get("resolution") is not None:
+        kwargs["resolution"] = tuple(kwargs["resolution"])
+
+    reference_ms, reference = time_per_frame(
+        lambda frame: process_frame(frame, **kwargs), frames
+    )
+    compiled_ms, compiled = time_per_frame(preprocessor, frames)
+    difference = max(
+        int(np.abs(a.astype(np.int16) - b).max())
+        for a, b in zip(reference, compiled)
+    )
+
+    print(f"{'function':<20} {'ms/frame':>9}")
+    print(f"{'process_frame':<20} {reference_ms:>9.2f}")
+    print(f"{'FramePreprocessor':<20} {compiled_ms:>9.2f}")
+    print(
+        f"speedup {reference_ms / compiled_ms:.2f}x, "
+        f"max difference {difference}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--settings", default=None)
+    parser.add_argument("--video", default=None)
+    parser.add_argument("--frames", type=int, default=100)
+    run(parser.parse_args())
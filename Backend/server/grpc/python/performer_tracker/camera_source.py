@@ -0,0 +1,235 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides a CameraSource class that grabs frames continuously on
+its own thread and only ever serves the newest frame, so a slow consumer
+never processes frames that have been sitting in the capture buffer.
+
+A video file path can be used instead of a camera, which is played back at
+its recorded frame rate so that it behaves like a live camera.
+"""
+
+import cv2
+import logging
+import threading
+import time
+from pipeline import StageStats
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CameraSource:
+    """
+    A camera or video file source that always exposes the newest frame.
+    """
+
+    def __init__(
+        self,
+        source,
+        buffer_size: int = 1,
+        fourcc: str = "MJPG",
+        resolution: tuple = None,
+        max_retries: int = 5,
+        loop: bool = False,
+    ):
+        """
+        Initialize the CameraSource.
+
+        Parameters:
+        source (int or str): Camera device index or video file path
+        buffer_size (int): Number of frames buffered by the capture backend
+                           (default is 1)
+        fourcc (str): Four character code requested from the camera, or None
+                      to keep the backend default (default is "MJPG")
+        resolution (tuple): Capture resolution as (width, height) (optional)
+        max_retries (int): Consecutive failed reads before the camera is
+                           considered lost (default is 5)
+        loop (bool): Restart a video file when it ends (default is False)
+        """
+        self.source = source
+        self.is_file = isinstance(source, str) and not source.isdigit()
+        self.buffer_size = buffer_size
+        self.fourcc = fourcc
+        self.resolution = resolution
+        self.max_retries = max_retries
+        self.loop = loop
+        self.cap = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.condition = threading.Condition()
+        self.frame = None
+        self.capture_time = None
+        self.frame_count = -1
+        self.served_count = -1
+        self.dropped = 0
+        self.stats = StageStats("capture")
+
+    def open(self):
+        """
+        Open the capture and apply the low latency settings the backend
+        supports.
+        """
+        source = self.source
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+        self.cap = cv2.VideoCapture(source)
+        if not self.cap.isOpened():
+            raise IOError(f"Unable to open video source {self.source}")
+
+        if not self.is_file:
+            if not self.cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size):
+                logger.debug("Capture backend ignored the buffer size")
+            if self.fourcc and not self.cap.set(
+                cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc)
+            ):
+                logger.debug(f"Capture backend ignored FOURCC {self.fourcc}")
+            if self.resolution is not None:
+                self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.resolution[0])
+                self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.resolution[1])
+
+        logger.info(f"Opened video source {self.source}")
+
+    def read_frames(self, count: int) -> list:
+        """
+        Read the first frames of the source before it is started, for
+        example to calibrate a model on them. The capture is released
+        afterwards.
+
+        Parameters:
+        count (int): Maximum number of frames to read
+
+        Returns:
+        list: The frames read
+        """
+        frames = []
+        try:
+            self.open()
+            while len(frames) < count:
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                frames.append(frame)
+        except IOError as e:
+            logger.warning(f"Failed to read frames: {e}")
+        finally:
+            if self.cap is not None:
+                self.cap.release()
+                self.cap = None
+        return frames
+
+    def start(self):
+        """
+        Open the source and start grabbing frames on a separate thread.
+        """
+        self.open()
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self._grab_frames, name="capture", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop grabbing frames and release the capture.
+        """
+        self.stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def is_running(self) -> bool:
+        """
+        Check whether frames are still being grabbed.
+
+        Returns:
+        bool: True if the grab thread is running
+        """
+        return self.thread is not None and self.thread.is_alive()
+
+    def _grab_frames(self):
+        """
+        Grab frames until stopped, keeping only the newest one.
+        """
+        frame_interval = 0
+        if self.is_file:
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            frame_interval = 1.0 / fps if fps > 0 else 0
+        next_frame_time = time.monotonic()
+        retry_count = 0
+
+        while not self.stop_event.is_set():
+            start_time = time.monotonic()
+            ret, frame = self.cap.read()
+            if not ret:
+                if self.is_file and self.loop:
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                if self.is_file:
+                    logger.info("Video file ended")
+                    break
+                retry_count += 1
+                logger.error(
+                    "Video feed is empty, retrying... "
+                    f"({retry_count}/{self.max_retries})"
+                )
+                if retry_count >= self.max_retries:
+                    logger.error("Maximum retries reached. Exiting.")
+                    break
+                continue
+
+            retry_count = 0
+            capture_time = time.monotonic()
+            self.stats.record(start_time, capture_time)
+            with self.condition:
+                if self.frame_count > self.served_count:
+                    self.dropped += 1
+                self.frame = frame
+                self.capture_time = capture_time
+                self.frame_count += 1
+                self.condition.notify_all()
+
+            if frame_interval:
+                # Play files back in real time, like a camera would
+                next_frame_time = max(
+                    next_frame_time + frame_interval, start_time
+                )
+                self.stop_event.wait(next_frame_time - time.monotonic())
+
+        with self.condition:
+            self.condition.notify_all()
+
+    def get(self, timeout: float = None):
+        """
+        Get the newest frame that has not been served yet.
+
+        Parameters:
+        timeout (float): Seconds to wait for a new frame (default is None,
+                         which waits until a frame arrives or the source
+                         stops)
+
+        Returns:
+        dict: Packet with the frame count, monotonic capture time and frame,
+              or None if no new frame arrived in time
+        """
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.frame_count > self.served_count
+                or not self.is_running(),
+                timeout=timeout,
+            )
+            if self.frame_count <= self.served_count:
+                return None
+            self.served_count = self.frame_count
+            return {
+                "frame_count": self.frame_count,
+                "capture_time": self.capture_time,
+                "frame": self.frame,
+            }
@@ -0,0 +1,156 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides an ImageWriter class that encodes and saves person
+crops on a pool of background threads, so that JPEG encoding and disk writes
+never run on the identity stage.
+
+Crops are saved at most once per interval per identity, and are dropped
+rather than queued when the writers cannot keep up.
+"""
+
+import cv2
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class ImageWriter:
+    """
+    A pool of threads writing person crops to the database folders.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 2,
+        max_queue_size: int = 32,
+        jpeg_quality: int = 90,
+        min_interval: float = 1.0,
+    ):
+        """
+        Initialize the ImageWriter.
+
+        Parameters:
+        num_workers (int): Number of writer threads (default is 2)
+        max_queue_size (int): Crops waiting to be written before new crops
+                              are dropped (default is 32)
+        jpeg_quality (int): JPEG quality from 0 to 100 (default is 90)
+        min_interval (float): Minimum seconds between two saved crops of
+                              the same identity (default is 1.0)
+        """
+        self.num_workers = num_workers
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)]
+        self.min_interval = min_interval
+        self.last_saved = {}
+        self.threads = []
+        self.lock = threading.Lock()
+        self.written = 0
+        self.failed = 0
+        self.dropped_overload = 0
+        self.dropped_rate = 0
+
+    def start(self):
+        """
+        Start the writer threads.
+        """
+        for i in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._write_loop, name=f"image_writer_{i}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """
+        Write the queued crops and stop the writer threads.
+        """
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, person_image, identity: str, folder: str) -> bool:
+        """
+        Queue a crop to be saved in the identity's folder without blocking.
+
+        Parameters:
+        person_image (np.ndarray): Cropped image of the person
+        identity (str): Identity the crop belongs to
+        folder (str): Database folder holding the identity folders
+
+        Returns:
+        bool: True if the crop was queued, False if it was dropped
+        """
+        now = time.monotonic()
+        key = (folder, identity)
+        with self.lock:
+            last_saved = self.last_saved.get(key)
+            if last_saved is not None and now - last_saved < self.min_interval:
+                self.dropped_rate += 1
+                return False
+            self.last_saved[key] = now
+
+        try:
+            # Copy the crop, as it is a view into the frame
+            self.queue.put_nowait(
+                (person_image.copy(), os.path.join(folder, identity))
+            )
+        except queue.Full:
+            with self.lock:
+                self.dropped_overload += 1
+            return False
+        return True
+
+    def _write_loop(self):
+        """
+        Encode and write queued crops until a stop marker is received.
+        """
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            person_image, identity_folder = item
+            try:
+                # Folders can be moved by gallery maintenance at any time
+                os.makedirs(identity_folder, exist_ok=True)
+                ok, encoded = cv2.imencode(
+                    ".jpg", person_image, self.encode_params
+                )
+                if not ok:
+                    raise ValueError("JPEG encoding failed")
+                path = os.path.join(identity_folder, f"{uuid.uuid4()}.jpg")
+                with open(path, "wb") as file:
+                    file.write(encoded.tobytes())
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to save image to {identity_folder}: {e}")
+                with self.lock:
+                    self.failed += 1
+                continue
+            with self.lock:
+                self.written += 1
+
+    def get_stats(self) -> dict:
+        """
+        Get the number of crops written and dropped.
+
+        Returns:
+        dict: Written, failed and dropped counts and the queue length
+        """
+        with self.lock:
+            return {
+                "written": self.written,
+                "failed": self.failed,
+                "dropped_overload": self.dropped_overload,
+                "dropped_rate": self.dropped_rate,
+                "queued": self.queue.qsize(),
+            }
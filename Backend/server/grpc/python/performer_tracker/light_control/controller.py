@@ -30,27 +30,39 @@ class LightController:
         universe_id (int): The ID of the universe to control
         """
         self.node = ArtNetNode(node_ip, port=port)
+        self.universe_id = universe_id
         self.universe = self.node.add_universe(universe_id)
+        self.universes = {universe_id: self.universe}
         self.channels = {}
         logger.info(
             f"LightController initialized with IP: {node_ip}, Port: {port}, "
             f"Universe: {universe_id}"
         )
 
-    def add_channel(self, name: str, start: int, width: int = 1):
+    def add_channel(
+        self, name: str, start: int, width: int = 1, universe_id: int = None
+    ):
         """
-        Add a channel to the universe.
+        Add a channel to a universe, adding the universe to the node if it
+        is new.
 
         Parameters:
         name (str): The name of the channel
         start (int): The start address of the channel
         width (int): The width of the channel (default is 1)
+        universe_id (int): The ID of the universe (default is the universe
+                           the controller was created with)
         """
-        self.channels[name] = self.universe.add_channel(
-            start=start, width=width
-        )
+        if universe_id is None:
+            universe_id = self.universe_id
+        universe = self.universes.get(universe_id)
+        if universe is None:
+            universe = self.node.add_universe(universe_id)
+            self.universes[universe_id] = universe
+        self.channels[name] = universe.add_channel(start=start, width=width)
         logger.info(
-            f"Added channel {name} starting at {start} with width {width}"
+            f"Added channel {name} in universe {universe_id} starting at "
+            f"{start} with width {width}"
         )
 
     def set_channel_values(self, name: str, values: list):
@@ -66,3 +78,12 @@ class LightController:
             logger.debug(f"Set values for channel {name}: {values}")
         else:
             logger.warning(f"Channel {name} not found. Unable to set values.")
+
+    def send(self):
+        """
+        Send the buffer of every universe as one Art-Net frame each. Channel
+        values set since the last send go out together, instead of on the
+        node's own refresh timing.
+        """
+        for universe in self.universes.values():
+            universe.send_data()
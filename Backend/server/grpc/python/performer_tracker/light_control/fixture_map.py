@@ -0,0 +1,246 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module contains the FixtureMap class, which patches moving head
+fixtures into an Art-Net node and points each of them at the performer it
+is assigned to. Pan and tilt are calculated for all fixtures at once, and
+the channel values are written into the universe buffers, so adding a
+fixture adds no network sends.
+
+Fixtures are configured as a list under
+settings["performer_tracker"]["fixtures"], for example:
+    {"name": "spot_left", "universe": 0, "address": 1,
+     "position": [3048, 0, 4500], "max_pan": 540, "max_tilt": 246,
+     "performer": "3"}
+Each fixture may also set "channels", the offsets of its pan, tilt,
+shutter and dimmer channels from its address (1-based), and "shutter" and
+"dimmer", the values they are opened with.
+
+The beams can optionally be moved towards their targets with proportional
+control, and have their angular speed limited, to smooth out jitter in the
+tracked positions.
+"""
+
+import logging
+import numpy as np
+
+from light_control.pan_tilt_calculator import (
+    LightPositionUpdater,
+    PanTiltCalculator,
+)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANNELS = {"shutter": 1, "dimmer": 2, "pan": 18, "tilt": 20}
+SHUTTER_OPEN = 25
+DIMMER_FULL = 255
+
+
+class FixtureMap:
+    """
+    Moving head fixtures, each following an assigned performer.
+    """
+
+    def __init__(self, fixtures: list, kp: float = None, max_slew=None):
+        """
+        Initialize the FixtureMap.
+
+        Parameters:
+        fixtures (list): Fixture settings, as described in the module
+                         documentation
+        kp (float): Proportional gain moving the beams towards their
+                    targets each tick, or None to jump straight to them
+                    (default is None)
+        max_slew (float): Largest beam speed in degrees per second, or
+                          None for no limit (default is None)
+        """
+        self.kp = kp
+        self.max_slew = max_slew
+        self.fixtures = []
+        for index, fixture in enumerate(fixtures):
+            self.fixtures.append(
+                {
+                    "name": fixture.get("name", f"fixture_{index}"),
+                    "universe": fixture.get("universe", 0),
+                    "address": fixture.get("address", 1),
+                    "channels": {
+                        **DEFAULT_CHANNELS,
+                        **fixture.get("channels", {}),
+                    },
+                    "shutter": fixture.get("shutter", SHUTTER_OPEN),
+                    "dimmer": fixture.get("dimmer", DIMMER_FULL),
+                }
+            )
+        self.origins = np.array(
+            [fixture["position"] for fixture in fixtures], dtype=np.float64
+        ).reshape(-1, 3)
+        self.max_pan = np.array(
+            [fixture["max_pan"] for fixture in fixtures], dtype=np.float64
+        )
+        self.max_tilt = np.array(
+            [fixture["max_tilt"] for fixture in fixtures], dtype=np.float64
+        )
+        self.performers = [str(fixture["performer"]) for fixture in fixtures]
+        # Angles the beams were last sent to, NaN before their first target
+        self.pan = np.full(len(self.fixtures), np.nan)
+        self.tilt = np.full(len(self.fixtures), np.nan)
+        logger.info(
+            f"Fixture map with {len(self.fixtures)} fixtures following "
+            f"performers {sorted(set(self.performers))}"
+        )
+
+    def __len__(self):
+        return len(self.fixtures)
+
+    @classmethod
+    def from_settings(cls, performer_settings: dict):
+        """
+        Build the fixture map from the performer tracker settings. Without
+        a fixture list, the single fixture of the light_* settings follows
+        the tracked user.
+
+        Parameters:
+        performer_settings (dict): settings["performer_tracker"]
+
+        Returns:
+        FixtureMap: The fixture map
+        """
+        kp = None
+        if performer_settings.get("light_p_control", False):
+            kp = performer_settings.get("kp", 0.5)
+        fixtures = performer_settings.get("fixtures")
+        if not fixtures:
+            fixtures = [
+                {
+                    "name": "light",
+                    "universe": performer_settings["light_universe_id"],
+                    "position": performer_settings["light_coords"],
+                    "max_pan": performer_settings["max_pan"],
+                    "max_tilt": performer_settings["max_tilt"],
+                    "performer": performer_settings["tracked_user_id"],
+                }
+            ]
+        return cls(
+            fixtures,
+            kp=kp,
+            max_slew=performer_settings.get("light_max_slew"),
+        )
+
+    def patch(self, controller):
+        """
+        Add the channels of every fixture to a light controller, named
+        "<fixture>.<channel>".
+
+        Parameters:
+        controller (LightController): The light controller
+        """
+        for fixture in self.fixtures:
+            for channel, offset in fixture["channels"].items():
+                controller.add_channel(
+                    f"{fixture['name']}.{channel}",
+                    start=fixture["address"] + offset - 1,
+                    universe_id=fixture["universe"],
+                )
+
+    def steer(self, indices: list, pan, tilt, dt: float) -> tuple:
+        """
+        Move the beams of some fixtures towards their target angles, with
+        the configured proportional control and slew rate limit.
+
+        Parameters:
+        indices (list): Indices of the fixtures
+        pan (np.ndarray): Target pan angles
+        tilt (np.ndarray): Target tilt angles
+        dt (float): Seconds since the previous tick
+
+        Returns:
+        tuple: Pan and tilt angles to send
+        """
+        current_pan = self.pan[indices]
+        current_tilt = self.tilt[indices]
+        # Beams without a previous angle go straight to their target
+        first = np.isnan(current_pan)
+        current_pan[first] = pan[first]
+        current_tilt[first] = tilt[first]
+
+        new_pan, new_tilt = pan, tilt
+        if self.kp is not None:
+            new_pan, new_tilt = LightPositionUpdater.update_light_position(
+                current_pan, current_tilt, pan, tilt, self.kp
+            )
+        if self.max_slew is not None:
+            step = self.max_slew * dt
+            new_pan = current_pan + np.clip(new_pan - current_pan, -step, step)
+            new_tilt = current_tilt + np.clip(
+                new_tilt - current_tilt, -step, step
+            )
+
+        self.pan[indices] = new_pan
+        self.tilt[indices] = new_tilt
+        return new_pan, new_tilt
+
+    def compute(self, targets: dict, dt: float = 0.0) -> tuple:
+        """
+        Calculate the pan and tilt DMX values of every fixture whose
+        performer has a target.
+
+        Parameters:
+        targets (dict): Performer ID to target (x, y, z) coordinates
+        dt (float): Seconds since the previous tick, used by the slew rate
+                    limit (default is 0)
+
+        Returns:
+        tuple: Indices of the fixtures with a target, and their pan and
+               tilt DMX values
+        """
+        indices = [
+            index
+            for index, performer in enumerate(self.performers)
+            if performer in targets
+        ]
+        if not indices:
+            return [], np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        points = np.array(
+            [targets[self.performers[index]] for index in indices],
+            dtype=np.float64,
+        )
+        pan, tilt = PanTiltCalculator.calculate_pan_tilt_batch(
+            self.origins[indices], points
+        )
+        pan, tilt = self.steer(indices, pan, tilt, dt)
+        pan_dmx = PanTiltCalculator.angles_to_dmx(pan, self.max_pan[indices])
+        tilt_dmx = PanTiltCalculator.angles_to_dmx(
+            tilt + 90, self.max_tilt[indices]
+        )
+        return indices, pan_dmx, tilt_dmx
+
+    def apply(self, controller, targets: dict, dt: float = 0.0) -> int:
+        """
+        Point every fixture whose performer has a target at it, writing the
+        channel values into the universe buffers of a light controller.
+        Fixtures without a target keep their last position.
+
+        Parameters:
+        controller (LightController): The light controller the fixtures
+                                      are patched into
+        targets (dict): Performer ID to target (x, y, z) coordinates
+        dt (float): Seconds since the previous tick (default is 0)
+
+        Returns:
+        int: Number of fixtures updated
+        """
+        indices, pan_dmx, tilt_dmx = self.compute(targets, dt)
+        for index, pan, tilt in zip(indices, pan_dmx, tilt_dmx):
+            name = self.fixtures[index]["name"]
+            controller.set_channel_values(f"{name}.pan", [int(pan)])
+            controller.set_channel_values(f"{name}.tilt", [int(tilt)])
+            controller.set_channel_values(
+                f"{name}.shutter", [self.fixtures[index]["shutter"]]
+            )
+            controller.set_channel_values(
+                f"{name}.dimmer", [self.fixtures[index]["dimmer"]]
+            )
+        return len(indices)
@@ -9,6 +9,7 @@ on these values.
 
 import math
 import logging
+import numpy as np
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -101,6 +102,61 @@ class PanTiltCalculator:
         """
         return PanTiltCalculator.angle_to_dmx(tilt_angle + 90, max_tilt)
 
+    @staticmethod
+    def calculate_pan_tilt_batch(
+        origins: np.ndarray, targets: np.ndarray
+    ) -> tuple:
+        """
+        Calculate the pan and tilt angles of several fixtures at once, each
+        pointing from its origin to its target.
+
+        Parameters:
+        origins (np.ndarray): Fixture coordinates of shape (N, 3)
+        targets (np.ndarray): Target coordinates of shape (N, 3)
+
+        Returns:
+        tuple: Pan and tilt angles in degrees, each of shape (N,)
+        """
+        delta = np.asarray(targets, dtype=np.float64) - origins
+        distance = np.linalg.norm(delta, axis=1)
+        pan = np.degrees(np.arctan2(delta[:, 1], delta[:, 0]))
+        # A target at the fixture itself is treated as level
+        tilt = np.degrees(
+            np.arcsin(
+                np.divide(
+                    delta[:, 2],
+                    distance,
+                    out=np.zeros_like(distance),
+                    where=distance > 0,
+                )
+            )
+        )
+        return pan, tilt
+
+    @staticmethod
+    def angles_to_dmx(
+        angles: np.ndarray,
+        max_angles: np.ndarray,
+        min_dmx: int = 0,
+        max_dmx: int = 255,
+    ) -> np.ndarray:
+        """
+        Convert several angles to DMX values, clipped to the DMX range.
+
+        Parameters:
+        angles (np.ndarray): The angles to convert
+        max_angles (np.ndarray): The maximum angle of each fixture
+        min_dmx (int): The minimum DMX value (default is 0)
+        max_dmx (int): The maximum DMX value (default is 255)
+
+        Returns:
+        np.ndarray: The corresponding DMX values
+        """
+        dmx_values = (angles + max_angles / 2) / max_angles * (
+            max_dmx - min_dmx
+        ) + min_dmx
+        return np.clip(dmx_values.astype(int), min_dmx, max_dmx)
+
 
 class LightPositionUpdater:
     """
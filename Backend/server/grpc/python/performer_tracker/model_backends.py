@@ -0,0 +1,499 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides the inference backends of the performer tracker. The
+YOLO detector and the OSNet ReID model can run in PyTorch, or be exported
+once and run through ONNX Runtime or OpenVINO, optionally quantized to int8.
+
+Exported models are written next to the original weights and reused on the
+next start. OSNet exports are named after a fingerprint of the weights, so
+they are exported again when the weights change. int8 models are calibrated
+on sample inputs, camera frames for the detector and database crops for
+OSNet, and the float model is used when there are none.
+
+ONNX Runtime, OpenVINO and NNCF are optional dependencies, only imported
+when the backend that needs them is selected.
+"""
+
+import logging
+import os
+import cv2
+import numpy as np
+from ultralytics import YOLO
+from utils.homography import seg_to_bbox
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("pytorch", "onnxruntime", "openvino")
+EXPORT_FORMATS = {"onnxruntime": "onnx", "openvino": "openvino"}
+ONNX_OPSET = 17
+CALIBRATION_SIZE = 300
+DETECTOR_CALIBRATION_SIZE = 100
+LETTERBOX_COLOR = (114, 114, 114)
+
+
+def check_backend(backend: str):
+    """
+    Check that a backend name is supported.
+
+    Parameters:
+    backend (str): Name of the backend
+
+    Raises:
+    ValueError: If the backend is not supported
+    """
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend {backend}, expected one of {BACKENDS}"
+        )
+
+
+def quantize_onnx(source: str, target: str, calibration_batches):
+    """
+    Quantize an ONNX model to int8 with static QDQ quantization, calibrated
+    on sample inputs. Weights are quantized per channel to int8 and
+    activations to uint8, which ONNX Runtime's CPU provider fuses into
+    QLinearConv kernels. Dynamic quantization is avoided, since it turns
+    convolutions into ConvInteger nodes that are slower than float.
+
+    Parameters:
+    source (str): Path of the float ONNX model
+    target (str): Path to write the quantized model to
+    calibration_batches (iterable): Preprocessed input batches
+
+    Returns:
+    bool: True if the model was quantized, False if there was no
+          calibration data
+    """
+    import onnxruntime
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+
+    input_name = onnxruntime.InferenceSession(
+        source, providers=["CPUExecutionProvider"]
+    ).get_inputs()[0].name
+    batches = iter(calibration_batches)
+    first = next(batches, None)
+    if first is None:
+        logger.warning(
+            f"No calibration images to quantize {source}, using the float "
+            "model"
+        )
+        return False
+
+    class BatchReader(CalibrationDataReader):
+        def __init__(self):
+            self.pending = first
+
+        def get_next(self):
+            batch, self.pending = self.pending, None
+            if batch is None:
+                batch = next(batches, None)
+            return None if batch is None else {input_name: batch}
+
+    quantize_static(
+        source,
+        target,
+        BatchReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    logger.info(f"Quantized {source} to {target}")
+    return True
+
+
+def letterbox(image: np.ndarray, size: int) -> np.ndarray:
+    """
+    Resize an image to fit a square, keeping its aspect ratio and padding
+    the rest the way the YOLO predictor does.
+
+    Parameters:
+    image (np.ndarray): BGR image
+    size (int): Side of the square
+
+    Returns:
+    np.ndarray: Letterboxed BGR image of shape (size, size, 3)
+    """
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    resized_width = max(int(round(width * scale)), 1)
+    resized_height = max(int(round(height * scale)), 1)
+    resized = cv2.resize(
+        image, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR
+    )
+    top = (size - resized_height) // 2
+    left = (size - resized_width) // 2
+    return cv2.copyMakeBorder(
+        resized,
+        top,
+        size - resized_height - top,
+        left,
+        size - resized_width - left,
+        cv2.BORDER_CONSTANT,
+        value=LETTERBOX_COLOR,
+    )
+
+
+def folder_frames(folder: str):
+    """
+    Read the images of a folder, searched recursively.
+
+    Parameters:
+    folder (str): Folder to read images from
+
+    Yields:
+    np.ndarray: BGR image
+    """
+    if folder is None or not os.path.isdir(folder):
+        return
+    for root, _, files in os.walk(folder):
+        for img_name in sorted(files):
+            img = cv2.imread(os.path.join(root, img_name))
+            if img is not None:
+                yield img
+
+
+def detector_calibration_batches(frames, imgsz: int):
+    """
+    Preprocess frames into detector inputs, for calibrating a quantized
+    detector. Frames are consumed lazily, one batch at a time.
+
+    Parameters:
+    frames (iterable): BGR frames as the detector is given them
+    imgsz (int): Input size of the detector
+
+    Yields:
+    np.ndarray: Batch of one frame of shape (1, 3, imgsz, imgsz)
+    """
+    for frame in frames:
+        rgb = cv2.cvtColor(letterbox(frame, imgsz), cv2.COLOR_BGR2RGB)
+        batch = rgb.transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+        yield np.ascontiguousarray(batch)
+
+
+def load_detector(
+    model_path: str = "yolov8n.pt",
+    backend: str = "pytorch",
+    int8: bool = False,
+    imgsz: int = 640,
+    calibration_frames=None,
+):
+    """
+    Load the YOLO detector for a backend, exporting it on first use.
+
+    Parameters:
+    model_path (str): Path of the PyTorch YOLO weights, a "-seg" model
+                      for segmentation (default is "yolov8n.pt")
+    backend (str): "pytorch", "onnxruntime" or "openvino" (default is
+                   "pytorch")
+    int8 (bool): Use an int8 quantized model (default is False)
+    imgsz (int): Input size the model is exported for (default is 640)
+    calibration_frames (callable): Function returning the BGR frames an
+                                   int8 ONNX Runtime model is calibrated
+                                   on, as the detector is given them. Only
+                                   called when quantizing. Without frames
+                                   the float model is used (optional)
+
+    Returns:
+    YOLO: The detector, usable with track() for every backend
+    """
+    check_backend(backend)
+    if backend == "pytorch":
+        if int8:
+            logger.warning("int8 is not supported by the PyTorch backend")
+        return YOLO(model_path)
+
+    stem = os.path.splitext(model_path)[0]
+    task = "segment" if "-seg" in os.path.basename(stem) else "detect"
+    suffix = "_int8" if int8 else ""
+    if backend == "onnxruntime":
+        exported = f"{stem}.onnx"
+        target = f"{stem}{suffix}.onnx"
+    else:
+        exported = target = f"{stem}{suffix}_openvino_model"
+
+    if not os.path.exists(target):
+        if not os.path.exists(exported):
+            logger.info(f"Exporting {model_path} for {backend}")
+            exported = YOLO(model_path).export(
+                format=EXPORT_FORMATS[backend],
+                imgsz=imgsz,
+                int8=int8 and backend == "openvino",
+            )
+        if backend == "onnxruntime" and int8:
+            quantize_onnx(
+                exported,
+                target,
+                detector_calibration_batches(
+                    calibration_frames() if calibration_frames else [], imgsz
+                ),
+            )
+        target = target if os.path.exists(target) else exported
+
+    logger.info(f"Loading {target} with {backend}")
+    return YOLO(target, task=task)
+
+
+def extract_tracks(result, stage_roi=None):
+    """
+    Get the tracked people of a YOLO tracker result in full-frame
+    coordinates.
+
+    Detection models give the boxes directly. Segmentation models give the
+    tighter bounds of each segmentation polygon instead, falling back to
+    the tracker box for empty polygons.
+
+    Parameters:
+    result (ultralytics.engine.results.Results): Tracker result
+    stage_roi (StageROI): Stage region the detector ran on, or None if it
+                          ran on the full frame (default is None)
+
+    Returns:
+    tuple: Track IDs and bounding boxes as (x1, y1, x2, y2), empty if
+           nothing is tracked
+    """
+    if result.boxes.id is None:
+        return [], []
+    track_ids = result.boxes.id.int().cpu().tolist()
+    boxes = result.boxes.xyxy.cpu().numpy()
+    if result.masks is not None:
+        boxes = np.array(
+            [
+                seg_to_bbox(mask) if len(mask) else box
+                for mask, box in zip(result.masks.xy, boxes)
+            ],
+            dtype=np.float32,
+        )
+    if stage_roi is not None:
+        boxes = stage_roi.to_frame_boxes(boxes)
+    return track_ids, boxes
+
+
+class TorchReIDBackend:
+    """
+    Runs the OSNet model in PyTorch.
+    """
+
+    quantized = False
+
+    def __init__(self, model):
+        """
+        Initialize the TorchReIDBackend.
+
+        Parameters:
+        model (torch.nn.Module): The OSNet model in evaluation mode
+        """
+        import torch
+
+        self.torch = torch
+        self.model = model
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Extract features from a preprocessed batch.
+
+        Parameters:
+        batch (np.ndarray): Batch of shape (N, 3, 256, 128)
+
+        Returns:
+        np.ndarray: Features of shape (N, 512)
+        """
+        with self.torch.no_grad():
+            return self.model(self.torch.from_numpy(batch)).numpy()
+
+
+class OnnxReIDBackend:
+    """
+    Runs an exported OSNet model in ONNX Runtime.
+    """
+
+    def __init__(self, path: str, quantized: bool = False):
+        """
+        Initialize the OnnxReIDBackend.
+
+        Parameters:
+        path (str): Path of the ONNX model
+        quantized (bool): Whether the model is quantized to int8 (default
+                          is False)
+        """
+        import onnxruntime
+
+        self.quantized = quantized
+
+        self.session = onnxruntime.InferenceSession(
+            path, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Extract features from a preprocessed batch.
+
+        Parameters:
+        batch (np.ndarray): Batch of shape (N, 3, 256, 128)
+
+        Returns:
+        np.ndarray: Features of shape (N, 512)
+        """
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVINOReIDBackend:
+    """
+    Runs an exported OSNet model in OpenVINO.
+    """
+
+    def __init__(self, path: str, quantized: bool = False):
+        """
+        Initialize the OpenVINOReIDBackend.
+
+        Parameters:
+        path (str): Path of the OpenVINO IR model (.xml)
+        quantized (bool): Whether the model is quantized to int8 (default
+                          is False)
+        """
+        import openvino
+
+        self.quantized = quantized
+
+        self.model = openvino.Core().compile_model(path, "CPU")
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Extract features from a preprocessed batch.
+
+        Parameters:
+        batch (np.ndarray): Batch of shape (N, 3, 256, 128)
+
+        Returns:
+        np.ndarray: Features of shape (N, 512)
+        """
+        return self.model(batch)[0]
+
+
+def export_osnet_onnx(model, path: str, input_size: tuple):
+    """
+    Export the OSNet model to ONNX with a dynamic batch size.
+
+    Parameters:
+    model (torch.nn.Module): The OSNet model in evaluation mode
+    path (str): Path to write the ONNX model to
+    input_size (tuple): Input width and height
+    """
+    import torch
+
+    dummy = torch.zeros((1, 3, input_size[1], input_size[0]))
+    torch.onnx.export(
+        model,
+        dummy,
+        path,
+        input_names=["input"],
+        output_names=["features"],
+        dynamic_axes={"input": {0: "batch"}, "features": {0: "batch"}},
+        opset_version=ONNX_OPSET,
+    )
+    logger.info(f"Exported OSNet to {path}")
+
+
+def export_osnet_openvino(
+    onnx_path: str, path: str, int8: bool, calibration_batches: list
+):
+    """
+    Convert the ONNX OSNet model to OpenVINO IR, optionally quantized to
+    int8 with NNCF.
+
+    Parameters:
+    onnx_path (str): Path of the ONNX model
+    path (str): Path to write the IR model (.xml) to
+    int8 (bool): Quantize the model to int8
+    calibration_batches (list): Preprocessed batches used to calibrate the
+                                int8 model, required when int8 is set
+    """
+    import openvino
+
+    model = openvino.convert_model(onnx_path)
+    if int8:
+        import nncf
+
+        model = nncf.quantize(
+            model,
+            nncf.Dataset(calibration_batches),
+            subset_size=len(calibration_batches),
+        )
+    openvino.save_model(model, path)
+    logger.info(f"Exported OSNet to {path}")
+
+
+def load_reid_backend(
+    model,
+    model_path: str,
+    fingerprint: str,
+    backend: str = "pytorch",
+    int8: bool = False,
+    input_size: tuple = (128, 256),
+    calibration_batches=None,
+):
+    """
+    Load the OSNet model for a backend, exporting it on first use.
+
+    Parameters:
+    model (torch.nn.Module): The OSNet model in evaluation mode
+    model_path (str): Path of the PyTorch OSNet weights
+    fingerprint (str): Fingerprint of the weights, used to name exports
+    backend (str): "pytorch", "onnxruntime" or "openvino" (default is
+                   "pytorch")
+    int8 (bool): Use an int8 quantized model (default is False)
+    input_size (tuple): Input width and height (default is (128, 256))
+    calibration_batches (callable): Function returning preprocessed
+                                    batches to calibrate an int8 model,
+                                    only called when exporting one. Without
+                                    batches the float model is used
+                                    (optional)
+
+    Returns:
+    callable: Backend taking a preprocessed batch and returning features,
+              with a `quantized` attribute telling whether an int8 model
+              was loaded
+    """
+    check_backend(backend)
+    if backend == "pytorch":
+        if int8:
+            logger.warning("int8 is not supported by the PyTorch backend")
+        return TorchReIDBackend(model)
+
+    stem = f"{os.path.splitext(model_path)[0]}.{fingerprint[:8]}"
+    suffix = "_int8" if int8 else ""
+    onnx_path = f"{stem}.onnx"
+    if not os.path.exists(onnx_path):
+        export_osnet_onnx(model, onnx_path, input_size)
+
+    if backend == "onnxruntime":
+        path = f"{stem}{suffix}.onnx"
+        if int8 and not os.path.exists(path):
+            batches = calibration_batches() if calibration_batches else []
+            if not quantize_onnx(onnx_path, path, batches):
+                path, int8 = onnx_path, False
+        return OnnxReIDBackend(path, quantized=int8)
+
+    path = f"{stem}{suffix}.xml"
+    batches = []
+    if int8 and not os.path.exists(path):
+        batches = calibration_batches() if calibration_batches else []
+        if not batches:
+            logger.warning(
+                f"No calibration images to quantize {onnx_path}, using the "
+                "float model"
+            )
+            path, int8 = f"{stem}.xml", False
+    if not os.path.exists(path):
+        export_osnet_openvino(onnx_path, path, int8, batches)
+    return OpenVINOReIDBackend(path, quantized=int8)
@@ -0,0 +1,247 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides a constant-velocity Kalman filter per track, used to
+propagate performer positions on stage between detections and to
+extrapolate them to the time light positions are sent.
+
+Positions are filtered in homography (stage) coordinates, where a
+performer's motion is closest to constant velocity. The error between the
+predicted and measured position is tracked, so the detection rate can be
+judged against how well the motion model covers the skipped frames.
+"""
+
+import logging
+import threading
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class KalmanTrack:
+    """
+    A constant-velocity Kalman filter over a 2D position.
+    """
+
+    def __init__(
+        self,
+        position,
+        timestamp: float,
+        process_noise: float,
+        measurement_noise: float,
+    ):
+        """
+        Initialize the KalmanTrack at a measured position.
+
+        Parameters:
+        position (np.ndarray): Measured (x, y) position
+        timestamp (float): Monotonic time of the measurement
+        process_noise (float): Acceleration noise, in units per second
+                               squared
+        measurement_noise (float): Measurement noise, in units
+        """
+        self.state = np.array(
+            [position[0], position[1], 0.0, 0.0], dtype=np.float64
+        )
+        self.covariance = np.diag(
+            [measurement_noise**2] * 2 + [(10 * measurement_noise) ** 2] * 2
+        )
+        self.timestamp = timestamp
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+
+    def _transition(self, dt: float) -> tuple:
+        """
+        Get the state transition and process noise over a time step.
+
+        Parameters:
+        dt (float): Time step in seconds
+
+        Returns:
+        tuple: Transition matrix and process noise covariance
+        """
+        transition = np.eye(4)
+        transition[0, 2] = transition[1, 3] = dt
+        # Piecewise white acceleration noise
+        q = self.process_noise**2
+        block = np.array(
+            [[dt**4 / 4, dt**3 / 2], [dt**3 / 2, dt**2]], dtype=np.float64
+        )
+        noise = np.zeros((4, 4))
+        noise[np.ix_([0, 2], [0, 2])] = block * q
+        noise[np.ix_([1, 3], [1, 3])] = block * q
+        return transition, noise
+
+    def predict(self, timestamp: float, max_horizon: float = None):
+        """
+        Predict the position at a time without changing the filter.
+
+        Parameters:
+        timestamp (float): Monotonic time to predict at
+        max_horizon (float): Longest time past the last measurement to
+                             extrapolate over, or None for no limit
+                             (default is None)
+
+        Returns:
+        np.ndarray: Predicted (x, y) position
+        """
+        dt = max(timestamp - self.timestamp, 0.0)
+        if max_horizon is not None:
+            dt = min(dt, max_horizon)
+        return self.state[:2] + self.state[2:] * dt
+
+    def velocity(self) -> np.ndarray:
+        """
+        Get the estimated velocity.
+
+        Returns:
+        np.ndarray: (vx, vy) in units per second
+        """
+        return self.state[2:].copy()
+
+    def update(self, position, timestamp: float):
+        """
+        Advance the filter to a measurement and correct it.
+
+        Parameters:
+        position (np.ndarray): Measured (x, y) position
+        timestamp (float): Monotonic time of the measurement
+        """
+        dt = max(timestamp - self.timestamp, 0.0)
+        transition, noise = self._transition(dt)
+        state = transition @ self.state
+        covariance = transition @ self.covariance @ transition.T + noise
+
+        innovation = np.asarray(position, dtype=np.float64) - state[:2]
+        innovation_covariance = covariance[:2, :2] + np.eye(2) * (
+            self.measurement_noise**2
+        )
+        gain = covariance[:, :2] @ np.linalg.inv(innovation_covariance)
+        self.state = state + gain @ innovation
+        self.covariance = covariance - gain @ covariance[:2, :]
+        self.timestamp = max(timestamp, self.timestamp)
+
+
+class MotionModel:
+    """
+    Kalman filters for every measured track, with prediction error
+    statistics.
+    """
+
+    def __init__(
+        self,
+        process_noise: float = 2000.0,
+        measurement_noise: float = 100.0,
+        smoothing: float = 0.1,
+    ):
+        """
+        Initialize the MotionModel.
+
+        Parameters:
+        process_noise (float): Acceleration noise in stage units per second
+                               squared (default is 2000)
+        measurement_noise (float): Measurement noise in stage units
+                                   (default is 100)
+        smoothing (float): Weight of the newest prediction error in its
+                           moving average (default is 0.1)
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.smoothing = smoothing
+        self.tracks = {}
+        self.prediction_error = None
+        self.lock = threading.Lock()
+
+    def update(self, track_id: int, position, timestamp: float):
+        """
+        Correct a track's filter with a measured position, recording how far
+        the prediction was from the measurement.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+        position (np.ndarray): Measured (x, y) position
+        timestamp (float): Monotonic capture time of the measurement
+        """
+        with self.lock:
+            track = self.tracks.get(track_id)
+            if track is None:
+                self.tracks[track_id] = KalmanTrack(
+                    position,
+                    timestamp,
+                    self.process_noise,
+                    self.measurement_noise,
+                )
+                return
+            error = float(np.linalg.norm(track.predict(timestamp) - position))
+            if self.prediction_error is None:
+                self.prediction_error = error
+            else:
+                self.prediction_error += self.smoothing * (
+                    error - self.prediction_error
+                )
+            track.update(position, timestamp)
+
+    def predict(
+        self, track_id: int, timestamp: float, max_horizon: float = None
+    ):
+        """
+        Predict a track's position at a time.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+        timestamp (float): Monotonic time to predict at
+        max_horizon (float): Longest time past the last measurement to
+                             extrapolate over, or None for no limit
+                             (default is None)
+
+        Returns:
+        np.ndarray: Predicted (x, y) position, or None if the track has no
+                    measurements
+        """
+        with self.lock:
+            track = self.tracks.get(track_id)
+            if track is None:
+                return None
+            return track.predict(timestamp, max_horizon)
+
+    def last_measurement(self, track_id: int):
+        """
+        Get the capture time of a track's newest measurement.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+
+        Returns:
+        float: Monotonic capture time, or None if the track has no
+               measurements
+        """
+        with self.lock:
+            track = self.tracks.get(track_id)
+            return None if track is None else track.timestamp
+
+    def forget(self, track_id: int):
+        """
+        Remove a track's filter.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+        """
+        with self.lock:
+            self.tracks.pop(track_id, None)
+
+    def get_stats(self) -> dict:
+        """
+        Get the number of filtered tracks and the mean prediction error.
+
+        Returns:
+        dict: Tracks and smoothed prediction error in stage units
+        """
+        with self.lock:
+            error = self.prediction_error
+            return {
+                "tracks": len(self.tracks),
+                "prediction_error": None if error is None else round(error, 1),
+            }
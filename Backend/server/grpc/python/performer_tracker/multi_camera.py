@@ -0,0 +1,570 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides multi-camera tracking for wide stages. Each camera runs
+capture, preprocessing, detection and ReID feature extraction in its own
+process, with its own homography into the shared stage coordinate system.
+The workers send the stage positions and ReID descriptors of their tracks
+to a light-weight fusion stage, which associates tracks across cameras by
+stage position and descriptor and fuses their positions.
+
+Cameras are configured as a list under settings["cameras"]. Each entry
+overrides the keys of settings["camera"] it contains, and maps its
+src_points to stage_points, the matching stage coordinates (default is the
+corners of the whole stage).
+"""
+
+import itertools
+import logging
+import multiprocessing
+import queue
+import time
+import cv2
+import numpy as np
+
+from camera_source import CameraSource
+from model_backends import (
+    DETECTOR_CALIBRATION_SIZE,
+    extract_tracks,
+    folder_frames,
+    load_detector,
+)
+from pipeline import DetectionScheduler
+from reid.gallery import DEFAULT_THRESHOLDS
+from reid.identity_cache import IdentityCache
+from reid.reid_model import PersonReID
+from utils.homography import compute_homography_matrix, get_center_point
+from utils.stage_roi import StageROI
+from video_processing import FramePreprocessor
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STATS_INTERVAL = 5.0  # Seconds between statistics sent by a worker
+
+
+class ProcessQueue:
+    """
+    A bounded hand-off queue between processes with the interface of
+    LatestQueue. When the queue is full the newest item is dropped, as the
+    producer cannot take items back out of a multiprocessing queue.
+    """
+
+    def __init__(self, context, maxsize: int = 8):
+        """
+        Initialize the ProcessQueue.
+
+        Parameters:
+        context (multiprocessing.context.BaseContext): Multiprocessing
+                                                        context
+        maxsize (int): Maximum number of items held (default is 8)
+        """
+        self.queue = context.Queue(maxsize=maxsize)
+        self.dropped_count = context.Value("i", 0)
+
+    @property
+    def dropped(self) -> int:
+        """
+        Number of items dropped because the queue was full.
+        """
+        return self.dropped_count.value
+
+    def put(self, item):
+        """
+        Put an item, dropping it if the queue is full.
+
+        Parameters:
+        item: The item to hand off
+        """
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self.dropped_count.get_lock():
+                self.dropped_count.value += 1
+
+    def get(self, timeout: float = None):
+        """
+        Get the oldest item.
+
+        Parameters:
+        timeout (float): Seconds to wait for an item (default is None,
+                         which waits until one arrives)
+
+        Returns:
+        The item, or None if none arrived in time
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def camera_homography(camera_settings, stage_size):
+    """
+    Compute the homography of a camera into stage coordinates.
+
+    Parameters:
+    camera_settings (dict): Settings of the camera
+    stage_size (tuple): Stage width and height in stage units
+
+    Returns:
+    np.ndarray: Homography matrix from frame to stage coordinates
+    """
+    stage_points = camera_settings.get("stage_points") or [
+        (0, 0),
+        (stage_size[0], 0),
+        (stage_size[0], stage_size[1]),
+        (0, stage_size[1]),
+    ]
+    return compute_homography_matrix(
+        np.array(camera_settings["src_points"], dtype=np.float32),
+        np.array(stage_points, dtype=np.float32),
+    )
+
+
+class CameraWorker:
+    """
+    Captures, detects and extracts ReID descriptors for one camera, inside
+    its own process.
+    """
+
+    def __init__(self, index, camera_settings, performer_settings, stage_size):
+        """
+        Initialize the CameraWorker.
+
+        Parameters:
+        index (int): Index of the camera in settings["cameras"]
+        camera_settings (dict): Settings of the camera, merged over
+                                settings["camera"]
+        performer_settings (dict): settings["performer_tracker"]
+        stage_size (tuple): Stage width and height in stage units
+        """
+        self.index = index
+        self.homography = camera_homography(camera_settings, stage_size)
+        self.camera = CameraSource(
+            camera_settings.get("video_file")
+            or camera_settings["video_device_pos"],
+            buffer_size=camera_settings.get("buffer_size", 1),
+            fourcc=camera_settings.get("fourcc", "MJPG"),
+            resolution=tuple(camera_settings["resolution"]),
+        )
+        self.preprocessor = FramePreprocessor(camera_settings)
+        self.stage_roi = None
+        if (
+            camera_settings.get("enable_crop")
+            and len(camera_settings.get("crop_points", [])) >= 3
+        ):
+            self.stage_roi = StageROI(
+                camera_settings["crop_points"],
+                tuple(camera_settings["resolution"]),
+                scale=camera_settings.get("crop_scale", 1.0),
+                mask_outside=camera_settings.get("crop_mask", True),
+            )
+        self.calibration_folder = performer_settings.get(
+            "detector_calibration_folder"
+        )
+        self.calibration_count = performer_settings.get(
+            "detector_calibration_frames", DETECTOR_CALIBRATION_SIZE
+        )
+        default_model = (
+            "yolov8n-seg.pt"
+            if performer_settings.get("use_segmentation", False)
+            else "yolov8n.pt"
+        )
+        self.model = load_detector(
+            performer_settings.get("detector_model", default_model),
+            backend=performer_settings.get("inference_backend", "pytorch"),
+            int8=performer_settings.get("inference_int8", False),
+            calibration_frames=self.calibration_frames,
+        )
+        self.reid_model = PersonReID(
+            backend=performer_settings.get("inference_backend", "pytorch"),
+            int8=performer_settings.get("inference_int8", False),
+            calibration_folder=performer_settings["user_folder"],
+        )
+        self.scheduler = DetectionScheduler(
+            target_fps=performer_settings.get("target_fps", 30),
+            max_load=performer_settings.get("max_detection_load", 0.7),
+            max_stride=performer_settings.get("max_detection_stride", 10),
+        )
+        self.identity_cache = IdentityCache(
+            refresh_interval=performer_settings.get(
+                "reid_refresh_interval", 30
+            ),
+            min_box_iou=performer_settings.get("reid_min_box_iou", 0.3),
+            overlap_iou=performer_settings.get("reid_overlap_iou", 0.1),
+        )
+        self.max_unseen_frames = performer_settings.get(
+            "track_max_unseen_frames", 90
+        )
+        self.descriptors = {}
+        self.last_seen = {}
+
+    def calibration_frames(self):
+        """
+        Get the frames an int8 detector is calibrated on, the images of the
+        calibration folder when set or otherwise the first frames of the
+        camera, up to the calibration frame count, preprocessed and cropped
+        to the stage as in process().
+
+        Yields:
+        np.ndarray: BGR frame
+        """
+        frames = (
+            itertools.islice(
+                folder_frames(self.calibration_folder), self.calibration_count
+            )
+            if self.calibration_folder
+            else self.camera.read_frames(self.calibration_count)
+        )
+        for frame in frames:
+            frame = self.preprocessor(frame)
+            if self.stage_roi is not None:
+                frame = self.stage_roi.apply(frame)
+            yield frame
+
+    def process(self, packet):
+        """
+        Detect the people in a frame and get their stage positions and
+        descriptors. Descriptors are only extracted for tracks whose cached
+        descriptor may be stale.
+
+        Parameters:
+        packet (dict): Frame packet from the camera source
+
+        Returns:
+        dict: Detection message for the fusion stage
+        """
+        frame_count = packet["frame_count"]
+        frame = self.preprocessor(packet["frame"])
+        source = frame
+        if self.stage_roi is not None:
+            source = self.stage_roi.apply(frame)
+        results = self.model.track(source=source, persist=True, verbose=False)
+        track_ids, boxes = extract_tracks(results[0], self.stage_roi)
+
+        people = []
+        height, width = frame.shape[:2]
+        for track_id, box in zip(track_ids, boxes):
+            x1, y1, x2, y2 = map(int, box)
+            if x1 < 0 or y1 < 0 or x2 >= width or y2 >= height:
+                continue
+            if x2 <= x1 or y2 <= y1:
+                continue
+            self.last_seen[track_id] = frame_count
+            people.append((track_id, (x1, y1, x2, y2)))
+
+        needs_reid = self.identity_cache.plan(frame_count, people)
+        refresh = [
+            (track_id, bbox)
+            for track_id, bbox in people
+            if track_id in needs_reid
+        ]
+        features = self.reid_model.extract_reid_features_batch(
+            [frame[y1:y2, x1:x2] for _, (x1, y1, x2, y2) in refresh]
+        )
+        for (track_id, bbox), descriptor in zip(refresh, features):
+            self.descriptors[track_id] = descriptor
+            self.identity_cache.update(track_id, bbox, frame_count, None)
+
+        for track_id, seen in list(self.last_seen.items()):
+            if frame_count - seen > self.max_unseen_frames:
+                del self.last_seen[track_id]
+                self.descriptors.pop(track_id, None)
+                self.identity_cache.forget(track_id)
+
+        centers = np.array(
+            [[get_center_point(bbox)] for _, bbox in people], dtype=np.float32
+        ).reshape(-1, 1, 2)
+        positions = np.zeros((0, 2), dtype=np.float32)
+        if len(centers):
+            positions = cv2.perspectiveTransform(centers, self.homography)
+        return {
+            "camera": self.index,
+            "capture_time": packet["capture_time"],
+            "track_ids": [track_id for track_id, _ in people],
+            "positions": positions.reshape(-1, 2),
+            "descriptors": np.array(
+                [self.descriptors[track_id] for track_id, _ in people],
+                dtype=np.float32,
+            ).reshape(len(people), -1),
+            "refreshed": [track_id in needs_reid for track_id, _ in people],
+        }
+
+    def run(self, output_queue, stop_event):
+        """
+        Process the newest camera frames until the stop event is set, the
+        camera stops or the tracker process exits.
+
+        The tracker is stopped with SIGTERM, which skips its cleanup and
+        never sets the stop event, so the worker also watches its parent
+        process to release the camera and models instead of orphaning them.
+
+        Parameters:
+        output_queue (ProcessQueue): Queue to the fusion stage
+        stop_event (multiprocessing.Event): Event that stops the worker
+        """
+        parent = multiprocessing.parent_process()
+        self.camera.start()
+        last_stats = time.monotonic()
+        logger.info(f"Camera worker {self.index} started")
+        try:
+            while not stop_event.is_set() and self.camera.is_running():
+                if parent is not None and not parent.is_alive():
+                    logger.warning(
+                        f"Camera worker {self.index} lost the tracker "
+                        "process. Stopping."
+                    )
+                    break
+                packet = self.camera.get(timeout=0.1)
+                if packet is None or not self.scheduler.should_detect():
+                    continue
+
+                start_time = time.monotonic()
+                message = self.process(packet)
+                self.scheduler.record_inference(time.monotonic() - start_time)
+
+                if time.monotonic() - last_stats >= STATS_INTERVAL:
+                    last_stats = time.monotonic()
+                    message["stats"] = {
+                        "capture": self.camera.stats.snapshot(),
+                        "dropped": self.camera.dropped,
+                        "scheduler": self.scheduler.get_stats(),
+                        "identity_cache": self.identity_cache.get_stats(),
+                    }
+                output_queue.put(message)
+        finally:
+            self.camera.stop()
+            logger.info(f"Camera worker {self.index} stopped")
+
+
+def run_camera_worker(
+    index,
+    camera_settings,
+    performer_settings,
+    stage_size,
+    output_queue,
+    stop_event,
+):
+    """
+    Entry point of a camera worker process.
+
+    Parameters:
+    index (int): Index of the camera in settings["cameras"]
+    camera_settings (dict): Settings of the camera, merged over
+                            settings["camera"]
+    performer_settings (dict): settings["performer_tracker"]
+    stage_size (tuple): Stage width and height in stage units
+    output_queue (ProcessQueue): Queue to the fusion stage
+    stop_event (multiprocessing.Event): Event that stops the worker
+    """
+    try:
+        worker = CameraWorker(
+            index, camera_settings, performer_settings, stage_size
+        )
+        worker.run(output_queue, stop_event)
+    except Exception as e:
+        logger.exception(f"Camera worker {index} failed: {e}")
+
+
+class StageFusion:
+    """
+    Associates the tracks of several cameras into global tracks and fuses
+    their stage positions.
+
+    A camera track is linked to a global track once, when it first
+    appears. It joins the nearest global track that is not seen by the same
+    camera, is within the matching distance on stage and has a similar
+    descriptor. Otherwise it starts a new global track. The position of a
+    global track is the mean of the fresh positions of its camera tracks.
+    """
+
+    def __init__(
+        self,
+        match_distance: float = 500.0,
+        descriptor_threshold: float = None,
+        max_age: float = 0.5,
+        link_timeout: float = 5.0,
+        metric: str = "euclidean",
+    ):
+        """
+        Initialize the StageFusion.
+
+        Parameters:
+        match_distance (float): Largest stage distance between a camera
+                                track and the global track it joins, in
+                                stage units (default is 500)
+        descriptor_threshold (float): Largest descriptor distance between
+                                      a camera track and the global track
+                                      it joins (default is the uncertain
+                                      ReID threshold of the metric)
+        max_age (float): Seconds an observation counts towards the fused
+                         position (default is 0.5)
+        link_timeout (float): Seconds after which an unseen camera track
+                              is forgotten (default is 5)
+        metric (str): Descriptor distance, "euclidean" or "cosine"
+                      (default is "euclidean")
+        """
+        self.match_distance = match_distance
+        if descriptor_threshold is None:
+            descriptor_threshold = DEFAULT_THRESHOLDS[metric]["uncertain"]
+        self.descriptor_threshold = descriptor_threshold
+        self.max_age = max_age
+        self.link_timeout = link_timeout
+        self.metric = metric
+        self.links = {}
+        self.observations = {}
+        self.next_global_id = 1
+        self.updates = 0
+        self.camera_stats = {}
+
+    def descriptor_distance(self, a: np.ndarray, b: np.ndarray) -> float:
+        """
+        Get the distance between two descriptors.
+
+        Parameters:
+        a (np.ndarray): Descriptor
+        b (np.ndarray): Descriptor
+
+        Returns:
+        float: Distance in the configured metric
+        """
+        if self.metric == "cosine":
+            norm = np.linalg.norm(a) * np.linalg.norm(b)
+            return float(1.0 - np.dot(a, b) / norm) if norm else 1.0
+        return float(np.linalg.norm(a - b))
+
+    def _global_tracks(self, now: float) -> dict:
+        """
+        Group the fresh observations by global track.
+
+        Parameters:
+        now (float): Monotonic time of the newest observation
+
+        Returns:
+        dict: Global ID to the list of (camera, observation) pairs
+        """
+        tracks = {}
+        for key, observation in self.observations.items():
+            if now - observation["time"] <= self.max_age:
+                tracks.setdefault(self.links[key], []).append(
+                    (key[0], observation)
+                )
+        return tracks
+
+    def _link(self, camera: int, observation: dict, tracks: dict) -> int:
+        """
+        Find the global track a new camera track belongs to.
+
+        Parameters:
+        camera (int): Index of the camera
+        observation (dict): First observation of the camera track
+        tracks (dict): Fresh observations per global track
+
+        Returns:
+        int: Global ID of the joined or new global track
+        """
+        best_id, best_cost = None, None
+        for global_id, members in tracks.items():
+            if any(member_camera == camera for member_camera, _ in members):
+                continue
+            position = np.mean([o["position"] for _, o in members], axis=0)
+            distance = float(
+                np.linalg.norm(position - observation["position"])
+            )
+            descriptor = min(
+                self.descriptor_distance(
+                    member["descriptor"], observation["descriptor"]
+                )
+                for _, member in members
+            )
+            if (
+                distance > self.match_distance
+                or descriptor > self.descriptor_threshold
+            ):
+                continue
+            cost = (
+                distance / self.match_distance
+                + descriptor / self.descriptor_threshold
+            )
+            if best_cost is None or cost < best_cost:
+                best_id, best_cost = global_id, cost
+
+        if best_id is None:
+            best_id = self.next_global_id
+            self.next_global_id += 1
+        return best_id
+
+    def update(self, message: dict) -> dict:
+        """
+        Add the detections of a camera and fuse the global tracks.
+
+        Parameters:
+        message (dict): Detection message of a camera worker
+
+        Returns:
+        dict: Global ID to a dictionary of the fused position, the newest
+              descriptor, whether any camera refreshed it, and the cameras
+              seeing it
+        """
+        self.updates += 1
+        camera = message["camera"]
+        now = message["capture_time"]
+        if "stats" in message:
+            self.camera_stats[camera] = message["stats"]
+
+        tracks = self._global_tracks(now)
+        refreshed = set()
+        for track_id, position, descriptor, is_refreshed in zip(
+            message["track_ids"],
+            message["positions"],
+            message["descriptors"],
+            message["refreshed"],
+        ):
+            key = (camera, track_id)
+            observation = {
+                "time": now,
+                "position": position,
+                "descriptor": descriptor,
+            }
+            if key not in self.links:
+                self.links[key] = self._link(camera, observation, tracks)
+                tracks.setdefault(self.links[key], []).append(
+                    (camera, observation)
+                )
+            self.observations[key] = observation
+            if is_refreshed:
+                refreshed.add(self.links[key])
+
+        for key, observation in list(self.observations.items()):
+            if now - observation["time"] > self.link_timeout:
+                del self.observations[key]
+                del self.links[key]
+
+        fused = {}
+        for global_id, members in self._global_tracks(now).items():
+            newest = max(members, key=lambda member: member[1]["time"])
+            fused[global_id] = {
+                "position": np.mean(
+                    [o["position"] for _, o in members], axis=0
+                ),
+                "descriptor": newest[1]["descriptor"],
+                "refreshed": global_id in refreshed,
+                "cameras": sorted(camera for camera, _ in members),
+            }
+        return fused
+
+    def get_stats(self) -> dict:
+        """
+        Get the number of tracks and the newest statistics of each camera.
+
+        Returns:
+        dict: Camera tracks, global tracks and statistics per camera
+        """
+        return {
+            "camera_tracks": len(self.links),
+            "global_tracks": len(set(self.links.values())),
+            "cameras": dict(self.camera_stats),
+        }
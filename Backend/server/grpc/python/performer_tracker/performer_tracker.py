@@ -11,25 +11,49 @@ Date: 06/06/2024
 """
 
 import cv2
+import itertools
 import logging
 import os
 import sys
-import uuid
+import threading
+import time
 import numpy as np
-from collections import defaultdict, deque
-from ultralytics import YOLO
-from ultralytics.utils.plotting import Annotator, colors
+from ultralytics.utils.plotting import Annotator
 from reid.reid_model import PersonReID
+from reid.gallery import DEFAULT_THRESHOLDS
+from reid.identity_cache import IdentityCache
+from reid.gallery_maintenance import GalleryMaintainer
 from light_control.controller import LightController
-from light_control.pan_tilt_calculator import (
-    PanTiltCalculator,
+from light_control.fixture_map import FixtureMap
+from utils.homography import compute_remap_maps, get_center_point
+from utils.stage_roi import StageROI
+from video_processing import FramePreprocessor
+from pipeline import (
+    DetectionScheduler,
+    LatestQueue,
+    PipelineStage,
+    StageStats,
 )
-from utils.homography import seg_to_bbox, get_center_point
-from video_processing import process_frame
+from camera_source import CameraSource
+from model_backends import (
+    DETECTOR_CALIBRATION_SIZE,
+    extract_tracks,
+    folder_frames,
+    load_detector,
+)
+from track_registry import TrackRegistry
+from motion_model import MotionModel
+from image_writer import ImageWriter
+from preview_stream import PreviewPublisher
+from multi_camera import ProcessQueue, StageFusion, run_camera_worker
 import asyncio
+import multiprocessing
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__))))
 
+LIGHT_UPDATE_INTERVAL = 0.1  # Seconds between DMX updates
+STATS_LOG_INTERVAL = 5.0  # Seconds between pipeline statistics logs
+
 
 class PerformerTracker:
     def __init__(self, settings, status_queue=None):
@@ -45,13 +69,107 @@ class PerformerTracker:
         self.setup_logging()
         self.validate_homography_dimensions()
         self.initialize_homography()
-        self.track_histories = defaultdict(lambda: deque(maxlen=10))
-        self.user_colors = {}
-        self.yolo_id_to_user = {}
         self.real_world_point = None
         self.light_controller = None
         self.stop = False
-        self.reid_model = PersonReID()
+        self.stop_event = threading.Event()
+        self.homography_preview = None
+        self.preview_maps = None
+        self.last_preview_time = 0.0
+        self.camera = None
+        self.stage_roi = None
+        self.fusion = None
+        self.preprocessor = FramePreprocessor(self.settings["camera"])
+        self.light_stats = StageStats("light")
+        self.stages = []
+        self.queues = {}
+        performer_settings = self.settings["performer_tracker"]
+        self.reid_metric = performer_settings.get("reid_metric", "euclidean")
+        if self.reid_metric not in DEFAULT_THRESHOLDS:
+            raise ValueError(f"Unknown ReID metric: {self.reid_metric}")
+        thresholds = DEFAULT_THRESHOLDS[self.reid_metric]
+        self.reid_model = PersonReID(
+            metric=self.reid_metric,
+            ann_min_size=performer_settings.get("reid_ann_min_size", 2000),
+            backend=performer_settings.get("inference_backend", "pytorch"),
+            int8=performer_settings.get("inference_int8", False),
+            calibration_folder=performer_settings["user_folder"],
+        )
+        self.match_threshold = performer_settings.get(
+            "reid_match_threshold", thresholds["match"]
+        )
+        self.uncertain_threshold = performer_settings.get(
+            "reid_uncertain_threshold", thresholds["uncertain"]
+        )
+        self.image_writer = ImageWriter(
+            num_workers=performer_settings.get("image_writer_workers", 2),
+            max_queue_size=performer_settings.get("image_queue_size", 32),
+            jpeg_quality=performer_settings.get("jpeg_quality", 90),
+            min_interval=performer_settings.get("save_min_interval", 1.0),
+        )
+        self.next_uncertain_index = 0
+        self.scheduler = DetectionScheduler(
+            target_fps=performer_settings.get("target_fps", 30),
+            max_load=performer_settings.get("max_detection_load", 0.7),
+            max_stride=performer_settings.get("max_detection_stride", 10),
+        )
+        self.motion_model = MotionModel()
+        self.fixture_map = FixtureMap.from_settings(performer_settings)
+        self.followed_performers = set(self.fixture_map.performers)
+        self.followed_tracks = {}
+        self.performer_points = {}
+        self.predictive_targeting = performer_settings.get(
+            "predictive_targeting", True
+        )
+        self.light_output_latency = performer_settings.get(
+            "light_output_latency", 0.03
+        )
+        self.max_prediction_horizon = performer_settings.get(
+            "max_prediction_horizon", 0.5
+        )
+        self.light_update_interval = performer_settings.get(
+            "light_update_interval", LIGHT_UPDATE_INTERVAL
+        )
+        self.track_registry = TrackRegistry(
+            history_size=performer_settings.get("track_history_size", 10),
+            max_unseen_frames=performer_settings.get(
+                "track_max_unseen_frames", 90
+            ),
+        )
+        self.gallery_maintainer = GalleryMaintainer(
+            interval=performer_settings.get(
+                "gallery_maintenance_interval", 30
+            ),
+            max_per_identity=performer_settings.get(
+                "gallery_max_per_identity", 20
+            ),
+            merge_threshold=performer_settings.get(
+                "gallery_merge_threshold", thresholds["merge"]
+            ),
+            stale_seconds=performer_settings.get("gallery_stale_seconds", 900),
+            evicted_retention=performer_settings.get(
+                "gallery_evicted_retention", 50
+            ),
+        )
+        self.headless = performer_settings.get("headless", False)
+        self.preview_publisher = None
+        mjpeg_port = performer_settings.get("preview_mjpeg_port")
+        if self.headless or mjpeg_port is not None:
+            self.preview_publisher = PreviewPublisher(
+                prefix=performer_settings.get(
+                    "preview_shm_prefix", "performer_tracker"
+                ),
+                width=performer_settings.get("preview_width", 640),
+                fps=performer_settings.get("preview_fps", 10),
+                mjpeg_port=mjpeg_port,
+            )
+        self.identity_cache = IdentityCache(
+            refresh_interval=performer_settings.get(
+                "reid_refresh_interval", 30
+            ),
+            min_box_iou=performer_settings.get("reid_min_box_iou", 0.3),
+            overlap_iou=performer_settings.get("reid_overlap_iou", 0.1),
+        )
 
     def setup_logging(self):
         """
@@ -102,78 +220,474 @@ class PerformerTracker:
     async def start_camera_stream(self):
         """
         Start the camera stream for performer tracking.
+
+        Capture, detection and identification each run in their own thread.
+        The detector always takes the newest camera frame, and later stages
+        hand frames on through queues that drop stale frames. This
+        coroutine only displays the newest results and reports statistics,
+        so the light control loop sharing the event loop is never blocked by
+        inference.
         """
+        if self.settings.get("cameras"):
+            await self.start_multi_camera_stream()
+            return
+
         self.logger.info("Starting camera stream")
-        model = YOLO("yolov8n-seg.pt")
-        cap = cv2.VideoCapture(self.settings["camera"]["video_device_pos"])
+        performer_settings = self.settings["performer_tracker"]
+        camera_settings = self.settings["camera"]
+        self.camera = CameraSource(
+            camera_settings.get("video_file")
+            or camera_settings["video_device_pos"],
+            buffer_size=camera_settings.get("buffer_size", 1),
+            fourcc=camera_settings.get("fourcc", "MJPG"),
+            resolution=tuple(camera_settings["resolution"]),
+        )
+        stage_zone = self.settings["stage_zone"]
+        if (
+            stage_zone.get("enable_crop")
+            and len(stage_zone["crop_points"]) >= 3
+        ):
+            self.stage_roi = StageROI(
+                stage_zone["crop_points"],
+                tuple(camera_settings["resolution"]),
+                scale=stage_zone.get("crop_scale", 1.0),
+                mask_outside=stage_zone.get("crop_mask", True),
+            )
+        default_model = (
+            "yolov8n-seg.pt"
+            if performer_settings.get("use_segmentation", False)
+            else "yolov8n.pt"
+        )
+        self.model = load_detector(
+            performer_settings.get("detector_model", default_model),
+            backend=performer_settings.get("inference_backend", "pytorch"),
+            int8=performer_settings.get("inference_int8", False),
+            calibration_frames=self.detector_calibration_frames,
+        )
 
         self.ensure_directories()
-        database = self.reid_model.load_database(
+        self.database = self.reid_model.load_database(
             self.settings["performer_tracker"]["user_folder"]
         )
-        uncertain_database = self.reid_model.load_database(
+        self.uncertain_database = self.reid_model.load_database(
             self.settings["performer_tracker"]["uncertain_folder"]
         )
+        self.next_uncertain_index = self.find_next_uncertain_index()
+        self.gallery_maintainer.register("users", self.database)
+        self.gallery_maintainer.register(
+            "uncertain",
+            self.uncertain_database,
+            folder=self.settings["performer_tracker"]["uncertain_folder"],
+            uncertain=True,
+        )
 
-        frame_count = 0
-        retry_count = 0
-        max_retries = 5
+        self.stop_event.clear()
+        identity_queue = LatestQueue()
+        display_queue = LatestQueue()
+        self.queues = {
+            "identity": identity_queue,
+            "display": display_queue,
+        }
+        self.stages = [
+            PipelineStage(
+                "detector",
+                self.detect,
+                self.camera,
+                identity_queue,
+                self.stop_event,
+            ),
+            PipelineStage(
+                "identity",
+                self.identify,
+                identity_queue,
+                display_queue,
+                self.stop_event,
+            ),
+        ]
+        self.image_writer.start()
+        self.gallery_maintainer.start()
+        if self.preview_publisher is not None:
+            self.preview_publisher.start()
+        self.camera.start()
+        for stage in self.stages:
+            stage.start()
+
+        last_stats_log = time.monotonic()
+        while not self.stop and self.camera.is_running():
+            packet = display_queue.get(timeout=0)
+            if self.show_frames(packet):
+                self.logger.info("Quitting application")
+                break
 
-        while not self.stop:
-            ret, frame = cap.read()
-            if not ret:
-                retry_count += 1
-                self.logger.error(
-                    "Video feed is empty, retrying... "
-                    f"({retry_count}/{max_retries})"
+            if time.monotonic() - last_stats_log >= STATS_LOG_INTERVAL:
+                last_stats_log = time.monotonic()
+                self.logger.info(
+                    f"Pipeline statistics: {self.get_pipeline_stats()}"
                 )
-                if retry_count >= max_retries:
-                    self.logger.error("Maximum retries reached. Exiting.")
-                    break
-                continue
-
-            retry_count = 0
 
-            frame = self.process_and_transform_frame(frame)
-            annotator = Annotator(frame.copy(), line_width=2)
-            results = model.track(source=frame, persist=True)
-
-            if (
-                results[0].boxes.id is not None
-                and results[0].masks is not None
-            ):
-                self.process_detections(
-                    results[0],
-                    frame,
-                    frame_count,
-                    annotator,
-                    database,
-                    uncertain_database,
-                )
+            await asyncio.sleep(0.01)
 
-            if self.settings["performer_tracker"]["show_window"]:
-                cv2.imshow(
-                    "Real-Time Detection and Tracking", annotator.result
-                )
+        self.stop_event.set()
+        for stage in self.stages:
+            stage.join()
+        self.camera.stop()
+        self.image_writer.stop()
+        self.gallery_maintainer.stop()
+        if self.preview_publisher is not None:
+            self.preview_publisher.stop()
+        if not self.headless:
+            cv2.destroyAllWindows()
 
-            if cv2.waitKey(1) & 0xFF == ord("q"):
-                self.logger.info("Quitting application")
-                break
+        if not self.stop:
+            self.logger.error(
+                "Performer tracker loop exited unexpectedly. "
+                "Stopping the light controller."
+            )
+            self.stop()
 
-            frame_count += 1
+    async def start_multi_camera_stream(self):
+        """
+        Start tracking with every camera in settings["cameras"].
 
-            await asyncio.sleep(0.01)
+        Each camera captures, detects and extracts ReID descriptors in its
+        own process. The fusion stage joins their tracks in stage
+        coordinates and follows the tracked user. No frames reach this
+        process, so nothing is displayed.
+        """
+        cameras = self.settings["cameras"]
+        self.logger.info(f"Starting {len(cameras)} camera streams")
+        performer_settings = self.settings["performer_tracker"]
+        self.ensure_directories()
+        self.database = self.reid_model.load_database(
+            performer_settings["user_folder"]
+        )
+        self.gallery_maintainer.register("users", self.database)
+        self.fusion = StageFusion(
+            match_distance=performer_settings.get(
+                "fusion_match_distance", 500
+            ),
+            descriptor_threshold=performer_settings.get(
+                "fusion_descriptor_threshold"
+            ),
+            max_age=performer_settings.get("fusion_max_age", 0.5),
+            metric=self.reid_metric,
+        )
 
-        cap.release()
-        cv2.destroyAllWindows()
+        # Spawned processes do not inherit model or capture state
+        context = multiprocessing.get_context("spawn")
+        worker_stop = context.Event()
+        message_queue = ProcessQueue(context, maxsize=4 * len(cameras))
+        processes = [
+            context.Process(
+                target=run_camera_worker,
+                args=(
+                    index,
+                    {**self.settings["camera"], **camera_settings},
+                    performer_settings,
+                    (self.target_width, self.target_height),
+                    message_queue,
+                    worker_stop,
+                ),
+                name=f"camera-{index}",
+                daemon=True,
+            )
+            for index, camera_settings in enumerate(cameras)
+        ]
+
+        self.stop_event.clear()
+        self.queues = {"fusion": message_queue}
+        self.stages = [
+            PipelineStage(
+                "fusion", self.fuse, message_queue, None, self.stop_event
+            )
+        ]
+        self.gallery_maintainer.start()
+        for process in processes:
+            process.start()
+        for stage in self.stages:
+            stage.start()
+
+        last_stats_log = time.monotonic()
+        while not self.stop and any(
+            process.is_alive() for process in processes
+        ):
+            if time.monotonic() - last_stats_log >= STATS_LOG_INTERVAL:
+                last_stats_log = time.monotonic()
+                self.logger.info(
+                    f"Pipeline statistics: {self.get_pipeline_stats()}"
+                )
+            await asyncio.sleep(0.1)
+
+        worker_stop.set()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.stop_event.set()
+        for stage in self.stages:
+            stage.join()
+        self.gallery_maintainer.stop()
 
         if not self.stop:
             self.logger.error(
-                "Performer tracker loop exited unexpectedly. "
+                "Camera workers exited unexpectedly. "
                 "Stopping the light controller."
             )
             self.stop()
 
+    def fuse(self, message):
+        """
+        Pipeline stage that fuses the detections of one camera into the
+        global tracks, identifies them and follows the tracked user.
+
+        :param message: Detection message from a camera worker.
+        :return: None, as nothing is handed on.
+        """
+        self.apply_gallery_changes()
+        fused = self.fusion.update(message)
+        update_count = self.fusion.updates
+
+        refreshed = [
+            global_id
+            for global_id, track in fused.items()
+            if track["refreshed"]
+        ]
+        descriptors = np.array(
+            [fused[global_id]["descriptor"] for global_id in refreshed]
+        )
+        matches = self.reid_model.match_descriptors_batch(
+            descriptors,
+            self.database,
+            threshold=self.match_threshold,
+        )
+        for global_id in fused:
+            self.track_registry.touch(global_id, update_count)
+        for global_id, (match_id, score) in zip(refreshed, matches):
+            if match_id:
+                self.track_registry.add_vote(global_id, match_id, score)
+
+        for global_id in self.track_registry.evict_stale(update_count):
+            self.forget_track(global_id)
+
+        for global_id, track in fused.items():
+            identity = self.track_registry.identity_of(global_id)
+            if identity not in self.followed_performers:
+                continue
+            followed_id = self.followed_tracks.get(identity)
+            if followed_id not in (None, global_id) and followed_id in fused:
+                # Another global track of the performer is already followed
+                continue
+            position = np.round(track["position"], decimals=0)
+            self.set_performer_point(identity, position)
+            self.motion_model.update(
+                global_id, position, message["capture_time"]
+            )
+            self.followed_tracks[identity] = global_id
+        return None
+
+    def detect(self, packet):
+        """
+        Pipeline stage that preprocesses a frame and runs the YOLO tracker.
+
+        The scheduler skips frames when detection cannot keep up with the
+        target rate. On skipped frames the followed performers' positions
+        are propagated with the motion model instead.
+
+        :param packet: Frame packet from the camera source.
+        :return: The packet with the processed frame and tracker result, or
+                 None if the frame was skipped.
+        """
+        if not self.scheduler.should_detect():
+            self.propagate_position(packet["capture_time"])
+            return None
+
+        start_time = time.monotonic()
+        frame = self.process_and_transform_frame(packet["frame"])
+        source = frame
+        if self.stage_roi is not None:
+            source = self.stage_roi.apply(frame)
+        results = self.model.track(source=source, persist=True)
+        self.scheduler.record_inference(time.monotonic() - start_time)
+        packet["frame"] = frame
+        packet["track_ids"], packet["boxes"] = extract_tracks(
+            results[0], self.stage_roi
+        )
+        return packet
+
+    def propagate_position(self, capture_time):
+        """
+        Update the followed performers' positions from the motion model.
+
+        :param capture_time: Monotonic capture time of the skipped frame.
+        """
+        for identity, track_id in list(self.followed_tracks.items()):
+            position = self.motion_model.predict(track_id, capture_time)
+            if position is not None:
+                self.set_performer_point(
+                    identity, np.round(position, decimals=0)
+                )
+
+    def set_performer_point(self, identity, position):
+        """
+        Set the stage position a followed performer's fixtures point at.
+
+        :param identity: Identity of the performer.
+        :param position: Stage position of the performer.
+        """
+        self.performer_points[identity] = position
+        if identity == self.settings["performer_tracker"]["tracked_user_id"]:
+            self.real_world_point = position
+
+    def predict_targets(self, send_time):
+        """
+        Get the stage position of every followed performer at the time the
+        light positions take effect.
+
+        Each position is extrapolated from the performer's newest
+        measurement with the velocity estimated by the motion model, so
+        capture, inference and light loop latency do not leave moving
+        performers behind the beam. Extrapolation stops after
+        max_prediction_horizon seconds without a measurement.
+
+        :param send_time: Monotonic time the light positions take effect.
+        :return: Performer identity to stage position, and the capture time
+                 of the newest measurement, or None without measurements.
+        """
+        points = dict(self.performer_points)
+        newest_capture = None
+        for identity, track_id in list(self.followed_tracks.items()):
+            capture_time = self.motion_model.last_measurement(track_id)
+            if capture_time is None:
+                continue
+            if newest_capture is None or capture_time > newest_capture:
+                newest_capture = capture_time
+            if not self.predictive_targeting:
+                continue
+            position = self.motion_model.predict(
+                track_id, send_time, self.max_prediction_horizon
+            )
+            if position is not None and identity in points:
+                points[identity] = position
+        return points, newest_capture
+
+    def forget_track(self, track_id):
+        """
+        Stop following a track that is no longer seen. Its performer's
+        fixtures keep their last position until the performer is found
+        again.
+
+        :param track_id: Track ID assigned by the tracker.
+        """
+        self.motion_model.forget(track_id)
+        for identity, followed_id in list(self.followed_tracks.items()):
+            if followed_id == track_id:
+                del self.followed_tracks[identity]
+
+    def identify(self, packet):
+        """
+        Pipeline stage that re-identifies the tracked people and annotates
+        the frame.
+
+        :param packet: Frame packet from the detector stage.
+        :return: The packet with the annotated frame.
+        """
+        self.apply_gallery_changes()
+        frame = packet["frame"]
+        annotator = Annotator(frame.copy(), line_width=2)
+
+        if packet["track_ids"]:
+            self.process_detections(
+                packet["track_ids"],
+                packet["boxes"],
+                frame,
+                packet["frame_count"],
+                annotator,
+                self.database,
+                self.uncertain_database,
+                packet["capture_time"],
+            )
+
+        packet["annotated"] = annotator.result
+        return packet
+
+    def apply_gallery_changes(self):
+        """
+        Relabel the tracks whose identities were merged or evicted by
+        gallery maintenance since the last call. Their cached labels are
+        dropped, so they are re-identified on their next frame.
+        """
+        for _, merges, evicted in self.gallery_maintainer.pop_changes():
+            for track_id in self.track_registry.relabel(merges, evicted):
+                self.identity_cache.forget(track_id)
+
+    def show_frames(self, packet):
+        """
+        Show the newest annotated frame and homography preview, and
+        publish them to the preview streams. In headless mode nothing is
+        shown.
+
+        :param packet: Newest packet from the identity stage, or None.
+        :return: True if the user asked to quit, False otherwise.
+        """
+        if self.preview_publisher is not None:
+            if packet is not None:
+                self.preview_publisher.publish(
+                    "annotated", packet["annotated"], packet["capture_time"]
+                )
+            if self.homography_preview is not None:
+                self.preview_publisher.publish(
+                    "stage", self.homography_preview
+                )
+
+        if self.headless:
+            return False
+
+        if (
+            packet is not None
+            and self.settings["performer_tracker"]["show_window"]
+        ):
+            cv2.imshow("Real-Time Detection and Tracking", packet["annotated"])
+
+        if self.homography_preview is not None:
+            cv2.imshow(
+                "Homography Transformed Frame", self.homography_preview
+            )
+
+        return cv2.waitKey(1) & 0xFF == ord("q")
+
+    def get_pipeline_stats(self):
+        """
+        Get FPS and latency of each pipeline stage and the light loop.
+
+        :return: Dictionary of statistics per stage, and the number of
+                 stale frames dropped by each queue.
+        """
+        stats = {}
+        if self.camera is not None:
+            stats["capture"] = self.camera.stats.snapshot()
+        for stage in self.stages:
+            stats[stage.name] = stage.stats.snapshot()
+        stats["light"] = self.light_stats.snapshot()
+        if self.fusion is not None:
+            stats["fusion"] = self.fusion.get_stats()
+        stats["identity_cache"] = self.identity_cache.get_stats()
+        stats["image_writer"] = self.image_writer.get_stats()
+        stats["gallery"] = self.gallery_maintainer.get_stats()
+        stats["tracks"] = self.track_registry.get_stats()
+        if self.preview_publisher is not None:
+            stats["preview"] = self.preview_publisher.get_stats()
+        stats["scheduler"] = {
+            **self.scheduler.get_stats(),
+            **self.motion_model.get_stats(),
+        }
+        stats["dropped"] = {
+            name: stage_queue.dropped
+            for name, stage_queue in self.queues.items()
+        }
+        if self.camera is not None:
+            stats["dropped"]["capture"] = self.camera.dropped
+        return stats
+
     def ensure_directories(self):
         """
         Ensure that the necessary directories for storing images exist.
@@ -186,152 +700,170 @@ class PerformerTracker:
             exist_ok=True,
         )
 
+    def find_next_uncertain_index(self):
+        """
+        Find the index of the next uncertain identity from the folders
+        already saved. Later identities are numbered from an in-memory
+        counter.
+
+        :return: One more than the highest existing uncertain index.
+        """
+        indices = [
+            int(name.rsplit("_", 1)[1])
+            for name in os.listdir(
+                self.settings["performer_tracker"]["uncertain_folder"]
+            )
+            if name.startswith("uncertain_")
+            and name.rsplit("_", 1)[1].isdigit()
+        ]
+        return max(indices, default=-1) + 1
+
+    def detector_calibration_frames(self):
+        """
+        Get the frames an int8 detector is calibrated on. These are the
+        images of performer_tracker.detector_calibration_folder when set,
+        which should be frames captured from the camera, or otherwise the
+        first frames of the camera, up to
+        performer_tracker.detector_calibration_frames in both cases. Frames
+        are preprocessed and cropped to the stage as in detect().
+
+        :return: Generator of BGR frames.
+        """
+        performer_settings = self.settings["performer_tracker"]
+        count = performer_settings.get(
+            "detector_calibration_frames", DETECTOR_CALIBRATION_SIZE
+        )
+        folder = performer_settings.get("detector_calibration_folder")
+        frames = (
+            itertools.islice(folder_frames(folder), count)
+            if folder
+            else self.camera.read_frames(count)
+        )
+        for frame in frames:
+            frame = self.process_and_transform_frame(frame)
+            if self.stage_roi is not None:
+                frame = self.stage_roi.apply(frame)
+            yield frame
+
     def process_and_transform_frame(self, frame):
         """
-        Process and transform the input frame based on settings.
+        Process and transform the input frame based on settings. The
+        preprocessing is only recompiled when the camera settings change.
+        The stage view preview is rendered at most once per
+        stage_zone.homography_preview_interval seconds, and only when
+        stage_zone.homography_preview is enabled.
 
         :param frame: Input video frame.
         :return: Processed and transformed frame.
         """
-        frame = process_frame(
-            frame,
-            brightness=self.settings["camera"]["brightness"],
-            exposure=self.settings["camera"]["exposure"],
-            contrast=self.settings["camera"]["contrast"],
-            saturation=self.settings["camera"]["saturation"],
-            mirror_x=self.settings["camera"]["mirror_x"],
-            mirror_y=self.settings["camera"]["mirror_y"],
-            clahe=self.settings["camera"]["clahe"],
-            clahe_clip_limit=self.settings["camera"]["clahe_clip_limit"],
-            rotation=self.settings["camera"]["rotation"],
-            resolution=tuple(self.settings["camera"]["resolution"]),
-        )
-
-        if self.settings["stage_zone"]["enable_homography"]:
-            test = self.perform_homography(frame)
+        self.preprocessor.update(self.settings["camera"])
+        frame = self.preprocessor(frame)
 
-            if self.real_world_point is not None:
-                cv2.circle(
-                    test,
-                    tuple(int(x) for x in self.real_world_point),
-                    20,
-                    (0, 0, 255),
-                    -1,
+        stage_zone = self.settings["stage_zone"]
+        if stage_zone["enable_homography"] and stage_zone.get(
+            "homography_preview", False
+        ):
+            now = time.monotonic()
+            if now - self.last_preview_time >= stage_zone.get(
+                "homography_preview_interval", 0.5
+            ):
+                self.last_preview_time = now
+                self.homography_preview = self.render_homography_preview(
+                    frame
                 )
 
-            test = self.resize_to_original_frame(
-                test,
-                self.settings["camera"]["resolution"][0],
-                self.settings["camera"]["resolution"][1],
-            )
-
-            cv2.imshow("Homography Transformed Frame", test)
-
         return frame
 
     def process_detections(
         self,
-        result,
+        track_ids,
+        boxes,
         frame,
         frame_count,
         annotator,
         database,
         uncertain_database,
+        capture_time=None,
     ):
         """
         Process detections from the YOLO model and update tracking information.
 
-        :param result: Detection results from YOLO model.
+        :param track_ids: Track IDs assigned by YOLO.
+        :param boxes: Bounding boxes in frame coordinates.
         :param frame: Current video frame.
         :param frame_count: Current frame count.
         :param annotator: Annotator object for drawing on the frame.
         :param database: Database of known persons.
         :param uncertain_database: Database of uncertain identities.
+        :param capture_time: Monotonic capture time of the frame (optional).
         """
-        masks = result.masks.xy
-        track_ids = result.boxes.id.int().cpu().tolist()
-        track_masks = zip(track_ids, masks)
+        track_boxes = list(zip(track_ids, boxes))
 
-        for mask, track_id in track_masks:
-            x1, y1, x2, y2 = map(int, seg_to_bbox(mask))
+        people = []
+        for track_id, box in track_boxes:
+            self.track_registry.touch(track_id, frame_count)
+            x1, y1, x2, y2 = map(int, box)
             if not self.is_bbox_valid(x1, y1, x2, y2, frame):
                 continue
 
             person_image = frame[y1:y2, x1:x2]
             if person_image.size == 0:
                 continue
+            people.append((track_id, (x1, y1, x2, y2), person_image))
 
-            descriptors = self.reid_model.extract_reid_features(person_image)
-            label = f"ID: {track_id} - Not Identified"
-
-            if descriptors is not None and descriptors.size > 0:
-                match_id, score = self.reid_model.match_descriptors(
-                    descriptors, database, threshold=15
-                )
-
-                if match_id:
-                    self.save_image(
-                        frame_count,
-                        person_image,
-                        match_id,
-                        self.settings["performer_tracker"]["user_folder"],
-                    )
-                    self.track_histories[track_id].append((match_id, score))
-                else:
-                    uncertain_match_id, uncertain_score = (
-                        self.reid_model.match_descriptors(
-                            descriptors, uncertain_database, threshold=20
-                        )
-                    )
+        # Only tracks whose cached identity may be stale are re-identified,
+        # all in a single forward pass
+        needs_reid = self.identity_cache.plan(
+            frame_count, [(track_id, bbox) for track_id, bbox, _ in people]
+        )
+        reid_people = [person for person in people if person[0] in needs_reid]
+        descriptor_matrix = self.reid_model.extract_reid_features_batch(
+            [person_image for _, _, person_image in reid_people]
+        )
+        matches = self.reid_model.match_descriptors_batch(
+            descriptor_matrix, database, threshold=self.match_threshold
+        )
+        labels = {}
+        for (track_id, bbox, person_image), descriptors, match in zip(
+            reid_people, descriptor_matrix, matches
+        ):
+            labels[track_id] = self.handle_descriptors(
+                descriptors,
+                frame_count,
+                person_image,
+                track_id,
+                database,
+                uncertain_database,
+                match,
+            )
+            self.identity_cache.update(
+                track_id, bbox, frame_count, labels[track_id]
+            )
 
-                    if uncertain_match_id:
-                        self.save_image(
-                            None,
-                            person_image,
-                            uncertain_match_id,
-                            self.settings["performer_tracker"][
-                                "uncertain_folder"
-                            ],
-                        )
-                        self.track_histories[track_id].append(
-                            (uncertain_match_id, uncertain_score)
-                        )
-                    else:
-                        performer_track = self.settings["performer_tracker"]
-                        uncertain_folder = performer_track["uncertain_folder"]
-                        new_uncertain_id = f'uncertain_{
-                            len(os.listdir(uncertain_folder))
-                        }'
-                        uncertain_database[new_uncertain_id] = [descriptors]
-                        self.save_image(
-                            None,
-                            person_image,
-                            new_uncertain_id,
-                            self.settings["performer_tracker"][
-                                "uncertain_folder"
-                            ],
-                        )
-                        self.track_histories[track_id].append(
-                            (new_uncertain_id, 0)
-                        )
-
-            if len(self.track_histories[track_id]) > 0:
-                label = self.update_track_histories(track_id)
+        for track_id, bbox, _ in people:
+            label = labels.get(track_id)
+            if track_id not in needs_reid:
+                label = self.identity_cache.get_label(track_id)
+            if label is None:
+                label = f"ID: {track_id} - Not Identified"
 
             annotator.box_label(
-                [x1, y1, x2, y2],
+                list(bbox),
                 label,
-                color=self.user_colors.get(
-                    self.yolo_id_to_user.get(track_id, track_id),
-                    colors(track_id, True),
-                ),
+                color=self.track_registry.color_of(track_id),
             )
 
-        if (
-            self.settings["performer_tracker"]["tracked_user_id"]
-            in self.yolo_id_to_user.values()
+        for track_id in self.track_registry.evict_stale(frame_count):
+            self.identity_cache.forget(track_id)
+            self.forget_track(track_id)
+
+        if any(
+            self.track_registry.is_tracked(identity)
+            for identity in self.followed_performers
         ):
-            self.update_light_position(track_masks, frame, annotator)
+            self.update_light_position(
+                track_boxes, frame, annotator, capture_time
+            )
 
     def is_bbox_valid(self, x1, y1, x2, y2, frame):
         """
@@ -356,6 +888,7 @@ class PerformerTracker:
         track_id,
         database,
         uncertain_database,
+        match=None,
     ):
         """
         Handle descriptors extracted from a person's image and update tracking
@@ -367,11 +900,17 @@ class PerformerTracker:
         :param track_id: Track ID assigned by YOLO.
         :param database: Database of known persons.
         :param uncertain_database: Database of uncertain identities.
+        :param match: (user ID, score) of the descriptors already matched
+                      against the database (optional).
+        :return: Label for the bounding box, or None if the track has no
+                 identity yet.
         """
         if descriptors is not None and descriptors.size > 0:
-            match_id, score = self.reid_model.match_descriptors(
-                descriptors, database, threshold=15
-            )
+            if match is None:
+                match = self.reid_model.match_descriptors(
+                    descriptors, database, threshold=self.match_threshold
+                )
+            match_id, score = match
 
             if match_id:
                 self.save_image(
@@ -380,14 +919,13 @@ class PerformerTracker:
                     match_id,
                     self.settings["performer_tracker"]["user_folder"],
                 )
-                self.track_histories[track_id].append((match_id, score))
+                self.track_registry.add_vote(track_id, match_id, score)
             else:
                 self.handle_uncertain_matches(
                     descriptors, person_image, track_id, uncertain_database
                 )
 
-        if len(self.track_histories[track_id]) > 0:
-            self.update_track_histories(track_id)
+        return self.track_registry.label_of(track_id)
 
     def handle_uncertain_matches(
         self, descriptors, person_image, track_id, uncertain_database
@@ -402,7 +940,9 @@ class PerformerTracker:
         """
         uncertain_match_id, uncertain_score = (
             self.reid_model.match_descriptors(
-                descriptors, uncertain_database, threshold=20
+                descriptors,
+                uncertain_database,
+                threshold=self.uncertain_threshold,
             )
         )
 
@@ -413,27 +953,25 @@ class PerformerTracker:
                 uncertain_match_id,
                 self.settings["performer_tracker"]["uncertain_folder"],
             )
-            self.track_histories[track_id].append(
-                (uncertain_match_id, uncertain_score)
+            self.track_registry.add_vote(
+                track_id, uncertain_match_id, uncertain_score
             )
         else:
-            performer_track = self.settings["performer_tracker"]
-            uncertain_folder = performer_track["uncertain_folder"]
-            new_uncertain_id = f'uncertain_{
-                len(os.listdir(uncertain_folder))
-            }'
-            uncertain_database[new_uncertain_id] = [descriptors]
+            new_uncertain_id = f"uncertain_{self.next_uncertain_index}"
+            self.next_uncertain_index += 1
+            uncertain_database.add(new_uncertain_id, descriptors)
             self.save_image(
                 None,
                 person_image,
                 new_uncertain_id,
                 self.settings["performer_tracker"]["uncertain_folder"],
             )
-            self.track_histories[track_id].append((new_uncertain_id, 0))
+            self.track_registry.add_vote(track_id, new_uncertain_id, 0)
 
     def save_image(self, frame_count, person_image, match_id, folder):
         """
-        Save an image of the person to the specified folder.
+        Queue an image of the person to be saved to the specified folder by
+        the background image writer.
 
         :param frame_count: Current frame count.
         :param person_image: Cropped image of the person.
@@ -446,39 +984,7 @@ class PerformerTracker:
             % self.settings["performer_tracker"]["save_interval"]
             == 0
         ):
-            user_folder = os.path.join(folder, match_id)
-            os.makedirs(user_folder, exist_ok=True)
-            img_name = f"{uuid.uuid4()}.jpg"
-            img_path = os.path.join(user_folder, img_name)
-            cv2.imwrite(img_path, person_image)
-
-    def update_track_histories(self, track_id):
-        """
-        Update track histories and determine the best match ID for the given
-        track ID.
-
-        :param track_id: Track ID assigned by YOLO.
-        :return: Label for the bounding box with the best match ID.
-        """
-        id_counts = defaultdict(int)
-        for id, score in self.track_histories[track_id]:
-            id_counts[id] += 1
-        best_match_id = max(id_counts, key=id_counts.get)
-        match_percentage = (
-            id_counts[best_match_id] / len(self.track_histories[track_id])
-        ) * 100
-        best_score = min(
-            score
-            for id, score in self.track_histories[track_id]
-            if id == best_match_id
-        )
-        label = (
-            f"ID: {track_id} - {best_match_id} ({match_percentage:.2f}%) "
-            f"Score: {best_score:.2f}"
-        )
-        self.yolo_id_to_user[track_id] = best_match_id
-        self.user_colors[best_match_id] = colors(len(self.user_colors), True)
-        return label
+            self.image_writer.submit(person_image, match_id, folder)
 
     def is_point_in_polygon(self, point, polygon):
         """
@@ -534,20 +1040,22 @@ class PerformerTracker:
                 closest_point = proj_point
         return closest_point
 
-    def update_light_position(self, track_masks, frame, annotator):
+    def update_light_position(
+        self, track_boxes, frame, annotator, capture_time=None
+    ):
         """
-        Update the light position based on the tracked user's location.
+        Update the positions of the performers followed by fixtures.
 
-        :param track_masks: List of tracked IDs and their corresponding masks.
+        :param track_boxes: List of tracked IDs and their bounding boxes.
         :param frame: Current video frame.
         :param annotator: Annotator object for drawing on the frame.
+        :param capture_time: Monotonic capture time of the frame, used to
+                             update the motion model (optional).
         """
-        for track_id, mask in track_masks:
-            if (
-                self.yolo_id_to_user.get(track_id)
-                == self.settings["performer_tracker"]["tracked_user_id"]
-            ):
-                x1, y1, x2, y2 = map(int, seg_to_bbox(mask))
+        for track_id, box in track_boxes:
+            identity = self.track_registry.identity_of(track_id)
+            if identity in self.followed_performers:
+                x1, y1, x2, y2 = map(int, box)
                 center_point = np.array(
                     [[get_center_point([x1, y1, x2, y2])]], dtype=np.float32
                 )
@@ -562,7 +1070,12 @@ class PerformerTracker:
                     f"Real-world coords: {real_world_coords}"
                 )
 
-                self.real_world_point = real_world_coords
+                self.set_performer_point(identity, real_world_coords)
+                if capture_time is not None:
+                    self.motion_model.update(
+                        track_id, real_world_coords, capture_time
+                    )
+                    self.followed_tracks[identity] = track_id
 
                 cv2.circle(
                     frame,
@@ -573,61 +1086,44 @@ class PerformerTracker:
                 )
                 annotator.result = frame
 
-    def perform_homography(self, frame):
+    def render_homography_preview(self, frame):
         """
-        Perform homography transformation on the input frame.
+        Render the stage view of a frame at display resolution, marking the
+        followed performer. Only tracked points are transformed otherwise,
+        so this is just for display.
 
-        :param frame: Input video frame.
-        :return: Transformed frame.
+        :param frame: Processed video frame.
+        :return: The stage view, or None without four source points.
         """
-        if len(self.src_points) == 4:
-            transformed_frame = cv2.warpPerspective(
-                frame,
-                self.h,
-                (int(self.target_width), int(self.target_height)),
+        if len(self.src_points) != 4:
+            return None
+        display_size = (frame.shape[1], frame.shape[0])
+        if self.preview_maps is None or self.preview_maps[0] != display_size:
+            self.preview_maps = (
+                display_size,
+                compute_remap_maps(
+                    self.h,
+                    (self.target_width, self.target_height),
+                    display_size,
+                ),
             )
-            return transformed_frame
-        return frame
-
-    def perform_crop(self, frame):
-        """
-        Perform cropping on the input frame based on settings.
-
-        :param frame: Input video frame.
-        :return: Cropped frame.
-        """
-        crop_points = np.array(
-            self.settings["stage_zone"]["crop_points"], dtype=np.float32
-        )
-
-        if (
-            self.settings["stage_zone"]["enable_homography"]
-            and len(crop_points) == 4
-        ):
-            crop_points = cv2.perspectiveTransform(
-                np.array([crop_points], dtype=np.float32), self.h
-            )[0]
-
-        crop_points[:, 0] = np.clip(crop_points[:, 0], 0, frame.shape[1] - 1)
-        crop_points[:, 1] = np.clip(crop_points[:, 1], 0, frame.shape[0] - 1)
-
-        rect = cv2.boundingRect(crop_points)
-        x, y, w, h = rect
-        cropped = frame[y: y + h, x: x + w].copy()
-
-        crop_points -= crop_points.min(axis=0)
-        mask = np.zeros(cropped.shape[:2], dtype=np.uint8)
-        cv2.drawContours(
-            mask,
-            [crop_points.astype(np.int32)],
-            -1,
-            (255, 255, 255),
-            -1,
-            cv2.LINE_AA,
-        )
-
-        result = cv2.bitwise_and(cropped, cropped, mask=mask)
-        return result
+        preview = cv2.remap(frame, *self.preview_maps[1], cv2.INTER_LINEAR)
+
+        if self.real_world_point is not None:
+            scale = np.array(
+                [
+                    display_size[0] / self.target_width,
+                    display_size[1] / self.target_height,
+                ]
+            )
+            cv2.circle(
+                preview,
+                tuple(int(x) for x in self.real_world_point * scale),
+                10,
+                (0, 0, 255),
+                -1,
+            )
+        return preview
 
     @staticmethod
     def sort_points_clockwise(pts):
@@ -645,27 +1141,16 @@ class PerformerTracker:
         sorted_pts = sorted(pts, key=angle_from_center)
         return sorted_pts
 
-    @staticmethod
-    def resize_to_original_frame(frame, original_width, original_height):
-        """
-        Resize the frame to its original dimensions.
-
-        :param frame: Input video frame.
-        :param original_width: Original width of the frame.
-        :param original_height: Original height of the frame.
-        :return: Resized frame.
-        """
-        return cv2.resize(frame, (original_width, original_height))
-
     async def light_control_loop(self):
         """
-        Light control loop to update the light position based on performer
-        location.
-        """
-        x0, y0, z0 = self.settings["performer_tracker"]["light_coords"]
-        max_pan = self.settings["performer_tracker"]["max_pan"]
-        max_tilt = self.settings["performer_tracker"]["max_tilt"]
+        Light control loop to point every fixture at its performer's
+        location. Each tick writes all fixture channels into the universe
+        buffers and sends one Art-Net frame per universe.
 
+        Targets are predicted to the time the frame takes effect, and the
+        light statistics record the latency from the newest measurement's
+        capture to the send.
+        """
         self.logger.info("Starting light control loop")
 
         self.light_controller = LightController(
@@ -673,43 +1158,41 @@ class PerformerTracker:
             self.settings["performer_tracker"]["light_node_port"],
             self.settings["performer_tracker"]["light_universe_id"],
         )
-        self.light_controller.add_channel("pan", start=18)
-        self.light_controller.add_channel("tilt", start=20)
-        self.light_controller.add_channel("shutter", start=1)
-        self.light_controller.add_channel("dimmer", start=2)
+        self.fixture_map.patch(self.light_controller)
+        stage_height = int(self.settings["stage_zone"]["homography_height"])
 
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        last_tick = None
         try:
             while not self.stop:
+                start_time = time.monotonic()
                 self.logger.debug("Light control loop running")
-                if self.real_world_point is not None:
+                dt = 0.0 if last_tick is None else start_time - last_tick
+                last_tick = start_time
+                points, capture_time = self.predict_targets(
+                    start_time + self.light_output_latency
+                )
+                targets = {
+                    identity: (point[0], stage_height - point[1], 0)
+                    for identity, point in points.items()
+                }
+                if self.fixture_map.apply(self.light_controller, targets, dt):
                     self.logger.debug("Updating DMX")
-                    xt, yt, zt = (
-                        self.real_world_point[0],
-                        int(self.settings["stage_zone"]["homography_height"])
-                        - self.real_world_point[1],
-                        0,
-                    )
-                    target_pan, target_tilt = (
-                        PanTiltCalculator.calculate_pan_tilt(
-                            x0, y0, z0, xt, yt, zt
-                        )
-                    )
-
-                    pan_dmx = PanTiltCalculator.pan_angle_to_dmx(
-                        target_pan, max_pan
-                    )
-                    tilt_dmx = PanTiltCalculator.tilt_angle_to_dmx(
-                        target_tilt, max_tilt
-                    )
+                    self.light_controller.send()
 
-                    self.light_controller.set_channel_values("pan", [pan_dmx])
-                    self.light_controller.set_channel_values(
-                        "tilt", [tilt_dmx]
-                    )
-                    self.light_controller.set_channel_values("shutter", [25])
-                    self.light_controller.set_channel_values("dimmer", [255])
+                self.light_stats.record(
+                    start_time, time.monotonic(), capture_time
+                )
 
-                await asyncio.sleep(0.1)
+                # Schedule against a fixed clock so DMX timing does not drift
+                # with the time spent in this loop
+                next_tick += self.light_update_interval
+                delay = next_tick - loop.time()
+                if delay < 0:
+                    next_tick = loop.time()
+                    delay = 0
+                await asyncio.sleep(delay)
         except asyncio.CancelledError as e:
             self.logger.info("Light control loop cancelled")
             self.logger.error(e)
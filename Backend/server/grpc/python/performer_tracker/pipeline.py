@@ -0,0 +1,305 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides the building blocks of the threaded performer tracking
+pipeline: a bounded hand-off queue that drops stale items, per-stage
+statistics, a worker thread that runs one pipeline stage, and a scheduler
+that adapts how often frames are sent through the detector.
+"""
+
+import logging
+import math
+import queue
+import threading
+import time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class LatestQueue:
+    """
+    A bounded hand-off queue between two pipeline stages. When the queue is
+    full the oldest item is dropped, so a slow consumer always receives the
+    most recent items.
+    """
+
+    def __init__(self, maxsize: int = 1):
+        """
+        Initialize the LatestQueue.
+
+        Parameters:
+        maxsize (int): Maximum number of items held (default is 1)
+        """
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def put(self, item):
+        """
+        Put an item, dropping the oldest item if the queue is full.
+
+        Parameters:
+        item: The item to hand off
+        """
+        with self.lock:
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def get(self, timeout: float = None):
+        """
+        Get the oldest item held.
+
+        Parameters:
+        timeout (float): Seconds to wait for an item (default is None, which
+                         waits forever)
+
+        Returns:
+        The item, or None if no item arrived within the timeout
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class StageStats:
+    """
+    Throughput and latency statistics of a pipeline stage, smoothed with an
+    exponential moving average.
+    """
+
+    def __init__(self, name: str, smoothing: float = 0.1):
+        """
+        Initialize the StageStats.
+
+        Parameters:
+        name (str): The name of the stage
+        smoothing (float): Weight of the newest sample (default is 0.1)
+        """
+        self.name = name
+        self.smoothing = smoothing
+        self.count = 0
+        self.fps = 0.0
+        self.latency = 0.0
+        self.processing_time = 0.0
+        self.last_time = None
+        self.lock = threading.Lock()
+
+    def _smooth(self, average: float, sample: float) -> float:
+        """
+        Blend a new sample into a moving average.
+
+        Parameters:
+        average (float): The current average
+        sample (float): The new sample
+
+        Returns:
+        float: The updated average
+        """
+        if self.count <= 1:
+            return sample
+        return average + self.smoothing * (sample - average)
+
+    def record(
+        self,
+        start_time: float,
+        end_time: float,
+        capture_time: float = None,
+    ):
+        """
+        Record one processed item.
+
+        Parameters:
+        start_time (float): Monotonic time the stage started the item
+        end_time (float): Monotonic time the stage finished the item
+        capture_time (float): Monotonic time the frame was captured, used to
+                              measure end-to-end latency (optional)
+        """
+        with self.lock:
+            self.count += 1
+            if self.last_time is not None and end_time > self.last_time:
+                self.fps = self._smooth(
+                    self.fps, 1.0 / (end_time - self.last_time)
+                )
+            self.last_time = end_time
+            self.processing_time = self._smooth(
+                self.processing_time, end_time - start_time
+            )
+            if capture_time is not None:
+                self.latency = self._smooth(
+                    self.latency, end_time - capture_time
+                )
+
+    def snapshot(self) -> dict:
+        """
+        Get the current statistics.
+
+        Returns:
+        dict: Count, FPS, processing time and latency in milliseconds
+        """
+        with self.lock:
+            return {
+                "count": self.count,
+                "fps": round(self.fps, 1),
+                "processing_ms": round(self.processing_time * 1000, 1),
+                "latency_ms": round(self.latency * 1000, 1),
+            }
+
+
+class PipelineStage(threading.Thread):
+    """
+    A worker thread running one pipeline stage. It takes items from an
+    input queue, processes them and hands the results to an output queue.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        process,
+        input_queue: LatestQueue,
+        output_queue: LatestQueue = None,
+        stop_event: threading.Event = None,
+    ):
+        """
+        Initialize the PipelineStage.
+
+        Parameters:
+        name (str): The name of the stage
+        process (callable): Function taking an item and returning the item
+                            to hand off, or None to hand off nothing
+        input_queue (LatestQueue): Queue to take items from
+        output_queue (LatestQueue): Queue to hand results to (optional)
+        stop_event (threading.Event): Event that stops the stage (optional)
+        """
+        super().__init__(name=name, daemon=True)
+        self.process = process
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.stop_event = stop_event or threading.Event()
+        self.stats = StageStats(name)
+
+    def run(self):
+        """
+        Process items until the stop event is set.
+        """
+        logger.info(f"Pipeline stage {self.name} started")
+        while not self.stop_event.is_set():
+            item = self.input_queue.get(timeout=0.1)
+            if item is None:
+                continue
+
+            start_time = time.monotonic()
+            try:
+                result = self.process(item)
+            except Exception as e:
+                logger.exception(f"Pipeline stage {self.name} failed: {e}")
+                continue
+            self.stats.record(
+                start_time, time.monotonic(), item.get("capture_time")
+            )
+
+            if result is not None and self.output_queue is not None:
+                self.output_queue.put(result)
+        logger.info(f"Pipeline stage {self.name} stopped")
+
+
+class DetectionScheduler:
+    """
+    Chooses the stride at which frames are sent through the detector, so
+    that detection uses at most a share of the CPU time available at the
+    target output rate. Frames in between are covered by the motion model.
+    """
+
+    def __init__(
+        self,
+        target_fps: float = 30.0,
+        max_load: float = 0.7,
+        max_stride: int = 10,
+        smoothing: float = 0.1,
+    ):
+        """
+        Initialize the DetectionScheduler.
+
+        Parameters:
+        target_fps (float): Rate at which positions are output (default is
+                            30)
+        max_load (float): Share of the time between output frames that
+                          detection may use (default is 0.7)
+        max_stride (int): Largest stride, so tracks are never predicted for
+                          too long (default is 10)
+        smoothing (float): Weight of the newest inference time in its
+                           moving average (default is 0.1)
+        """
+        self.target_fps = target_fps
+        self.max_load = max_load
+        self.max_stride = max_stride
+        self.smoothing = smoothing
+        self.inference_time = None
+        self.stride = 1
+        self.frames_since_detection = None
+        self.lock = threading.Lock()
+
+    def should_detect(self) -> bool:
+        """
+        Decide whether the next frame goes through the detector.
+
+        Returns:
+        bool: True to run detection, False to use the motion model
+        """
+        with self.lock:
+            if (
+                self.frames_since_detection is None
+                or self.frames_since_detection + 1 >= self.stride
+            ):
+                self.frames_since_detection = 0
+                return True
+            self.frames_since_detection += 1
+            return False
+
+    def record_inference(self, duration: float):
+        """
+        Record the time a detection took and update the stride.
+
+        Parameters:
+        duration (float): Seconds the detection took
+        """
+        with self.lock:
+            if self.inference_time is None:
+                self.inference_time = duration
+            else:
+                self.inference_time += self.smoothing * (
+                    duration - self.inference_time
+                )
+            stride = math.ceil(
+                self.inference_time * self.target_fps / self.max_load
+            )
+            self.stride = min(max(stride, 1), self.max_stride)
+
+    def get_stats(self) -> dict:
+        """
+        Get the current stride and CPU headroom.
+
+        Returns:
+        dict: Stride, inference time in milliseconds and the share of time
+              left over at the target output rate
+        """
+        with self.lock:
+            if self.inference_time is None:
+                return {"stride": self.stride}
+            load = self.inference_time * self.target_fps / self.stride
+            return {
+                "stride": self.stride,
+                "inference_ms": round(self.inference_time * 1000, 1),
+                "headroom": round(1.0 - load, 2),
+            }
@@ -0,0 +1,415 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module publishes preview frames of the performer tracker without
+OpenCV windows, so the tracker can run headless under the gRPC server.
+
+Each preview stream is a ring buffer of downscaled frames in shared memory,
+written at a throttled rate. Other processes such as the GUI attach to it
+by name with a PreviewReader. An optional local MJPEG endpoint serves the
+streams to a browser, encoding frames only while somebody is watching and
+in its own threads, so detection is unaffected either way.
+
+Shared memory layout:
+    header: int64[8] magic, slots, width, height, channels, latest
+            sequence and two reserved fields
+    slot table: int64[slots, 2] sequence and capture time in nanoseconds
+                per slot, the sequence being -1 while a slot is written
+    slots: uint8[slots, height, width, channels] frames
+"""
+
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import resource_tracker, shared_memory
+import cv2
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAGIC = 0x50524556  # "PREV"
+HEADER_FIELDS = 8
+SLOT_FIELDS = 2
+
+
+def _views(buffer, slots, width, height, channels):
+    """
+    Get numpy views of the header, slot table and frames of a ring buffer.
+
+    Parameters:
+    buffer (memoryview): Shared memory buffer
+    slots (int): Number of frame slots
+    width (int): Frame width
+    height (int): Frame height
+    channels (int): Frame channels
+
+    Returns:
+    tuple: Header, slot table and frame views
+    """
+    header = np.ndarray((HEADER_FIELDS,), np.int64, buffer)
+    table_offset = header.nbytes
+    table = np.ndarray(
+        (slots, SLOT_FIELDS), np.int64, buffer, offset=table_offset
+    )
+    frames = np.ndarray(
+        (slots, height, width, channels),
+        np.uint8,
+        buffer,
+        offset=table_offset + table.nbytes,
+    )
+    return header, table, frames
+
+
+class PreviewRing:
+    """
+    A ring buffer of preview frames in shared memory, written by a single
+    process.
+    """
+
+    def __init__(self, name: str, width: int, height: int, slots: int = 4):
+        """
+        Initialize the PreviewRing, replacing a segment left behind by a
+        previous run.
+
+        Parameters:
+        name (str): Name of the shared memory segment
+        width (int): Frame width
+        height (int): Frame height
+        slots (int): Number of frame slots (default is 4)
+        """
+        self.name = name
+        self.size = (width, height)
+        channels = 3
+        nbytes = 8 * (HEADER_FIELDS + slots * SLOT_FIELDS) + (
+            slots * height * width * channels
+        )
+        try:
+            self.shm = shared_memory.SharedMemory(
+                name, create=True, size=nbytes
+            )
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(
+                name, create=True, size=nbytes
+            )
+
+        self.header, self.table, self.frames = _views(
+            self.shm.buf, slots, width, height, channels
+        )
+        self.table[:] = 0
+        self.header[:] = [MAGIC, slots, width, height, channels, 0, 0, 0]
+        self.sequence = 0
+        logger.info(
+            f"Publishing {width}x{height} preview frames to shared memory "
+            f"{name}"
+        )
+
+    def write(self, frame: np.ndarray, capture_time_ns: int):
+        """
+        Write a frame to the next slot, resizing it to the ring size.
+
+        Parameters:
+        frame (np.ndarray): BGR frame
+        capture_time_ns (int): Capture time of the frame in nanoseconds
+        """
+        self.sequence += 1
+        slot = self.sequence % len(self.frames)
+        self.table[slot, 0] = -1
+        if (frame.shape[1], frame.shape[0]) == self.size:
+            self.frames[slot] = frame
+        else:
+            cv2.resize(
+                frame,
+                self.size,
+                dst=self.frames[slot],
+                interpolation=cv2.INTER_AREA,
+            )
+        self.table[slot, 1] = capture_time_ns
+        self.table[slot, 0] = self.sequence
+        self.header[5] = self.sequence
+
+    def close(self):
+        """
+        Release and remove the shared memory segment.
+        """
+        del self.header, self.table, self.frames
+        self.shm.close()
+        self.shm.unlink()
+
+
+class PreviewReader:
+    """
+    Reads the newest frame of a PreviewRing, from any process.
+    """
+
+    def __init__(self, name: str, external: bool = True):
+        """
+        Initialize the PreviewReader by attaching to a ring buffer.
+
+        Parameters:
+        name (str): Name of the shared memory segment
+        external (bool): The reader runs in another process than the
+                         writer (default is True)
+
+        Raises:
+        FileNotFoundError: If no ring buffer of that name exists
+        ValueError: If the segment is not a preview ring buffer
+        """
+        self.shm = shared_memory.SharedMemory(name)
+        if external:
+            # Only the writer owns the segment; without this the resource
+            # tracker of a reading process would remove it when that
+            # process exits
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        magic, slots, width, height, channels = (
+            int(x) for x in np.ndarray((5,), np.int64, self.shm.buf)
+        )
+        if magic != MAGIC:
+            self.shm.close()
+            raise ValueError(f"{name} is not a preview ring buffer")
+        self.header, self.table, self.frames = _views(
+            self.shm.buf, slots, width, height, channels
+        )
+
+    def read(self, after: int = 0):
+        """
+        Copy the newest frame if it is newer than a sequence number.
+
+        Parameters:
+        after (int): Sequence number of the last frame read (default is 0)
+
+        Returns:
+        tuple: Sequence number, capture time in nanoseconds and frame, or
+               None if there is no newer frame
+        """
+        sequence = int(self.header[5])
+        if sequence <= after:
+            return None
+        slot = sequence % len(self.frames)
+        frame = self.frames[slot].copy()
+        capture_time_ns = int(self.table[slot, 1])
+        # The slot was overwritten while copying if its sequence changed
+        if self.table[slot, 0] != sequence:
+            return None
+        return sequence, capture_time_ns, frame
+
+    def close(self):
+        """
+        Detach from the ring buffer.
+        """
+        del self.header, self.table, self.frames
+        self.shm.close()
+
+
+class PreviewPublisher:
+    """
+    Publishes named preview streams at a throttled rate, and optionally
+    serves them as MJPEG over HTTP.
+    """
+
+    def __init__(
+        self,
+        prefix: str = "performer_tracker",
+        width: int = 640,
+        fps: float = 10.0,
+        slots: int = 4,
+        mjpeg_port=None,
+        jpeg_quality: int = 80,
+    ):
+        """
+        Initialize the PreviewPublisher.
+
+        Parameters:
+        prefix (str): Prefix of the shared memory segment names, each
+                      stream being named "<prefix>_<stream>" (default is
+                      "performer_tracker")
+        width (int): Width of the preview frames, the height keeping the
+                     aspect ratio of the first frame (default is 640)
+        fps (float): Maximum frames per second published per stream
+                     (default is 10)
+        slots (int): Frame slots per ring buffer (default is 4)
+        mjpeg_port (int): Local port of the MJPEG endpoint, or None to
+                          disable it (default is None)
+        jpeg_quality (int): JPEG quality of the MJPEG stream (default is
+                            80)
+        """
+        self.prefix = prefix
+        self.width = width
+        self.interval = 1.0 / fps
+        self.slots = slots
+        self.mjpeg_port = mjpeg_port
+        self.jpeg_quality = jpeg_quality
+        self.rings = {}
+        self.last_publish = {}
+        self.server = None
+        self.server_thread = None
+        self.lock = threading.Lock()
+        self.published = 0
+        self.throttled = 0
+
+    def ring_name(self, stream: str) -> str:
+        """
+        Get the shared memory segment name of a stream.
+
+        Parameters:
+        stream (str): Name of the stream
+
+        Returns:
+        str: Name of the shared memory segment
+        """
+        return f"{self.prefix}_{stream}"
+
+    def start(self):
+        """
+        Start the MJPEG endpoint if a port is configured.
+        """
+        if self.mjpeg_port is None or self.server is not None:
+            return
+        self.server = ThreadingHTTPServer(
+            ("127.0.0.1", self.mjpeg_port), self._handler_class()
+        )
+        self.server.daemon_threads = True
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self.server_thread.start()
+        logger.info(
+            f"Serving MJPEG previews on http://127.0.0.1:{self.mjpeg_port}/"
+            "<stream>.mjpg"
+        )
+
+    def stop(self):
+        """
+        Stop the MJPEG endpoint and remove the ring buffers.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server_thread.join()
+            self.server = None
+        with self.lock:
+            for ring in self.rings.values():
+                ring.close()
+            self.rings.clear()
+
+    def publish(self, stream: str, frame: np.ndarray, capture_time=None):
+        """
+        Publish a frame to a stream, unless the stream was published to
+        less than one interval ago.
+
+        Parameters:
+        stream (str): Name of the stream
+        frame (np.ndarray): BGR frame
+        capture_time (float): Monotonic capture time of the frame
+                              (optional, defaults to now)
+
+        Returns:
+        bool: True if the frame was published
+        """
+        now = time.monotonic()
+        if now - self.last_publish.get(stream, -self.interval) < (
+            self.interval
+        ):
+            self.throttled += 1
+            return False
+        self.last_publish[stream] = now
+
+        with self.lock:
+            ring = self.rings.get(stream)
+            if ring is None:
+                height = max(
+                    int(round(frame.shape[0] * self.width / frame.shape[1])),
+                    1,
+                )
+                ring = PreviewRing(
+                    self.ring_name(stream), self.width, height, self.slots
+                )
+                self.rings[stream] = ring
+            if capture_time is None:
+                capture_time = now
+            ring.write(frame, int(capture_time * 1e9))
+        self.published += 1
+        return True
+
+    def get_stats(self) -> dict:
+        """
+        Get the number of published and throttled frames.
+
+        Returns:
+        dict: Published and throttled frame counts and the streams
+        """
+        return {
+            "published": self.published,
+            "throttled": self.throttled,
+            "streams": sorted(self.rings),
+        }
+
+    def _handler_class(self):
+        """
+        Build the HTTP request handler class of the MJPEG endpoint.
+
+        Returns:
+        type: Request handler class bound to this publisher
+        """
+        publisher = self
+
+        class MJPEGHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stream = self.path.strip("/").removesuffix(".mjpg")
+                if stream not in publisher.rings:
+                    self.send_error(404, f"Unknown stream {stream}")
+                    return
+                publisher.serve_stream(self, stream)
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return MJPEGHandler
+
+    def serve_stream(self, handler, stream: str):
+        """
+        Send the frames of a stream as multipart JPEG until the client
+        disconnects or the publisher stops.
+
+        Parameters:
+        handler (BaseHTTPRequestHandler): Handler of the client request
+        stream (str): Name of the stream
+        """
+        reader = PreviewReader(self.ring_name(stream), external=False)
+        handler.send_response(200)
+        handler.send_header(
+            "Content-Type", "multipart/x-mixed-replace; boundary=frame"
+        )
+        handler.send_header("Cache-Control", "no-cache")
+        handler.end_headers()
+        sequence = 0
+        try:
+            while self.server is not None:
+                result = reader.read(sequence)
+                if result is None:
+                    time.sleep(self.interval / 2)
+                    continue
+                sequence, _, frame = result
+                ok, jpeg = cv2.imencode(
+                    ".jpg",
+                    frame,
+                    [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality],
+                )
+                if not ok:
+                    continue
+                handler.wfile.write(
+                    b"--frame\r\nContent-Type: image/jpeg\r\n"
+                    + f"Content-Length: {len(jpeg)}\r\n\r\n".encode()
+                    + jpeg.tobytes()
+                    + b"\r\n"
+                )
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug(f"MJPEG client of {stream} disconnected")
+        finally:
+            reader.close()
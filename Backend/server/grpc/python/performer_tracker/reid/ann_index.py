@@ -0,0 +1,110 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides an HNSWIndex class, an approximate nearest neighbour
+index over gallery descriptors built on hnswlib.
+
+hnswlib is an optional dependency. When it is not installed, ANN_AVAILABLE
+is False and galleries always use exact search.
+"""
+
+import logging
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ANN_AVAILABLE = hnswlib is not None
+SPACES = {"euclidean": "l2", "cosine": "cosine"}
+
+
+class HNSWIndex:
+    """
+    An HNSW graph over descriptors, labelled by their gallery row index.
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        metric: str = "euclidean",
+        capacity: int = 1024,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 128,
+    ):
+        """
+        Initialize an empty HNSWIndex.
+
+        Parameters:
+        dim (int): Length of a descriptor
+        metric (str): "euclidean" or "cosine" (default is "euclidean")
+        capacity (int): Initial number of descriptors the index can hold,
+                        doubled whenever it is exceeded (default is 1024)
+        m (int): Graph links per node (default is 16)
+        ef_construction (int): Candidate list size while inserting
+                               (default is 200)
+        ef_search (int): Candidate list size while searching, trading
+                         latency for recall (default is 128)
+
+        Raises:
+        ImportError: If hnswlib is not installed
+        """
+        if hnswlib is None:
+            raise ImportError("hnswlib is required for the HNSW index")
+        self.metric = metric
+        self.capacity = capacity
+        self.ef_search = ef_search
+        self.index = hnswlib.Index(space=SPACES[metric], dim=dim)
+        self.index.init_index(
+            max_elements=capacity, ef_construction=ef_construction, M=m
+        )
+        self.index.set_ef(ef_search)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, descriptors: np.ndarray, rows: np.ndarray):
+        """
+        Insert descriptors into the index.
+
+        Parameters:
+        descriptors (np.ndarray): Descriptors of shape (N, dim)
+        rows (np.ndarray): Gallery row index of each descriptor
+        """
+        required = self.size + len(descriptors)
+        if required > self.capacity:
+            while self.capacity < required:
+                self.capacity *= 2
+            self.index.resize_index(self.capacity)
+        self.index.add_items(descriptors, rows)
+        self.size = required
+
+    def search(self, queries: np.ndarray, k: int):
+        """
+        Find the approximate k nearest descriptors of every query.
+
+        Parameters:
+        queries (np.ndarray): Descriptors of shape (Q, dim)
+        k (int): Number of neighbours per query
+
+        Returns:
+        tuple: Distances and gallery row indices, both of shape (Q, k) and
+               sorted nearest first
+        """
+        # The candidate list must be at least as long as k
+        self.index.set_ef(max(self.ef_search, k))
+        rows, distances = self.index.knn_query(queries, k=k)
+        if self.metric == "euclidean":
+            # hnswlib reports squared L2 distances
+            distances = np.sqrt(np.maximum(distances, 0.0))
+        else:
+            distances = np.maximum(distances, 0.0)
+        return distances.astype(np.float32), rows.astype(np.int64)
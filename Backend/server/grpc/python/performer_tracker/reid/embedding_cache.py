@@ -0,0 +1,165 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides an EmbeddingCache class that stores the ReID
+descriptors of a database folder next to its images, so that the tracker
+only has to decode and embed images that are new or have changed since the
+last start.
+
+Descriptors are kept in one .npy matrix that is memory-mapped on load, with
+a JSON index mapping each image path, size and modification time to its row.
+The index records the row count and a CRC-32 of the matrix it was written
+with, and the cache is discarded when they do not match the matrix on disk
+or when the fingerprint of the model weights changes.
+"""
+
+import json
+import logging
+import os
+import zlib
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CACHE_NAME = ".embedding_cache"
+
+
+class EmbeddingCache:
+    """
+    A persistent store of the descriptors of every image in a folder.
+    """
+
+    def __init__(self, folder: str, fingerprint: str, dim: int = 512):
+        """
+        Initialize the EmbeddingCache.
+
+        Parameters:
+        folder (str): Database folder the cache is stored in
+        fingerprint (str): Fingerprint of the model weights the descriptors
+                           were computed with
+        dim (int): Length of a descriptor (default is 512)
+        """
+        self.matrix_path = os.path.join(folder, CACHE_NAME + ".npy")
+        self.index_path = os.path.join(folder, CACHE_NAME + ".json")
+        self.fingerprint = fingerprint
+        self.dim = dim
+        self.matrix = np.empty((0, dim), np.float32)
+        self.entries = {}
+
+    @staticmethod
+    def file_key(path: str) -> list:
+        """
+        Get the key an image is cached under, so that a replaced image is
+        embedded again.
+
+        Parameters:
+        path (str): Path of the image
+
+        Returns:
+        list: File size and modification time in nanoseconds
+        """
+        stat = os.stat(path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    @staticmethod
+    def checksum(matrix: np.ndarray) -> int:
+        """
+        Get the CRC-32 of a descriptor matrix, tying an index to the matrix
+        it was written with.
+
+        Parameters:
+        matrix (np.ndarray): Descriptor matrix
+
+        Returns:
+        int: CRC-32 of the matrix data
+        """
+        return zlib.crc32(np.ascontiguousarray(matrix).data)
+
+    def load(self) -> bool:
+        """
+        Load the cache index and memory-map the descriptor matrix.
+
+        Returns:
+        bool: True if a cache for the current weights was loaded
+        """
+        try:
+            with open(self.index_path, encoding="utf-8") as file:
+                index = json.load(file)
+            if index.get("fingerprint") != self.fingerprint:
+                logger.info("Model weights changed, rebuilding embeddings")
+                return False
+            matrix = np.load(self.matrix_path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.debug(f"No usable embedding cache: {e}")
+            return False
+
+        if matrix.ndim != 2 or matrix.shape[1] != self.dim:
+            return False
+        if index.get("rows") != len(matrix) or index.get(
+            "checksum"
+        ) != self.checksum(matrix):
+            logger.info("Embedding cache index does not match its matrix")
+            return False
+        self.matrix = matrix
+        self.entries = index["entries"]
+        return True
+
+    def lookup(self, relative_path: str, key: list):
+        """
+        Get the cached row of an image.
+
+        Parameters:
+        relative_path (str): Path of the image relative to the folder
+        key (list): Current key of the image from file_key
+
+        Returns:
+        int: Row of the image in the matrix, or None if the image is not
+             cached or has changed
+        """
+        entry = self.entries.get(relative_path)
+        if entry is None or entry[1:] != key:
+            return None
+        return entry[0]
+
+    def save(self, paths: list, descriptors: np.ndarray, keys: list):
+        """
+        Replace the cache with the given images and descriptors. Files are
+        written under temporary names and swapped in. The index records the
+        row count and checksum of its matrix, so if a save is interrupted
+        between the two swaps, the mismatch is detected on load.
+
+        Parameters:
+        paths (list): Paths of the images relative to the folder
+        descriptors (np.ndarray): Descriptors of shape (N, dim), in the same
+                                  order as paths
+        keys (list): Key of each image from file_key
+        """
+        descriptors = np.ascontiguousarray(descriptors, np.float32)
+        entries = {
+            path: [row] + key
+            for row, (path, key) in enumerate(zip(paths, keys))
+        }
+        index = {
+            "fingerprint": self.fingerprint,
+            "rows": len(descriptors),
+            "checksum": self.checksum(descriptors),
+            "entries": entries,
+        }
+
+        # np.save appends .npy to names without it
+        temporary_matrix = self.matrix_path[: -len(".npy")] + ".tmp.npy"
+        temporary_index = self.index_path + ".tmp"
+        try:
+            np.save(temporary_matrix, descriptors)
+            with open(temporary_index, "w", encoding="utf-8") as file:
+                json.dump(index, file)
+            os.replace(temporary_matrix, self.matrix_path)
+            os.replace(temporary_index, self.index_path)
+        except OSError as e:
+            logger.error(f"Failed to save embedding cache: {e}")
+            return
+        self.matrix = descriptors
+        self.entries = entries
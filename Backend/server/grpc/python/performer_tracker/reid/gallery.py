@@ -0,0 +1,401 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides a Gallery class that stores ReID descriptors in one
+contiguous float32 matrix with an identity index per row.
+
+Queries are matched against the whole gallery with a single matrix product,
+so the cost of matching grows with the BLAS throughput rather than with a
+Python loop over every stored descriptor. Once a gallery grows past a
+configurable size, nearest neighbour searches switch to an approximate HNSW
+index if hnswlib is installed, while small galleries keep exact search.
+
+Galleries are shared between the identity stage and gallery maintenance, so
+every access holds the gallery lock.
+"""
+
+import logging
+import threading
+import time
+import numpy as np
+from reid.ann_index import ANN_AVAILABLE, HNSWIndex
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+METRICS = ("euclidean", "cosine")
+# Default distance thresholds per metric. Euclidean distances between raw
+# OSNet descriptors run into the tens, while cosine distances lie in [0, 2]
+DEFAULT_THRESHOLDS = {
+    "euclidean": {"match": 15.0, "uncertain": 20.0, "merge": 10.0},
+    "cosine": {"match": 0.3, "uncertain": 0.4, "merge": 0.2},
+}
+INITIAL_CAPACITY = 256
+
+
+class Gallery:
+    """
+    A gallery of ReID descriptors grouped by identity.
+    """
+
+    def __init__(
+        self,
+        dim: int = 512,
+        metric: str = "euclidean",
+        ann_min_size: int = None,
+    ):
+        """
+        Initialize an empty Gallery.
+
+        Parameters:
+        dim (int): Length of a descriptor (default is 512)
+        metric (str): "euclidean" for the L2 distance between raw
+                      descriptors, or "cosine" for one minus the cosine
+                      similarity of L2-normalized descriptors (default is
+                      "euclidean")
+        ann_min_size (int): Gallery size from which searches use an HNSW
+                            index, or None to always search exactly
+                            (default is None)
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown gallery metric: {metric}")
+        self.dim = dim
+        self.metric = metric
+        self.size = 0
+        self._descriptors = np.empty((INITIAL_CAPACITY, dim), np.float32)
+        self._squared_norms = np.empty(INITIAL_CAPACITY, np.float32)
+        self._label_ids = np.empty(INITIAL_CAPACITY, np.int32)
+        self.identities = []
+        self.identity_index = {}
+        self.last_seen = {}
+        self.lock = threading.RLock()
+        self.ann_min_size = ann_min_size
+        self.ann_index = None
+        if ann_min_size is not None and not ANN_AVAILABLE:
+            logger.info("hnswlib is not installed, using exact search only")
+            self.ann_min_size = None
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, identity):
+        return identity in self.identity_index
+
+    @property
+    def descriptors(self) -> np.ndarray:
+        """
+        The stored descriptors, one row each.
+
+        Returns:
+        np.ndarray: View of shape (size, dim)
+        """
+        return self._descriptors[: self.size]
+
+    @property
+    def label_ids(self) -> np.ndarray:
+        """
+        The identity index of each stored descriptor.
+
+        Returns:
+        np.ndarray: View of shape (size,)
+        """
+        return self._label_ids[: self.size]
+
+    def _reserve(self, size: int):
+        """
+        Grow the storage so it holds at least the given number of rows.
+
+        Parameters:
+        size (int): Number of rows required
+        """
+        capacity = len(self._label_ids)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ("_descriptors", "_squared_norms", "_label_ids"):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], old.dtype)
+            new[: self.size] = old[: self.size]
+            setattr(self, name, new)
+
+    def _prepare(self, descriptors) -> np.ndarray:
+        """
+        Convert descriptors to a float32 matrix, normalized for the cosine
+        metric.
+
+        Parameters:
+        descriptors (np.ndarray): Descriptors of shape (dim,) or (N, dim)
+
+        Returns:
+        np.ndarray: Matrix of shape (N, dim)
+        """
+        descriptors = np.asarray(descriptors, np.float32).reshape(-1, self.dim)
+        if self.metric == "cosine":
+            norms = np.linalg.norm(descriptors, axis=1, keepdims=True)
+            descriptors = descriptors / np.maximum(norms, 1e-12)
+        return descriptors
+
+    def _append(self, identity: str, descriptors: np.ndarray) -> tuple:
+        """
+        Append prepared descriptors of an identity to the storage.
+
+        Parameters:
+        identity (str): The identity the descriptors belong to
+        descriptors (np.ndarray): Prepared descriptors of shape (N, dim)
+
+        Returns:
+        tuple: First and one past the last row written
+        """
+        if identity not in self.identity_index:
+            self.identity_index[identity] = len(self.identities)
+            self.identities.append(identity)
+
+        start, end = self.size, self.size + len(descriptors)
+        self._reserve(end)
+        self._descriptors[start:end] = descriptors
+        self._squared_norms[start:end] = np.einsum(
+            "ij,ij->i", descriptors, descriptors
+        )
+        self._label_ids[start:end] = self.identity_index[identity]
+        self.size = end
+        return start, end
+
+    def add(self, identity: str, descriptors):
+        """
+        Add descriptors of an identity to the gallery.
+
+        Parameters:
+        identity (str): The identity the descriptors belong to
+        descriptors (np.ndarray): Descriptors of shape (dim,) or (N, dim)
+        """
+        descriptors = self._prepare(descriptors)
+        with self.lock:
+            start, end = self._append(identity, descriptors)
+            self.last_seen[identity] = time.monotonic()
+            if self.ann_index is not None:
+                self.ann_index.add(descriptors, np.arange(start, end))
+            elif self.ann_min_size is not None and end >= self.ann_min_size:
+                self.build_ann_index()
+
+    def snapshot(self) -> tuple:
+        """
+        Copy the descriptors of every identity, for maintenance to work on
+        without holding the lock.
+
+        Returns:
+        tuple: Dict of descriptors by identity in insertion order, dict of
+               last seen monotonic times, and the gallery size at the time
+               of the snapshot
+        """
+        with self.lock:
+            order = np.argsort(self.label_ids, kind="stable")
+            counts = np.bincount(
+                self.label_ids, minlength=len(self.identities)
+            )
+            groups = np.split(self.descriptors[order], np.cumsum(counts)[:-1])
+            descriptors = {
+                identity: group
+                for identity, group in zip(self.identities, groups)
+                if len(group)
+            }
+            return descriptors, dict(self.last_seen), self.size
+
+    def rebuild(
+        self,
+        descriptors: dict,
+        snapshot_size: int,
+        merges: dict = None,
+    ):
+        """
+        Replace the gallery contents with maintained descriptors. Rows added
+        since the snapshot are kept, under their merged identity if their
+        identity was merged.
+
+        The new storage and HNSW index are built without holding the lock,
+        so matching carries on against the old contents until they are
+        swapped in.
+
+        Parameters:
+        descriptors (dict): Descriptors by identity to keep
+        snapshot_size (int): Gallery size when the snapshot was taken
+        merges (dict): Target identity of each merged identity (optional)
+        """
+        merges = merges or {}
+        rebuilt = Gallery(self.dim, self.metric, self.ann_min_size)
+        for identity, rows in descriptors.items():
+            rebuilt._append(identity, self._prepare(rows))
+        if self.ann_min_size is not None and (
+            rebuilt.size >= self.ann_min_size
+        ):
+            rebuilt.build_ann_index()
+
+        with self.lock:
+            added = self.descriptors[snapshot_size:]
+            added_identities = [
+                self.identities[label_id]
+                for label_id in self.label_ids[snapshot_size:]
+            ]
+            added_identities = [
+                merges.get(identity, identity) for identity in added_identities
+            ]
+            for identity, row in zip(added_identities, added):
+                start, end = rebuilt._append(identity, row[None, :])
+                if rebuilt.ann_index is not None:
+                    rebuilt.ann_index.add(row[None, :], np.arange(start, end))
+            if rebuilt.ann_index is None and self.ann_min_size is not None:
+                if rebuilt.size >= self.ann_min_size:
+                    rebuilt.build_ann_index()
+
+            for identity, seen in self.last_seen.items():
+                identity = merges.get(identity, identity)
+                if identity in rebuilt.identity_index:
+                    rebuilt.last_seen[identity] = max(
+                        seen, rebuilt.last_seen.get(identity, seen)
+                    )
+
+            self._descriptors = rebuilt._descriptors
+            self._squared_norms = rebuilt._squared_norms
+            self._label_ids = rebuilt._label_ids
+            self.size = rebuilt.size
+            self.identities = rebuilt.identities
+            self.identity_index = rebuilt.identity_index
+            self.last_seen = rebuilt.last_seen
+            self.ann_index = rebuilt.ann_index
+
+    def build_ann_index(self):
+        """
+        Build the HNSW index from every stored descriptor. Descriptors added
+        later are inserted incrementally.
+        """
+        self.ann_index = HNSWIndex(
+            self.dim, self.metric, capacity=max(2 * self.size, 1024)
+        )
+        self.ann_index.add(self.descriptors, np.arange(self.size))
+        logger.info(f"Built HNSW index over {self.size} descriptors")
+
+    def get(self, identity: str) -> np.ndarray:
+        """
+        Get the descriptors stored for an identity.
+
+        Parameters:
+        identity (str): The identity
+
+        Returns:
+        np.ndarray: Descriptors of shape (N, dim)
+        """
+        with self.lock:
+            label_id = self.identity_index.get(identity)
+            if label_id is None:
+                return np.empty((0, self.dim), np.float32)
+            return self.descriptors[self.label_ids == label_id]
+
+    def distances(self, queries) -> np.ndarray:
+        """
+        Compute the distance from every query to every stored descriptor.
+
+        Parameters:
+        queries (np.ndarray): Descriptors of shape (dim,) or (Q, dim)
+
+        Returns:
+        np.ndarray: Distances of shape (Q, size)
+        """
+        queries = self._prepare(queries)
+        with self.lock:
+            products = queries @ self.descriptors.T
+            squared_norms = self._squared_norms[: self.size]
+        if self.metric == "cosine":
+            return np.maximum(1.0 - products, 0.0)
+
+        # |q - g|^2 = |q|^2 + |g|^2 - 2 q.g, with the gallery norms cached
+        squared = np.einsum("ij,ij->i", queries, queries)[:, None]
+        squared = squared + squared_norms - 2.0 * products
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def search(self, queries, k: int = 1, exact: bool = False):
+        """
+        Find the k nearest stored descriptors of every query.
+
+        Parameters:
+        queries (np.ndarray): Descriptors of shape (dim,) or (Q, dim)
+        k (int): Number of neighbours per query (default is 1)
+        exact (bool): Search exactly even when an HNSW index is built
+                      (default is False)
+
+        Returns:
+        tuple: Distances and row indices, both of shape (Q, k) and sorted
+               nearest first. k is capped at the gallery size.
+        """
+        with self.lock:
+            k = min(k, self.size)
+            if self.ann_index is not None and not exact and k > 0:
+                return self.ann_index.search(self._prepare(queries), k)
+
+            distances = self.distances(queries)
+            if k == 0:
+                empty = np.empty((len(distances), 0))
+                return empty.astype(np.float32), empty.astype(np.int64)
+            if k < self.size:
+                indices = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            else:
+                indices = np.broadcast_to(
+                    np.arange(self.size), distances.shape
+                ).copy()
+            nearest = np.take_along_axis(distances, indices, axis=1)
+            order = np.argsort(nearest, axis=1)
+            return (
+                np.take_along_axis(nearest, order, axis=1),
+                np.take_along_axis(indices, order, axis=1),
+            )
+
+    def identity_distances(self, queries) -> np.ndarray:
+        """
+        Compute the distance from every query to the nearest stored
+        descriptor of every identity.
+
+        Parameters:
+        queries (np.ndarray): Descriptors of shape (dim,) or (Q, dim)
+
+        Returns:
+        np.ndarray: Distances of shape (Q, number of identities), infinite
+                    for identities without descriptors
+        """
+        with self.lock:
+            distances = self.distances(queries)
+            reduced = np.full(
+                (len(self.identities), len(distances)), np.inf, np.float32
+            )
+            np.minimum.at(reduced, self.label_ids, distances.T)
+            return reduced.T
+
+    def match(self, queries, threshold: float):
+        """
+        Match every query to its nearest identity.
+
+        Parameters:
+        queries (np.ndarray): Descriptors of shape (dim,) or (Q, dim)
+        threshold (float): Distance below which a match is accepted
+
+        Returns:
+        list: One (identity, distance) tuple per query. The identity is
+              None when the nearest identity is not within the threshold.
+        """
+        with self.lock:
+            queries = np.asarray(queries, np.float32).reshape(-1, self.dim)
+            if self.size == 0:
+                return [(None, float("inf"))] * len(queries)
+
+            distances, indices = self.search(queries, k=1)
+            now = time.monotonic()
+            matches = []
+            for distance, index in zip(distances[:, 0], indices[:, 0]):
+                distance = float(distance)
+                if distance < threshold:
+                    identity = self.identities[self.label_ids[index]]
+                    self.last_seen[identity] = now
+                    matches.append((identity, distance))
+                else:
+                    matches.append((None, distance))
+            return matches
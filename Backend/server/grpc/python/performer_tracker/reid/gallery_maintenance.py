@@ -0,0 +1,405 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides a GalleryMaintainer class that keeps ReID galleries
+bounded on a background thread, away from the identity stage.
+
+On every run the maintainer:
+- caps the descriptors of each identity to a diverse subset, chosen with
+  greedy k-centres so that different poses and lighting are kept
+- merges uncertain identities whose descriptors cluster together
+- evicts uncertain identities that have not been matched for a while
+- records the size of every gallery over time
+
+Merged and evicted uncertain identities can also be reorganised on disk, so
+that the next start loads the maintained gallery. Images saved into a merged
+folder while it is being moved are moved again on the next run, and only the
+most recently evicted folders are kept.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EVICTED_FOLDER = ".evicted"
+
+
+def pairwise_distances(a, b, metric):
+    """
+    Compute the distance between every pair of rows of two matrices.
+
+    Parameters:
+    a (np.ndarray): Matrix of shape (N, dim)
+    b (np.ndarray): Matrix of shape (M, dim)
+    metric (str): "euclidean" or "cosine"
+
+    Returns:
+    np.ndarray: Distances of shape (N, M)
+    """
+    if metric == "cosine":
+        a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+        b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+        return np.maximum(1.0 - a @ b.T, 0.0)
+    squared = (
+        np.einsum("ij,ij->i", a, a)[:, None]
+        + np.einsum("ij,ij->i", b, b)[None, :]
+        - 2.0 * (a @ b.T)
+    )
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def select_diverse(descriptors, count, metric):
+    """
+    Select a diverse subset of descriptors with greedy k-centres: start from
+    the descriptor nearest the mean, then repeatedly add the descriptor
+    farthest from those already selected.
+
+    Parameters:
+    descriptors (np.ndarray): Descriptors of shape (N, dim)
+    count (int): Number of descriptors to keep
+    metric (str): "euclidean" or "cosine"
+
+    Returns:
+    np.ndarray: The selected descriptors, at most count rows
+    """
+    if len(descriptors) <= count:
+        return descriptors
+    mean = descriptors.mean(axis=0, keepdims=True)
+    selected = [int(np.argmin(pairwise_distances(descriptors, mean, metric)))]
+    nearest = pairwise_distances(descriptors, descriptors[selected], metric)
+    nearest = nearest[:, 0]
+    while len(selected) < count:
+        index = int(np.argmax(nearest))
+        selected.append(index)
+        nearest = np.minimum(
+            nearest,
+            pairwise_distances(descriptors, descriptors[[index]], metric)[
+                :, 0
+            ],
+        )
+    return descriptors[selected]
+
+
+class GalleryMaintainer:
+    """
+    A background thread keeping registered galleries bounded.
+    """
+
+    def __init__(
+        self,
+        interval: float = 30.0,
+        max_per_identity: int = 20,
+        merge_threshold: float = 10.0,
+        stale_seconds: float = 900.0,
+        history_size: int = 120,
+        evicted_retention: int = 50,
+    ):
+        """
+        Initialize the GalleryMaintainer.
+
+        Parameters:
+        interval (float): Seconds between maintenance runs (default is 30)
+        max_per_identity (int): Descriptors kept per identity (default is
+                                20)
+        merge_threshold (float): Distance between the centres of two
+                                 uncertain identities below which they are
+                                 merged (default is 10)
+        stale_seconds (float): Seconds without a match after which an
+                               uncertain identity is evicted (default is
+                               900)
+        history_size (int): Gallery size samples kept per gallery (default
+                            is 120)
+        evicted_retention (int): Evicted identity folders kept on disk per
+                                 database folder (default is 50)
+        """
+        self.interval = interval
+        self.max_per_identity = max_per_identity
+        self.merge_threshold = merge_threshold
+        self.stale_seconds = stale_seconds
+        self.galleries = {}
+        self.history = {}
+        self.history_size = history_size
+        self.evicted_retention = evicted_retention
+        self.pending_merges = {}
+        self.merged = {}
+        self.evicted = 0
+        self.changes = deque()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def register(self, name, gallery, folder=None, uncertain=False):
+        """
+        Register a gallery to maintain.
+
+        Parameters:
+        name (str): Name the gallery is reported under
+        gallery (Gallery): The gallery
+        folder (str): Database folder of the gallery. Merged and evicted
+                      identities are reorganised in it when given (optional)
+        uncertain (bool): Merge and evict identities of this gallery
+                          (default is False)
+        """
+        self.galleries[name] = (gallery, folder, uncertain)
+        self.history[name] = deque(maxlen=self.history_size)
+
+    def start(self):
+        """
+        Start maintaining the registered galleries on a separate thread.
+        """
+        self.stop_event.clear()
+        self.thread = threading.Thread(
+            target=self._maintain_loop, name="gallery_maintenance", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the maintenance thread.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _maintain_loop(self):
+        """
+        Run maintenance at a fixed interval until stopped.
+        """
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.exception(f"Gallery maintenance failed: {e}")
+
+    def run_once(self):
+        """
+        Maintain every registered gallery once.
+        """
+        for name, (gallery, folder, uncertain) in self.galleries.items():
+            descriptors, last_seen, snapshot_size = gallery.snapshot()
+            merges, evicted = {}, []
+            if uncertain:
+                merges = self.find_merges(descriptors, gallery.metric)
+                for source, target in merges.items():
+                    descriptors[target] = np.concatenate(
+                        [descriptors[target], descriptors.pop(source)]
+                    )
+                    last_seen[target] = max(
+                        last_seen.get(target, 0), last_seen.get(source, 0)
+                    )
+                now = time.monotonic()
+                evicted = [
+                    identity
+                    for identity in descriptors
+                    if now - last_seen.get(identity, now) > self.stale_seconds
+                ]
+                for identity in evicted:
+                    del descriptors[identity]
+
+            for identity, rows in descriptors.items():
+                descriptors[identity] = select_diverse(
+                    rows, self.max_per_identity, gallery.metric
+                )
+            gallery.rebuild(descriptors, snapshot_size, merges)
+
+            if folder is not None:
+                self.reorganise_folder(folder, merges, evicted)
+            if merges or evicted:
+                self.changes.append((name, merges, evicted))
+            self.merged.update(merges)
+            self.evicted += len(evicted)
+            self.history[name].append(
+                (time.time(), len(gallery.identities), len(gallery))
+            )
+            logger.info(
+                f"Maintained {name} gallery: {len(gallery.identities)} "
+                f"identities, {len(gallery)} descriptors "
+                f"({len(merges)} merged, {len(evicted)} evicted)"
+            )
+
+    def find_merges(self, descriptors, metric):
+        """
+        Find identities whose descriptor centres lie within the merge
+        threshold of each other. Each cluster is merged into the identity
+        that was added first.
+
+        Parameters:
+        descriptors (dict): Descriptors by identity in insertion order
+        metric (str): "euclidean" or "cosine"
+
+        Returns:
+        dict: Target identity of each identity to merge
+        """
+        identities = list(descriptors)
+        if len(identities) < 2:
+            return {}
+        centres = np.stack(
+            [descriptors[identity].mean(axis=0) for identity in identities]
+        )
+        close = pairwise_distances(centres, centres, metric)
+        close = np.triu(close < self.merge_threshold, k=1)
+
+        # Union-find over the close pairs, keeping the earliest identity as
+        # the root of each cluster
+        parent = list(range(len(identities)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in zip(*np.nonzero(close)):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+        return {
+            identities[i]: identities[find(i)]
+            for i in range(len(identities))
+            if find(i) != i
+        }
+
+    def reorganise_folder(self, folder, merges, evicted):
+        """
+        Move the images of merged identities into their target folders and
+        move evicted identities out of the database folder.
+
+        Each identity is handled on its own, so one failure does not stop
+        the rest. A merged folder that is not empty after its images were
+        moved, as when images are still being saved into it, is moved again
+        on the next run.
+
+        Parameters:
+        folder (str): Database folder
+        merges (dict): Target identity of each merged identity
+        evicted (list): Evicted identities
+        """
+        pending = self.pending_merges.setdefault(folder, {})
+        pending.update(merges)
+        evicted = set(evicted)
+
+        for source in list(pending):
+            # Follow merges and evictions of the target since the source
+            # was merged into it
+            target = pending[source]
+            while target in pending and target != source:
+                target = pending[target]
+            if target in evicted:
+                del pending[source]
+                evicted.add(source)
+                continue
+
+            source_path = os.path.join(folder, source)
+            if not os.path.isdir(source_path):
+                del pending[source]
+                continue
+            target_path = os.path.join(folder, target)
+            try:
+                os.makedirs(target_path, exist_ok=True)
+                for name in os.listdir(source_path):
+                    os.replace(
+                        os.path.join(source_path, name),
+                        os.path.join(target_path, name),
+                    )
+                os.rmdir(source_path)
+                del pending[source]
+            except OSError as e:
+                logger.warning(
+                    f"Failed to merge {source_path} into {target_path}, "
+                    f"retrying on the next run: {e}"
+                )
+
+        evicted_folder = os.path.join(folder, EVICTED_FOLDER)
+        for identity in evicted:
+            source_path = os.path.join(folder, identity)
+            if not os.path.isdir(source_path):
+                continue
+            target_path = os.path.join(evicted_folder, identity)
+            if os.path.exists(target_path):
+                target_path += f"_{int(time.time())}"
+            try:
+                os.makedirs(evicted_folder, exist_ok=True)
+                shutil.move(source_path, target_path)
+                # Record when the identity was evicted for the retention
+                os.utime(target_path)
+            except OSError as e:
+                logger.error(f"Failed to evict {source_path}: {e}")
+
+        if evicted:
+            self.prune_evicted(evicted_folder)
+
+    def prune_evicted(self, evicted_folder):
+        """
+        Delete the oldest evicted identity folders beyond the retention.
+
+        Parameters:
+        evicted_folder (str): Folder of the evicted identities
+        """
+        try:
+            paths = [
+                os.path.join(evicted_folder, name)
+                for name in os.listdir(evicted_folder)
+            ]
+            paths.sort(key=os.path.getmtime, reverse=True)
+        except OSError as e:
+            logger.error(f"Failed to list {evicted_folder}: {e}")
+            return
+        for path in paths[self.evicted_retention:]:
+            try:
+                shutil.rmtree(path)
+            except OSError as e:
+                logger.error(f"Failed to delete {path}: {e}")
+
+    def pop_changes(self) -> list:
+        """
+        Take the identity merges and evictions made since the last call,
+        so the thread owning the tracks can relabel them.
+
+        Returns:
+        list: Tuples of (gallery name, merges, evicted identities)
+        """
+        changes = []
+        while self.changes:
+            changes.append(self.changes.popleft())
+        return changes
+
+    def get_stats(self) -> dict:
+        """
+        Get the current size of every gallery and the maintenance counts.
+
+        Returns:
+        dict: Identities and descriptors per gallery, and the number of
+              identities merged and evicted so far
+        """
+        stats = {
+            name: {
+                "identities": len(gallery.identities),
+                "descriptors": len(gallery),
+            }
+            for name, (gallery, _, _) in self.galleries.items()
+        }
+        stats["merged"] = len(self.merged)
+        stats["evicted"] = self.evicted
+        return stats
+
+    def get_history(self, name) -> list:
+        """
+        Get the size of a gallery over time.
+
+        Parameters:
+        name (str): Name the gallery was registered under
+
+        Returns:
+        list: Tuples of (unix time, identities, descriptors) per run
+        """
+        return list(self.history[name])
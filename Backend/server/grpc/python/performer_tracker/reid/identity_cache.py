@@ -0,0 +1,168 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides an IdentityCache class that remembers the identity
+resolved for each tracker track, so that ReID only runs when the cached
+identity may no longer be trusted.
+
+ReID is requested for a track when it is new, when its identity has not been
+refreshed for a number of frames, when its bounding box changes abruptly, or
+when it overlaps another track and the tracker may have swapped the ids.
+"""
+
+import logging
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Compute the intersection over union of every pair of boxes.
+
+    Parameters:
+    boxes_a (np.ndarray): Boxes of shape (N, 4) as (x1, y1, x2, y2)
+    boxes_b (np.ndarray): Boxes of shape (M, 4) as (x1, y1, x2, y2)
+
+    Returns:
+    np.ndarray: IoU matrix of shape (N, M)
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+
+class IdentityCache:
+    """
+    A cache of the identity resolved for each track, deciding per frame
+    which tracks need to be re-identified.
+    """
+
+    def __init__(
+        self,
+        refresh_interval: int = 30,
+        min_box_iou: float = 0.3,
+        overlap_iou: float = 0.1,
+    ):
+        """
+        Initialize the IdentityCache.
+
+        Parameters:
+        refresh_interval (int): Frames after which a cached identity is
+                                re-checked (default is 30)
+        min_box_iou (float): IoU with the previous box below which a box
+                             change counts as abrupt (default is 0.3)
+        overlap_iou (float): IoU with another track above which the tracks
+                             count as overlapping (default is 0.1)
+        """
+        self.refresh_interval = refresh_interval
+        self.min_box_iou = min_box_iou
+        self.overlap_iou = overlap_iou
+        self.entries = {}
+        self.hits = 0
+        self.misses = {"new": 0, "interval": 0, "moved": 0, "overlap": 0}
+
+    def plan(self, frame_count: int, detections: list) -> set:
+        """
+        Decide which tracks of a frame need ReID. Tracks that do not are
+        counted as cache hits and have their box updated.
+
+        Parameters:
+        frame_count (int): The current frame count
+        detections (list): Tuples of (track_id, (x1, y1, x2, y2))
+
+        Returns:
+        set: Track IDs that need ReID this frame
+        """
+        if not detections:
+            return set()
+
+        boxes = np.array([bbox for _, bbox in detections], dtype=np.float32)
+        overlaps = box_iou(boxes, boxes)
+        np.fill_diagonal(overlaps, 0)
+        overlapping = overlaps.max(axis=1) > self.overlap_iou
+
+        needs_reid = set()
+        for i, (track_id, bbox) in enumerate(detections):
+            entry = self.entries.get(track_id)
+            if entry is None:
+                reason = "new"
+            elif frame_count - entry["reid_frame"] >= self.refresh_interval:
+                reason = "interval"
+            elif box_iou(bbox, entry["bbox"])[0, 0] < self.min_box_iou:
+                reason = "moved"
+            elif overlapping[i]:
+                reason = "overlap"
+            else:
+                reason = None
+
+            if reason is None:
+                self.hits += 1
+                entry["bbox"] = bbox
+            else:
+                self.misses[reason] += 1
+                needs_reid.add(track_id)
+        return needs_reid
+
+    def update(self, track_id: int, bbox, frame_count: int, label: str):
+        """
+        Store the identity label resolved for a track by ReID.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+        bbox (tuple): Bounding box as (x1, y1, x2, y2)
+        frame_count (int): The frame count ReID ran on
+        label (str): Label of the resolved identity
+        """
+        self.entries[track_id] = {
+            "bbox": bbox,
+            "reid_frame": frame_count,
+            "label": label,
+        }
+
+    def get_label(self, track_id: int):
+        """
+        Get the cached label of a track.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+
+        Returns:
+        str: The cached label, or None if the track is unknown
+        """
+        entry = self.entries.get(track_id)
+        return entry["label"] if entry else None
+
+    def forget(self, track_id: int):
+        """
+        Remove a track from the cache.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+        """
+        self.entries.pop(track_id, None)
+
+    def get_stats(self) -> dict:
+        """
+        Get the cache hit and miss statistics.
+
+        Returns:
+        dict: Hits, misses per reason and the hit rate
+        """
+        misses = sum(self.misses.values())
+        total = self.hits + misses
+        return {
+            "hits": self.hits,
+            "misses": dict(self.misses),
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "cached_tracks": len(self.entries),
+        }
@@ -6,43 +6,88 @@ This module provides a PersonReID class for person re-identification using a
 custom OSNet model.
 
 The class includes methods to load the model, extract features, load a
-database of descriptors, and match descriptors.
+database of descriptors, and match descriptors. Crops are preprocessed with
+OpenCV and NumPy and run through the model as one batch, and databases are
+held as a Gallery so that matching is a single matrix product. Descriptors
+of database images are cached on disk, so only new images are embedded when
+a database is loaded. The model can run in PyTorch, ONNX Runtime or
+OpenVINO.
 """
 
 import os
 import cv2
+import hashlib
 import torch
 import logging
 import numpy as np
-import torchvision.transforms as transforms
 from torchreid.models import osnet_x1_0
+from reid.gallery import Gallery
+from reid.embedding_cache import EmbeddingCache
+from model_backends import (
+    CALIBRATION_SIZE,
+    folder_frames,
+    load_reid_backend,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+INPUT_SIZE = (128, 256)  # Width and height expected by OSNet
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+MAX_BATCH_SIZE = 32
+FEATURE_DIM = 512
+
 
 class PersonReID:
-    def __init__(self, model_path="models/osnet_x1_0.pth"):
+    def __init__(
+        self,
+        model_path="models/osnet_x1_0.pth",
+        metric="euclidean",
+        ann_min_size=None,
+        backend="pytorch",
+        int8=False,
+        calibration_folder=None,
+    ):
         """
         Initialize the PersonReID class.
 
         Parameters:
         model_path (str): Path to the pretrained OSNet model.
+        metric (str): Distance metric of the databases, "euclidean" or
+        "cosine".
+        ann_min_size (int): Database size from which matching uses an
+        approximate nearest neighbour index, or None for exact matching.
+        backend (str): Inference backend, "pytorch", "onnxruntime" or
+        "openvino".
+        int8 (bool): Run an int8 quantized model.
+        calibration_folder (str): Database folder whose images calibrate an
+        int8 model.
         """
         self.logger = logging.getLogger(__name__)
         self.model_path = model_path
+        self.metric = metric
+        self.ann_min_size = ann_min_size
         self.reid_model = self._load_custom_osnet_model()
         self.reid_model.eval()
-        self.transform = transforms.Compose(
-            [
-                transforms.ToPILImage(),
-                transforms.Resize((256, 128)),
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
-                ),
-            ]
+        self.weights_fingerprint = self._fingerprint_weights()
+        self.backend = load_reid_backend(
+            self.reid_model,
+            model_path,
+            self.weights_fingerprint,
+            backend=backend,
+            int8=int8,
+            input_size=INPUT_SIZE,
+            calibration_batches=lambda: self._calibration_batches(
+                calibration_folder
+            ),
+        )
+        # Descriptors differ between backends and between float and int8
+        # models, so each model actually loaded has its own cache
+        suffix = "-int8" if self.backend.quantized else ""
+        self.cache_fingerprint = (
+            f"{self.weights_fingerprint}-{backend}{suffix}"
         )
 
     def _load_custom_osnet_model(self):
@@ -64,6 +109,85 @@ class PersonReID:
             raise FileNotFoundError(f"Model not found at {self.model_path}")
         return model
 
+    def _fingerprint_weights(self):
+        """
+        Hash the model weights, so cached descriptors are invalidated when
+        the weights change.
+
+        Returns:
+        str: SHA-1 hex digest of the weights file.
+        """
+        digest = hashlib.sha1()
+        with open(self.model_path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _calibration_batches(self, folder):
+        """
+        Preprocess database images to calibrate a quantized model.
+
+        Parameters:
+        folder (str): Database folder to take images from.
+
+        Returns:
+        list: Preprocessed batches of one image each.
+        """
+        batches = []
+        for img in folder_frames(folder):
+            batches.append(self.preprocess([img]))
+            if len(batches) >= CALIBRATION_SIZE:
+                break
+        return batches
+
+    @staticmethod
+    def preprocess(images):
+        """
+        Resize and normalize image crops into a single input batch.
+
+        Channels are kept in the order they are given, as the model has
+        always been fed OpenCV frames directly.
+
+        Parameters:
+        images (list of np.ndarray): Input image crops.
+
+        Returns:
+        np.ndarray: Batch of shape (N, 3, 256, 128).
+        """
+        batch = np.empty(
+            (len(images), INPUT_SIZE[1], INPUT_SIZE[0], 3), dtype=np.float32
+        )
+        for i, image in enumerate(images):
+            batch[i] = cv2.resize(
+                image, INPUT_SIZE, interpolation=cv2.INTER_AREA
+            )
+        batch *= 1.0 / 255.0
+        batch -= MEAN
+        batch /= STD
+        return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+    def extract_reid_features_batch(self, images):
+        """
+        Extract re-identification features from several images with a single
+        forward pass per batch.
+
+        Parameters:
+        images (list of np.ndarray): Input image crops.
+
+        Returns:
+        np.ndarray: Extracted features of shape (N, 512).
+        """
+        if len(images) == 0:
+            return np.empty((0, FEATURE_DIM), dtype=np.float32)
+
+        features = []
+        for start in range(0, len(images), MAX_BATCH_SIZE):
+            batch = self.preprocess(images[start: start + MAX_BATCH_SIZE])
+            features.append(self.backend(batch))
+        features = np.concatenate(features).astype(np.float32, copy=False)
+        self.logger.debug(f"Extracted ReID features of shape {features.shape}")
+        return features
+
     def extract_reid_features(self, image):
         """
         Extract re-identification features from an image.
@@ -74,73 +198,115 @@ class PersonReID:
         Returns:
         np.ndarray: Extracted features.
         """
-        image = self.transform(image).unsqueeze(0)
-        with torch.no_grad():
-            features = self.reid_model(image).numpy().flatten()
-        self.logger.debug(f"Extracted ReID features of length {len(features)}")
-        return features
+        return self.extract_reid_features_batch([image])[0]
 
     def load_database(self, folder):
         """
         Load a database of user descriptors from a specified folder.
 
+        Descriptors cached from a previous load are reused for images that
+        have not changed, and only new or changed images are decoded and
+        embedded. The cache is then updated to match the folder.
+
         Parameters:
         folder (str): Path to the folder containing user images.
 
         Returns:
-        dict: Database of user descriptors.
+        Gallery: Database of user descriptors.
         """
         if not os.path.exists(folder):
             os.makedirs(folder, exist_ok=True)
 
-        database = {}
-        for user_folder in os.listdir(folder):
+        cache = EmbeddingCache(folder, self.cache_fingerprint, FEATURE_DIM)
+        cache.load()
+        paths, keys, user_ids, cached_rows = [], [], [], []
+        new_positions, new_descriptors = [], []
+        for user_folder in sorted(os.listdir(folder)):
             user_path = os.path.join(folder, user_folder)
-            if os.path.isdir(user_path):
-                user_descriptors = []
-                for img_name in os.listdir(user_path):
-                    img_path = os.path.join(user_path, img_name)
-                    img = cv2.imread(img_path)
+            if user_folder.startswith(".") or not os.path.isdir(user_path):
+                continue
+            images = []
+            for img_name in sorted(os.listdir(user_path)):
+                relative_path = os.path.join(user_folder, img_name)
+                key = cache.file_key(os.path.join(folder, relative_path))
+                row = cache.lookup(relative_path, key)
+                if row is None:
+                    img = cv2.imread(os.path.join(folder, relative_path))
                     if img is None:
                         continue
-                    descriptors = self.extract_reid_features(img)
-                    if descriptors is not None:
-                        user_descriptors.append(descriptors)
-                if user_descriptors:
-                    database[user_folder] = user_descriptors
+                    images.append(img)
+                    new_positions.append(len(paths))
+                paths.append(relative_path)
+                keys.append(key)
+                user_ids.append(user_folder)
+                cached_rows.append(row)
+            if images:
+                new_descriptors.append(
+                    self.extract_reid_features_batch(images)
+                )
+
+        descriptors = np.empty((len(paths), FEATURE_DIM), dtype=np.float32)
+        cached = [i for i, row in enumerate(cached_rows) if row is not None]
+        if cached:
+            # Read every reused descriptor from the memory map in one go
+            rows = [cached_rows[i] for i in cached]
+            descriptors[cached] = cache.matrix[rows]
+        if new_positions:
+            descriptors[new_positions] = np.concatenate(new_descriptors)
+        if new_positions or len(cached) != len(cache.entries):
+            cache.save(paths, descriptors, keys)
+
+        database = Gallery(
+            dim=FEATURE_DIM, metric=self.metric, ann_min_size=self.ann_min_size
+        )
+        user_ids = np.array(user_ids)
+        for user_id in dict.fromkeys(user_ids):
+            database.add(str(user_id), descriptors[user_ids == user_id])
         self.logger.info(
-            f"Loaded database with {len(database)} users from {folder}"
+            f"Loaded database with {len(database.identities)} users and "
+            f"{len(database)} descriptors from {folder} "
+            f"({len(new_positions)} newly embedded)"
         )
         return database
 
+    def match_descriptors_batch(self, descriptors, database, threshold=10):
+        """
+        Match several descriptors against a database in one matrix product.
+
+        Parameters:
+        descriptors (np.ndarray): Descriptors of shape (N, 512).
+        database (Gallery): Database of user descriptors.
+        threshold (float): Distance threshold for matching.
+
+        Returns:
+        list: One (user ID, score) tuple per descriptor. The user ID is None
+              if no match is found within the threshold.
+        """
+        if len(descriptors) == 0:
+            return []
+        matches = database.match(descriptors, threshold)
+        for match_id, score in matches:
+            if match_id:
+                self.logger.debug(f"Best match: {match_id} with score {score}")
+            else:
+                self.logger.debug(
+                    f"No match found within threshold. Best score: {score}"
+                )
+        return matches
+
     def match_descriptors(self, descriptors, database, threshold=10):
         """
         Match input descriptors against a database of descriptors.
 
         Parameters:
         descriptors (np.ndarray): Descriptors to match.
-        database (dict): Database of user descriptors.
+        database (Gallery): Database of user descriptors.
         threshold (float): Distance threshold for matching.
 
         Returns:
         tuple: Best matching user ID and score if a match is found within the
                threshold, otherwise (None, best_score).
         """
-        best_match_id = None
-        best_score = float("inf")
-        for user_id, user_descriptors in database.items():
-            for user_desc in user_descriptors:
-                distance = np.linalg.norm(descriptors - user_desc)
-                if distance < best_score:
-                    best_score = distance
-                    best_match_id = user_id
-        if best_score < threshold:
-            self.logger.debug(
-                f"Best match: {best_match_id} with score {best_score}"
-            )
-            return best_match_id, best_score
-        else:
-            self.logger.debug(
-                f"No match found within threshold. Best score: {best_score}"
-            )
-            return None, best_score
+        return self.match_descriptors_batch(
+            np.asarray(descriptors).reshape(1, -1), database, threshold
+        )[0]
@@ -0,0 +1,308 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides a TrackRegistry class holding the identity votes of
+every active track.
+
+Each track keeps its recent ReID matches together with running vote counts,
+so the best identity of a track is known without recounting its history.
+Tracks that have not been seen for a number of frames are evicted, so memory
+follows the number of people on stage rather than the length of the show.
+"""
+
+import logging
+from collections import Counter, deque
+from ultralytics.utils.plotting import colors
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TrackState:
+    """
+    The identity votes of a single track.
+    """
+
+    def __init__(self, history_size: int, frame_count: int):
+        """
+        Initialize the TrackState.
+
+        Parameters:
+        history_size (int): Number of recent matches that vote
+        frame_count (int): Frame count the track was first seen on
+        """
+        self.history = deque(maxlen=history_size)
+        self.votes = Counter()
+        self.best_identity = None
+        self.last_seen = frame_count
+
+    def add_vote(self, identity: str, score: float):
+        """
+        Add a match to the history, retiring the oldest match once the
+        history is full.
+
+        Parameters:
+        identity (str): Matched identity
+        score (float): Match distance
+        """
+        if len(self.history) == self.history.maxlen:
+            retired, _ = self.history[0]
+            self.votes[retired] -= 1
+            if self.votes[retired] == 0:
+                del self.votes[retired]
+        self.history.append((identity, score))
+        self.votes[identity] += 1
+
+        if (
+            self.best_identity not in self.votes
+            or self.votes[identity] > self.votes[self.best_identity]
+        ):
+            # The history is bounded, so this is a constant-size scan
+            self.best_identity = max(self.votes, key=self.votes.get)
+
+    def relabel(self, merges: dict, evicted: set) -> bool:
+        """
+        Rewrite the match history after gallery maintenance, moving votes
+        of merged identities to their target and dropping votes of evicted
+        identities.
+
+        Parameters:
+        merges (dict): Target identity of each merged identity
+        evicted (set): Evicted identities
+
+        Returns:
+        bool: True if any vote changed
+        """
+        if not any(
+            identity in merges or identity in evicted
+            for identity in self.votes
+        ):
+            return False
+        history = [
+            (merges.get(identity, identity), score)
+            for identity, score in self.history
+            if identity not in evicted
+        ]
+        self.history.clear()
+        self.history.extend(history)
+        self.votes = Counter(identity for identity, _ in history)
+        self.best_identity = (
+            max(self.votes, key=self.votes.get) if self.votes else None
+        )
+        return True
+
+    def best_score(self) -> float:
+        """
+        Get the best match distance of the best identity.
+
+        Returns:
+        float: The lowest distance among the best identity's matches
+        """
+        return min(
+            score
+            for identity, score in self.history
+            if identity == self.best_identity
+        )
+
+
+class TrackRegistry:
+    """
+    A registry of active tracks, their identity votes and identity colours.
+    """
+
+    def __init__(self, history_size: int = 10, max_unseen_frames: int = 90):
+        """
+        Initialize the TrackRegistry.
+
+        Parameters:
+        history_size (int): Number of recent matches that vote for the
+                            identity of a track (default is 10)
+        max_unseen_frames (int): Frames a track can go unseen before it is
+                                 evicted (default is 90)
+        """
+        self.history_size = history_size
+        self.max_unseen_frames = max_unseen_frames
+        self.tracks = {}
+        self.identity_tracks = Counter()
+        self.colors = {}
+        self.evicted = 0
+        self.frame_count = 0
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def touch(self, track_id: int, frame_count: int):
+        """
+        Mark a track as seen on a frame, registering it if it is new.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+        frame_count (int): The current frame count
+        """
+        self.frame_count = max(self.frame_count, frame_count)
+        track = self.tracks.get(track_id)
+        if track is None:
+            self.tracks[track_id] = TrackState(self.history_size, frame_count)
+        else:
+            track.last_seen = frame_count
+
+    def add_vote(self, track_id: int, identity: str, score: float):
+        """
+        Record a ReID match for a track.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+        identity (str): Matched identity
+        score (float): Match distance
+        """
+        self.touch(track_id, self.frame_count)
+        track = self.tracks[track_id]
+        previous = track.best_identity
+        track.add_vote(identity, score)
+        if track.best_identity != previous:
+            self._move_identity(previous, track.best_identity)
+        if identity not in self.colors:
+            self.colors[identity] = colors(len(self.colors), True)
+
+    def _move_identity(self, previous: str, current: str):
+        """
+        Update the count of tracks per best identity.
+
+        Parameters:
+        previous (str): Previous best identity of a track, or None
+        current (str): Current best identity of the track, or None
+        """
+        if previous is not None:
+            self.identity_tracks[previous] -= 1
+            if self.identity_tracks[previous] == 0:
+                del self.identity_tracks[previous]
+        if current is not None:
+            self.identity_tracks[current] += 1
+
+    def identity_of(self, track_id: int):
+        """
+        Get the best identity of a track.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+
+        Returns:
+        str: The identity with the most votes, or None if the track has no
+             votes
+        """
+        track = self.tracks.get(track_id)
+        return track.best_identity if track else None
+
+    def is_tracked(self, identity: str) -> bool:
+        """
+        Check whether any active track has an identity as its best identity.
+
+        Parameters:
+        identity (str): The identity
+
+        Returns:
+        bool: True if an active track is identified as the identity
+        """
+        return identity in self.identity_tracks
+
+    def color_of(self, track_id: int):
+        """
+        Get the annotation colour of a track. Colours are assigned once per
+        identity, and unidentified tracks are coloured by track ID.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+
+        Returns:
+        tuple: BGR colour
+        """
+        identity = self.identity_of(track_id)
+        if identity is None:
+            return colors(track_id, True)
+        return self.colors[identity]
+
+    def label_of(self, track_id: int):
+        """
+        Get the annotation label of a track.
+
+        Parameters:
+        track_id (int): Track ID assigned by the tracker
+
+        Returns:
+        str: Label with the best identity, its vote share and best score,
+             or None if the track has no votes
+        """
+        track = self.tracks.get(track_id)
+        if track is None or track.best_identity is None:
+            return None
+        match_percentage = (
+            track.votes[track.best_identity] / len(track.history)
+        ) * 100
+        return (
+            f"ID: {track_id} - {track.best_identity} "
+            f"({match_percentage:.2f}%) Score: {track.best_score():.2f}"
+        )
+
+    def relabel(self, merges: dict, evicted) -> list:
+        """
+        Update the votes of every track after gallery maintenance merged or
+        evicted identities.
+
+        Parameters:
+        merges (dict): Target identity of each merged identity
+        evicted (list): Evicted identities
+
+        Returns:
+        list: Track IDs whose votes changed
+        """
+        evicted = set(evicted)
+        changed = []
+        for track_id, track in self.tracks.items():
+            previous = track.best_identity
+            if track.relabel(merges, evicted):
+                changed.append(track_id)
+                if track.best_identity != previous:
+                    self._move_identity(previous, track.best_identity)
+        for identity in evicted.union(merges):
+            self.colors.pop(identity, None)
+        for track_id in changed:
+            identity = self.tracks[track_id].best_identity
+            if identity is not None and identity not in self.colors:
+                self.colors[identity] = colors(len(self.colors), True)
+        return changed
+
+    def evict_stale(self, frame_count: int) -> list:
+        """
+        Evict the tracks that have not been seen for too many frames.
+
+        Parameters:
+        frame_count (int): The current frame count
+
+        Returns:
+        list: Track IDs evicted
+        """
+        stale = [
+            track_id
+            for track_id, track in self.tracks.items()
+            if frame_count - track.last_seen > self.max_unseen_frames
+        ]
+        for track_id in stale:
+            track = self.tracks.pop(track_id)
+            self._move_identity(track.best_identity, None)
+        self.evicted += len(stale)
+        return stale
+
+    def get_stats(self) -> dict:
+        """
+        Get the number of active and evicted tracks.
+
+        Returns:
+        dict: Active tracks, evicted tracks and identities with a colour
+        """
+        return {
+            "active": len(self.tracks),
+            "evicted": self.evicted,
+            "identities": len(self.colors),
+        }
@@ -52,6 +52,37 @@ def apply_homography(point, homography_matrix):
     return transformed_point[:2]
 
 
+def compute_remap_maps(homography_matrix, stage_size, display_size):
+    """
+    Precompute the maps that render the stage view of a frame at display
+    resolution with cv2.remap, instead of warping the frame to the full
+    stage size.
+
+    Parameters:
+    homography_matrix (np.ndarray): Homography from frame to stage
+                                    coordinates.
+    stage_size (tuple): Stage width and height in stage units.
+    display_size (tuple): Width and height of the rendered view.
+
+    Returns:
+    tuple: Fixed-point map pair for cv2.remap.
+    """
+    width, height = display_size
+    # Stage pixel under the centre of every display pixel, as warped by
+    # cv2.warpPerspective to the full stage size
+    u, v = np.meshgrid(
+        (np.arange(width) + 0.5) * stage_size[0] / width - 0.5,
+        (np.arange(height) + 0.5) * stage_size[1] / height - 0.5,
+    )
+    stage_points = np.stack([u, v, np.ones_like(u)], axis=-1)
+    frame_points = stage_points @ np.linalg.inv(homography_matrix).T
+    frame_points = frame_points[..., :2] / frame_points[..., 2:]
+    map_x = frame_points[..., 0].astype(np.float32)
+    map_y = frame_points[..., 1].astype(np.float32)
+    logger.info(f"Computed homography remap maps for {width}x{height}")
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+
 def seg_to_bbox(mask):
     """
     Convert a segmentation mask to a bounding box.
@@ -69,7 +100,7 @@ def seg_to_bbox(mask):
         np.max(x_coords),
         np.max(y_coords),
     )
-    logger.info(f"Converted segmentation mask to bbox: {bbox}")
+    logger.debug(f"Converted segmentation mask to bbox: {bbox}")
     return bbox
 
 
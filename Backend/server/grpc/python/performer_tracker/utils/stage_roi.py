@@ -0,0 +1,113 @@
+"""
+Author: Jack Beaumont
+Date: 06/06/2024
+
+This module provides a StageROI class that crops frames to the bounding
+rectangle of the stage polygon before detection, optionally downscaling the
+crop and blanking everything outside the polygon, and maps detections back
+to full-frame coordinates.
+"""
+
+import cv2
+import logging
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class StageROI:
+    """
+    The region of a camera frame that contains the stage.
+    """
+
+    def __init__(
+        self,
+        crop_points,
+        frame_size: tuple,
+        scale: float = 1.0,
+        mask_outside: bool = True,
+    ):
+        """
+        Initialize the StageROI.
+
+        Parameters:
+        crop_points (list): Stage polygon in frame coordinates
+        frame_size (tuple): Frame width and height
+        scale (float): Factor the crop is resized by before detection
+                       (default is 1.0)
+        mask_outside (bool): Blank the parts of the crop outside the stage
+                             polygon (default is True)
+        """
+        points = np.array(crop_points, dtype=np.float32).reshape(-1, 2)
+        points[:, 0] = np.clip(points[:, 0], 0, frame_size[0] - 1)
+        points[:, 1] = np.clip(points[:, 1], 0, frame_size[1] - 1)
+        self.x, self.y, self.width, self.height = cv2.boundingRect(points)
+        self.scale = scale
+        self.size = (
+            max(int(round(self.width * scale)), 1),
+            max(int(round(self.height * scale)), 1),
+        )
+        self.offset = np.array([self.x, self.y], dtype=np.float32)
+
+        self.mask = None
+        if mask_outside:
+            polygon = (points - self.offset) * scale
+            self.mask = np.zeros((self.size[1], self.size[0]), np.uint8)
+            cv2.fillPoly(self.mask, [np.round(polygon).astype(np.int32)], 255)
+            if self.mask.all():
+                # A rectangular stage needs no masking
+                self.mask = None
+
+        logger.info(
+            f"Detecting in stage region {self.width}x{self.height} at "
+            f"({self.x}, {self.y}), scaled to {self.size[0]}x{self.size[1]}"
+        )
+
+    def apply(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Crop a frame to the stage region.
+
+        Parameters:
+        frame (np.ndarray): Full camera frame
+
+        Returns:
+        np.ndarray: The stage region, resized and masked as configured
+        """
+        region = frame[
+            self.y: self.y + self.height, self.x: self.x + self.width
+        ]
+        if self.scale != 1.0:
+            region = cv2.resize(
+                region, self.size, interpolation=cv2.INTER_AREA
+            )
+        if self.mask is not None:
+            region = cv2.bitwise_and(region, region, mask=self.mask)
+        return region
+
+    def to_frame_points(self, points: np.ndarray) -> np.ndarray:
+        """
+        Map points from stage region coordinates to frame coordinates.
+
+        Parameters:
+        points (np.ndarray): Points of shape (N, 2)
+
+        Returns:
+        np.ndarray: Points in frame coordinates
+        """
+        return np.asarray(points, np.float32) / self.scale + self.offset
+
+    def to_frame_boxes(self, boxes: np.ndarray) -> np.ndarray:
+        """
+        Map boxes from stage region coordinates to frame coordinates.
+
+        Parameters:
+        boxes (np.ndarray): Boxes of shape (N, 4) as (x1, y1, x2, y2)
+
+        Returns:
+        np.ndarray: Boxes in frame coordinates
+        """
+        return np.asarray(boxes, np.float32) / self.scale + np.tile(
+            self.offset, 2
+        )
@@ -6,6 +6,10 @@ This module provides functions for processing video frames, including
 adjusting brightness, exposure, contrast, saturation, mirroring, rotating,
 applying CLAHE (Contrast Limited Adaptive Histogram Equalization), and
 cropping.
+
+FramePreprocessor compiles the camera settings once into lookup tables and
+a cached CLAHE object, and gives the same result as process_frame without
+converting frames to floating point.
 """
 
 import cv2
@@ -67,19 +71,19 @@ def process_frame(
         adjusted_frame = cv2.resize(
             adjusted_frame, resolution, interpolation=cv2.INTER_AREA
         )
-        logger.info(f"Frame resized to {resolution}")
+        logger.debug(f"Frame resized to {resolution}")
 
     # Frame rotation
     if rotation != 0:
         adjusted_frame = rotate_frame(adjusted_frame, rotation)
-        logger.info(f"Frame rotated by {rotation * 90} degrees")
+        logger.debug(f"Frame rotated by {rotation * 90} degrees")
 
     # CLAHE (Contrast Limited Adaptive Histogram Equalization)
     if clahe == 1:
         adjusted_frame = CLAHE(
             adjusted_frame, np.clip(clahe_clip_limit / 40 * 50, 1, 100)
         )
-        logger.info(f"CLAHE applied with clip limit {clahe_clip_limit}")
+        logger.debug(f"CLAHE applied with clip limit {clahe_clip_limit}")
 
     # Adjust exposure and brightness
     if (brightness != 50) or (exposure != 50):
@@ -89,7 +93,7 @@ def process_frame(
         adjusted_frame = cv2.convertScaleAbs(
             frame_float, alpha=alpha, beta=beta
         )
-        logger.info(
+        logger.debug(
             f"Brightness adjusted to {brightness}, "
             f"Exposure adjusted to {exposure}"
         )
@@ -102,7 +106,7 @@ def process_frame(
             adjusted_frame - mean_intensity
         ) * contrast_factor + mean_intensity
         adjusted_frame = np.clip(adjusted_frame, 0, 255).astype(np.uint8)
-        logger.info(f"Contrast adjusted to {contrast}")
+        logger.debug(f"Contrast adjusted to {contrast}")
 
     # Adjust saturation
     if saturation != 50:
@@ -116,7 +120,7 @@ def process_frame(
         adjusted_frame = cv2.cvtColor(
             hsv_frame.astype("uint8"), cv2.COLOR_HSV2BGR
         )
-        logger.info(f"Saturation adjusted to {saturation}")
+        logger.debug(f"Saturation adjusted to {saturation}")
 
     return adjusted_frame
 
@@ -155,13 +159,223 @@ def CLAHE(img, clipLimit):
     Returns:
     - clahe_img: The image after applying CLAHE (numpy array).
     """
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2Lab)
     clahe = cv2.createCLAHE(clipLimit=clipLimit, tileGridSize=(8, 8))
+    return apply_clahe(img, clahe)
+
+
+def apply_clahe(img, clahe):
+    """
+    Apply a CLAHE object to the lightness channel of the input image.
+
+    Parameters:
+    - img: The input image (numpy array).
+    - clahe: CLAHE object created with cv2.createCLAHE.
+
+    Returns:
+    - clahe_img: The image after applying CLAHE (numpy array).
+    """
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2Lab)
     img[:, :, 0] = clahe.apply(img[:, :, 0])
     img = cv2.cvtColor(img, cv2.COLOR_Lab2BGR)
     return img
 
 
+class FramePreprocessor:
+    """
+    The adjustments of process_frame compiled from the camera settings.
+
+    Brightness and exposure are folded into a single 256-entry lookup
+    table. Contrast depends on the mean intensity of each frame, which is
+    taken from a histogram of the frame so the contrast table can be
+    composed with the brightness table and applied in the same pass.
+    Saturation is a lookup table on the S channel, and the CLAHE object is
+    created once. The tables are only rebuilt when the settings change.
+    """
+
+    SETTING_KEYS = (
+        "brightness",
+        "exposure",
+        "contrast",
+        "saturation",
+        "mirror_x",
+        "mirror_y",
+        "clahe",
+        "clahe_clip_limit",
+        "rotation",
+        "resolution",
+    )
+
+    def __init__(self, camera_settings=None):
+        """
+        Initialize the FramePreprocessor.
+
+        Parameters:
+        - camera_settings: The "camera" section of the settings (optional,
+                           defaults to no adjustments).
+        """
+        self.key = None
+        self.update(camera_settings or {})
+
+    def update(self, camera_settings):
+        """
+        Recompile the preprocessing if the camera settings changed.
+
+        Parameters:
+        - camera_settings: The "camera" section of the settings.
+
+        Returns:
+        - changed: True if the preprocessing was recompiled.
+        """
+        key = tuple(
+            (
+                tuple(camera_settings[name])
+                if name == "resolution" and camera_settings.get(name)
+                else camera_settings.get(name)
+            )
+            for name in self.SETTING_KEYS
+        )
+        if key == self.key:
+            return False
+        self.key = key
+        values = {
+            name: value
+            for name, value in zip(self.SETTING_KEYS, key)
+            if value is not None
+        }
+        self.compile(**values)
+        return True
+
+    def compile(
+        self,
+        brightness=50,
+        exposure=50,
+        contrast=50,
+        saturation=50,
+        mirror_x=0,
+        mirror_y=0,
+        clahe=0,
+        clahe_clip_limit=40,
+        rotation=0,
+        resolution=None,
+    ):
+        """
+        Build the lookup tables and CLAHE object for a set of adjustments.
+        The parameters are the same as those of process_frame.
+        """
+        if mirror_x == 1 and mirror_y == 1:
+            self.flip_code = -1
+        elif mirror_x == 1:
+            self.flip_code = 1
+        elif mirror_y == 1:
+            self.flip_code = 0
+        else:
+            self.flip_code = None
+        self.resolution = resolution
+        self.rotation = rotation
+
+        self.clahe = None
+        if clahe == 1:
+            self.clahe = cv2.createCLAHE(
+                clipLimit=np.clip(clahe_clip_limit / 40 * 50, 1, 100),
+                tileGridSize=(8, 8),
+            )
+
+        levels = np.arange(256, dtype=np.uint8)
+        self.intensity_lut = None
+        if (brightness != 50) or (exposure != 50):
+            self.intensity_lut = cv2.convertScaleAbs(
+                levels.astype(np.float32),
+                alpha=np.clip(exposure / 50, 0, 2),
+                beta=np.clip((brightness / 50 - 1) * 127.5, -127, 127.5),
+            ).ravel()
+
+        self.contrast_factor = None
+        if contrast != 50:
+            self.contrast_factor = np.clip(contrast / 50, 0, 2)
+
+        self.saturation_lut = None
+        if saturation != 50:
+            # Scaled in float32 like process_frame, so rounding matches
+            self.saturation_lut = np.clip(
+                levels.astype(np.float32)
+                * np.float32(np.clip(saturation / 50, 0, 2)),
+                0,
+                255,
+            ).astype(np.uint8)
+
+        logger.info(
+            f"Compiled frame preprocessing: brightness {brightness}, "
+            f"exposure {exposure}, contrast {contrast}, saturation "
+            f"{saturation}, CLAHE {clahe}, rotation {rotation * 90} degrees"
+        )
+
+    def contrast_lut(self, frame):
+        """
+        Build the lookup table of the intensity and contrast adjustments for
+        a frame.
+
+        Parameters:
+        - frame: The frame before the intensity adjustment (numpy array).
+
+        Returns:
+        - lut: Lookup table of 256 entries (numpy array).
+        """
+        levels = np.arange(256, dtype=np.float64)
+        if self.intensity_lut is not None:
+            levels = self.intensity_lut.astype(np.float64)
+        histogram = cv2.calcHist(
+            [frame.reshape(-1, 1)], [0], None, [256], [0, 256]
+        ).ravel()
+        mean_intensity = histogram @ levels / frame.size
+        adjusted = (
+            levels - mean_intensity
+        ) * self.contrast_factor + mean_intensity
+        return np.clip(adjusted, 0, 255).astype(np.uint8)
+
+    def __call__(self, frame):
+        """
+        Process a single video frame.
+
+        Parameters:
+        - frame: The input video frame to process (numpy array).
+
+        Returns:
+        - adjusted_frame: The processed video frame (numpy array).
+        """
+        adjusted_frame = frame
+        if self.flip_code is not None:
+            adjusted_frame = cv2.flip(adjusted_frame, self.flip_code)
+
+        if (
+            self.resolution is not None
+            and adjusted_frame.shape[1::-1] != self.resolution
+        ):
+            adjusted_frame = cv2.resize(
+                adjusted_frame, self.resolution, interpolation=cv2.INTER_AREA
+            )
+
+        if self.rotation != 0:
+            adjusted_frame = rotate_frame(adjusted_frame, self.rotation)
+
+        if self.clahe is not None:
+            adjusted_frame = apply_clahe(adjusted_frame, self.clahe)
+
+        lut = self.intensity_lut
+        if self.contrast_factor is not None:
+            lut = self.contrast_lut(np.ascontiguousarray(adjusted_frame))
+        if lut is not None:
+            adjusted_frame = cv2.LUT(adjusted_frame, lut)
+
+        if self.saturation_lut is not None:
+            hsv_frame = cv2.cvtColor(adjusted_frame, cv2.COLOR_BGR2HSV)
+            hsv_frame[:, :, 1] = cv2.LUT(
+                hsv_frame[:, :, 1], self.saturation_lut
+            )
+            adjusted_frame = cv2.cvtColor(hsv_frame, cv2.COLOR_HSV2BGR)
+
+        return adjusted_frame
+
+
 def crop_frame(frame, crop_points):
     """
     Crop the input frame to the region of interest defined by crop_points.
@@ -182,6 +396,6 @@ def crop_frame(frame, crop_points):
     x, y, w, h = cv2.boundingRect(roi_corners)
     cropped_frame = cropped_frame[y: y + h, x: x + w]
 
-    logger.info(f"Frame cropped to region defined by {crop_points}")
+    logger.debug(f"Frame cropped to region defined by {crop_points}")
 
     return cropped_frame
@@ -8,9 +8,20 @@ available for import when `from package import *` is used.
 from .script_data_handler import ScriptDataHandler
 from .text_search import TextSearch
 from .audio_buffer import AudioBuffer
+from .pointer_predictor import PointerPredictor
+from .transcript_filter import TranscriptFilter
+from .multi_channel_capture import MultiChannelCapture
+from .cue_engine import CueEngine, CueIndex
+from .transcript_writer import TranscriptWriter
 
 __all__ = [
     "ScriptDataHandler",
     "TextSearch",
-    "AudioBuffer"
+    "AudioBuffer",
+    "PointerPredictor",
+    "TranscriptFilter",
+    "MultiChannelCapture",
+    "CueEngine",
+    "CueIndex",
+    "TranscriptWriter",
 ]
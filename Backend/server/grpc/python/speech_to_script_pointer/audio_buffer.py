@@ -25,38 +25,61 @@ class AudioBuffer:
         RATE (int): The sample rate of the audio.
         CHUNK (int): The number of frames in the buffer.
         max_chunks (int): The maximum number of chunks to store in the buffer.
-        frames (deque): A deque to store audio frames.
+        input_device_index (int): Index of the input audio device.
+        channels (int): Number of input channels to capture.
+        frames (deque): A deque to store audio frames of the first channel.
+        channel_frames (list): One deque of audio frames per channel.
+        overflow_count (int): Number of chunks dropped on input overflow.
+        last_frame_time (float): Wall-clock time the newest frame was
+                                 captured.
         pa (pyaudio.PyAudio): The PyAudio instance.
         stream (pyaudio.Stream): The audio stream.
         thread (threading.Thread): The thread to collect audio data.
+        stop_event (threading.Event): Set to stop the collection thread.
     """
 
     RATE = 44100  # Samples collected per second
     CHUNK = 2048  # Number of frames in the buffer
 
-    def __init__(self, max_chunks: int = 200) -> None:
+    def __init__(
+        self,
+        max_chunks: int = 200,
+        input_device_index: int = 1,
+        channels: int = 1,
+    ) -> None:
         """
         Initialize the AudioBuffer instance.
 
         Parameters:
             max_chunks (int): Maximum number of chunks to store in the buffer.
+            input_device_index (int): Index of the input audio device.
+            channels (int): Number of input channels to capture. Each channel
+                            is deinterleaved into its own ring buffer.
         """
         self.max_chunks = max_chunks
-        self.frames = deque(maxlen=max_chunks)
+        self.input_device_index = input_device_index
+        self.channels = channels
+        self.channel_frames = [
+            deque(maxlen=max_chunks) for _ in range(channels)
+        ]
+        self.frames = self.channel_frames[0]
+        self.overflow_count = 0
+        self.last_frame_time = None
         self.pa = pyaudio.PyAudio()
         self.stream = None
         self._open_stream()
+        self.stop_event = threading.Event()
         self.thread = threading.Thread(target=self._collect_data, daemon=True)
 
     def _open_stream(self) -> None:
         """Helper method to open the audio stream."""
         self.stream = self.pa.open(
             format=pyaudio.paInt16,
-            channels=1,
+            channels=self.channels,
             rate=self.RATE,
             input=True,
             frames_per_buffer=self.CHUNK,
-            input_device_index=1,
+            input_device_index=self.input_device_index,
         )
 
     def __call__(self) -> np.ndarray:
@@ -109,23 +132,35 @@ class AudioBuffer:
 
     def stop(self) -> None:
         """Stop the data collection thread and close the audio stream."""
-        self.thread.join()  # Wait for the thread to finish before exiting
-        if self.stream is not None:
-            self.stream.stop_stream()
-            self.stream.close()
+        self.stop_event.set()
+        if self.thread.is_alive():
+            # The thread exits after its current read and closes the stream
+            self.thread.join()
+        else:
+            self._close_stream()
         self.pa.terminate()
+        self.pa = None
 
     def _collect_data(self) -> None:
         """Collect audio data in a separate thread."""
         try:
-            while True:
+            while not self.stop_event.is_set():
                 try:
                     # Get audio chunk and append to frames
                     raw_data = self.stream.read(self.CHUNK)
                     decoded = np.frombuffer(raw_data, np.int16)
-                    self.frames.append(decoded)
+                    if self.channels == 1:
+                        self.frames.append(decoded)
+                    else:
+                        decoded = decoded.reshape(-1, self.channels)
+                        for channel, frames in enumerate(self.channel_frames):
+                            frames.append(
+                                np.ascontiguousarray(decoded[:, channel])
+                            )
+                    self.last_frame_time = time.time()
                 except OSError as e:
                     if e.errno == pyaudio.paInputOverflowed:
+                        self.overflow_count += 1
                         logging.warning("Input overflowed. Frame dropped.")
                     elif e.errno == -9988:  # Stream closed error
                         logging.warning(
@@ -159,6 +194,7 @@ class AudioBuffer:
                 self.stream.close()
         except OSError as e:
             logging.warning(f"Stream already closed: {e}")
+        self.stream = None
 
     def __del__(self) -> None:
         """Ensure resources are cleaned up on deletion."""
@@ -0,0 +1,521 @@
+"""
+CueEngine Module
+
+This module provides functionality to fire cues when the script pointer
+passes their position in the script.
+
+Cues are loaded from the `/api/cues` endpoint of the backend server and kept
+in an index sorted by reading position, so that the cues passed by a pointer
+update are found with a binary search regardless of how many cues the show
+has. Edits are applied to the index as the backend server broadcasts them
+over its WebSocket, with the cues reloaded in full whenever the connection
+is (re)established. Without the websocket-client package, the cues are
+polled instead.
+
+A reading position is the distance from the top of the first page, with
+the pages stacked in order. The script editor stores cue positions on that
+scale already, offsetting each page by the height of the page it is on,
+while search matches give a page number and a distance from the bottom of
+that page.
+
+Classes:
+    CueIndex - Sorted index of cue positions with incremental updates.
+    CueEngine - Loads cues, follows the pointer and publishes fired cues.
+
+Logging:
+    Configured to log information, warnings, and errors to standard output.
+"""
+
+import bisect
+import json
+import logging
+import sys
+import threading
+import time
+import urllib.request
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+# Configure logging for the CueEngine class
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+# Use the same logger instance
+logger = logging.getLogger("speech_to_script_pointer")
+logger.setLevel(logging.INFO)
+
+# Constants
+CUES_URL = "http://localhost:4000/api/cues"
+CHANGES_URL = "ws://localhost:4000"
+CUE_FIRE_TOPIC = "local_server/cues/fire"
+PAGE_HEIGHT = 792  # Used for pages whose height is not known
+REARM_DISTANCE = PAGE_HEIGHT / 4  # Backward jump that re-arms passed cues
+MAX_FORWARD_JUMP = PAGE_HEIGHT / 2  # Forward jump that skips passed cues
+REFRESH_INTERVAL = 5.0
+
+
+class CueIndex:
+    """
+    CueIndex class to keep cues sorted by their reading position.
+
+    Attributes:
+        positions (list): Sorted reading positions of the cues.
+        ids (list): Cue ids, in the same order as `positions`.
+        cues (dict): Cue annotation and position by cue id.
+    """
+
+    def __init__(self):
+        """Initialize an empty CueIndex object."""
+        self.positions = []
+        self.ids = []
+        self.cues = {}
+
+    def __len__(self):
+        """
+        Define the length of the index.
+
+        Returns:
+            int: Number of indexed cues.
+        """
+        return len(self.ids)
+
+    def add(self, cue_id, position, cue):
+        """
+        Add a cue to the index, replacing any cue with the same id.
+
+        Parameters:
+            cue_id (str): Id of the cue.
+            position (float): Reading position of the cue.
+            cue (dict): The cue annotation.
+        """
+        if cue_id in self.cues:
+            self.remove(cue_id)
+        index = bisect.bisect_right(self.positions, position)
+        self.positions.insert(index, position)
+        self.ids.insert(index, cue_id)
+        self.cues[cue_id] = (position, cue)
+
+    def remove(self, cue_id):
+        """
+        Remove a cue from the index.
+
+        Parameters:
+            cue_id (str): Id of the cue.
+        """
+        if cue_id not in self.cues:
+            return
+        position, _ = self.cues.pop(cue_id)
+        index = bisect.bisect_left(self.positions, position)
+        while self.ids[index] != cue_id:
+            index += 1
+        del self.positions[index]
+        del self.ids[index]
+
+    def get(self, cue_id):
+        """
+        Get a cue annotation by id.
+
+        Parameters:
+            cue_id (str): Id of the cue.
+
+        Returns:
+            dict: The cue annotation, or None if it is not indexed.
+        """
+        entry = self.cues.get(cue_id)
+        return entry[1] if entry else None
+
+    def between(self, start, end):
+        """
+        Get the cues with a position in the half-open range (start, end].
+
+        Parameters:
+            start (float): Exclusive start position.
+            end (float): Inclusive end position.
+
+        Returns:
+            list: Tuples of (position, cue) in reading order.
+        """
+        first = bisect.bisect_right(self.positions, start)
+        last = bisect.bisect_right(self.positions, end)
+        return [self.cues[cue_id] for cue_id in self.ids[first:last]]
+
+
+class CueEngine:
+    """
+    CueEngine class to fire cues as the script pointer passes them.
+
+    Attributes:
+        mqtt_controller (object): MQTT controller for publishing fired cues.
+        cues_url (str): URL of the cues endpoint.
+        changes_url (str): URL of the WebSocket broadcasting cue changes.
+        page_heights (dict): Height of each script page in PDF points, by
+                             page number.
+        page_height (float): Height of pages missing from `page_heights`.
+        rearm_distance (float): Distance of a backward jump that re-arms the
+                                cues between the new and old positions.
+        max_forward_jump (float): Distance of a forward jump that moves the
+                                  pointer without firing the cues passed.
+        refresh_interval (float): Seconds between cue reloads, or between
+                                  attempts to reconnect to the change feed.
+        index (CueIndex): Index of the cues.
+        last_position (float): Reading position of the last pointer update.
+        high_water (float): Furthest position cues have been fired up to.
+    """
+
+    def __init__(
+        self,
+        mqtt_controller=None,
+        cues_url=CUES_URL,
+        changes_url=CHANGES_URL,
+        page_heights=None,
+        page_height=PAGE_HEIGHT,
+        rearm_distance=REARM_DISTANCE,
+        max_forward_jump=MAX_FORWARD_JUMP,
+        refresh_interval=REFRESH_INTERVAL,
+    ):
+        """
+        Initialize the CueEngine object.
+
+        Parameters:
+            mqtt_controller (object, optional): MQTT controller for
+                                                publishing fired cues.
+            cues_url (str, optional): URL of the cues endpoint.
+            changes_url (str, optional): URL of the WebSocket broadcasting
+                                         cue changes.
+            page_heights (dict, optional): Height of each script page in
+                                           PDF points, by page number.
+            page_height (float, optional): Height of pages missing from
+                                           `page_heights`.
+            rearm_distance (float, optional): Distance of a backward jump
+                                              that re-arms passed cues.
+            max_forward_jump (float, optional): Distance of a forward jump
+                                                that skips passed cues.
+            refresh_interval (float, optional): Seconds between cue reloads
+                                                or reconnection attempts.
+        """
+        self.mqtt_controller = mqtt_controller
+        self.cues_url = cues_url
+        self.changes_url = changes_url
+        self.page_heights = dict(page_heights or {})
+        self.page_height = page_height
+        if not self.page_heights:
+            logger.warning(
+                f"Script page heights unknown, assuming {page_height} points"
+            )
+        self.rearm_distance = rearm_distance
+        self.max_forward_jump = max_forward_jump
+        self.refresh_interval = refresh_interval
+        self.index = CueIndex()
+        self.last_position = None
+        self.high_water = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def get_page_height(self, page):
+        """
+        Get the height of a script page.
+
+        Parameters:
+            page (int): Page number, starting at 1.
+
+        Returns:
+            float: The page height in PDF points.
+        """
+        return self.page_heights.get(page, self.page_height)
+
+    def page_offset(self, page):
+        """
+        Get the reading position of the top of a page.
+
+        Parameters:
+            page (int): Page number, starting at 1.
+
+        Returns:
+            float: The reading position of the top of the page.
+        """
+        offset = (page - 1) * self.page_height
+        for other, height in self.page_heights.items():
+            if other < page:
+                offset += height - self.page_height
+        return offset
+
+    def reading_position(self, page, y_from_top):
+        """
+        Convert a page and a distance from the top of the page into a single
+        reading position.
+
+        Parameters:
+            page (int): Page number, starting at 1.
+            y_from_top (float): Distance from the top of the page.
+
+        Returns:
+            float: The reading position.
+        """
+        return self.page_offset(page) + y_from_top
+
+    def cue_position(self, cue):
+        """
+        Get the reading position of a cue. The cue marker is used when
+        present, since it marks the line the cue belongs to.
+
+        The script editor offsets `dy` by the height of the cue's page for
+        every page before it, so the distance from the top of the page is
+        recovered before stacking the real page heights.
+
+        Parameters:
+            cue (dict): The cue annotation.
+
+        Returns:
+            float: The reading position, or None if the annotation is not a
+                   cue.
+        """
+        anchor = cue.get("marker") or cue
+        try:
+            page = int(anchor["page"])
+            dy = float(anchor["pos"]["dy"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        y_from_top = dy - (page - 1) * self.get_page_height(page)
+        return self.reading_position(page, y_from_top)
+
+    def pointer_position(self, match):
+        """
+        Get the reading position of a text search match. Match coordinates
+        are measured from the bottom of the page.
+
+        Parameters:
+            match (dict): The best match of the text search.
+
+        Returns:
+            float: The reading position.
+        """
+        page = int(match["page_number"])
+        return self.reading_position(
+            page, self.get_page_height(page) - match["y_coordinate"]
+        )
+
+    def sync(self, annotations):
+        """
+        Update the index to match a full list of annotations. Only cues that
+        were added, changed or removed are touched.
+
+        Parameters:
+            annotations (list): Annotations as served by `/api/cues`.
+        """
+        cues = {}
+        for annotation in annotations:
+            position = self.cue_position(annotation)
+            if "type" in annotation and position is not None:
+                cues[annotation["id"]] = (position, annotation)
+
+        with self.lock:
+            for cue_id in list(self.index.cues):
+                if cue_id not in cues:
+                    self.index.remove(cue_id)
+            for cue_id, (position, cue) in cues.items():
+                if self.index.get(cue_id) != cue:
+                    self.index.add(cue_id, position, cue)
+
+    def apply_changes(self, changes):
+        """
+        Apply annotation changes in the format broadcast by the backend
+        server's WebSocket. Like the server, updates older than the cue they
+        change are ignored.
+
+        Parameters:
+            changes (list): Dicts with a "type" of "add", "update" or
+                            "delete", the changed "annotation" and the
+                            "timestamp" of the change.
+        """
+        with self.lock:
+            for change in changes:
+                annotation = change["annotation"]
+                cue_id = annotation["id"]
+                if change["type"] == "delete":
+                    self.index.remove(cue_id)
+                    continue
+                if change["type"] == "update":
+                    existing = self.index.get(cue_id) or {}
+                    timestamp = change.get("timestamp", 0)
+                    if timestamp < existing.get("timestamp", 0):
+                        continue
+                    annotation = {
+                        **existing,
+                        **annotation,
+                        "timestamp": timestamp,
+                    }
+                position = self.cue_position(annotation)
+                if "type" in annotation and position is not None:
+                    self.index.add(cue_id, position, annotation)
+
+    def load(self):
+        """
+        Load the cues from the cues endpoint.
+
+        Returns:
+            bool: True if the cues were loaded, False otherwise.
+        """
+        try:
+            with urllib.request.urlopen(self.cues_url, timeout=5) as response:
+                annotations = json.load(response)["annotations"]
+        except Exception as e:
+            logger.warning(f"Failed to load cues from {self.cues_url}: {e}")
+            return False
+        self.sync(annotations)
+        logger.info(f"Loaded {len(self.index)} cues")
+        return True
+
+    def update_position(self, match):
+        """
+        Fire the cues passed by a pointer update.
+
+        Moving forward fires every cue between the furthest position reached
+        and the new one. Small backward moves from search jitter fire
+        nothing, while a backward jump larger than `rearm_distance` re-arms
+        the cues after the new position. A forward jump larger than
+        `max_forward_jump`, as when a global search relocates the pointer,
+        moves past the cues in between without firing them.
+
+        Parameters:
+            match (dict): The best match of the text search.
+
+        Returns:
+            list: The cues fired by this update.
+        """
+        if match is None:
+            return []
+
+        position = self.pointer_position(match)
+        with self.lock:
+            if self.high_water is None:
+                self.last_position = self.high_water = position
+                return []
+
+            if position < self.high_water - self.rearm_distance:
+                logger.info("Pointer jumped back. Re-arming cues.")
+                self.last_position = self.high_water = position
+                return []
+
+            if position > self.high_water + self.max_forward_jump:
+                logger.info("Pointer jumped forward. Skipping passed cues.")
+                self.last_position = self.high_water = position
+                return []
+
+            fired = [
+                cue for _, cue in self.index.between(self.high_water, position)
+            ]
+            self.last_position = position
+            self.high_water = max(self.high_water, position)
+
+        for cue in fired:
+            self.fire(cue)
+        return fired
+
+    def fire(self, cue):
+        """
+        Publish a fired cue to MQTT.
+
+        Parameters:
+            cue (dict): The cue annotation.
+        """
+        logger.info(f"Firing cue: {cue.get('title') or cue['id']}")
+        if self.mqtt_controller is None:
+            return
+        event = {
+            "id": cue["id"],
+            "title": cue.get("title", ""),
+            "type": cue.get("type"),
+            "message": cue.get("message", ""),
+            "autofire": cue.get("autofire", False),
+            "page": cue.get("page"),
+            "timestamp": time.time(),
+        }
+        try:
+            self.mqtt_controller.publish(CUE_FIRE_TOPIC, json.dumps(event))
+        except Exception as e:
+            logger.error(f"Failed to publish MQTT message: {e}")
+
+    def start(self):
+        """
+        Load the cues and keep them updated in a separate thread, from the
+        change feed if websocket-client is installed or by polling if not.
+        """
+        self.load()
+        self.stop_event.clear()
+        if websocket is None:
+            logger.warning("websocket-client not installed. Polling cues.")
+            target = self._refresh_loop
+        else:
+            target = self._change_loop
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the cue update thread."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _refresh_loop(self):
+        """Reload the cues at a fixed interval until stopped."""
+        while not self.stop_event.wait(self.refresh_interval):
+            self.load()
+
+    def handle_message(self, message):
+        """
+        Apply a message from the change feed. Acknowledgements of changes
+        sent by other clients are ignored.
+
+        Parameters:
+            message (str): JSON message broadcast by the backend server.
+        """
+        try:
+            changes = json.loads(message).get("changes")
+            if changes:
+                self.apply_changes(changes)
+        except (ValueError, AttributeError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring malformed cue change: {e}")
+
+    def _change_loop(self):
+        """
+        Apply cue changes from the change feed until stopped, reloading the
+        cues after each (re)connection so edits made while disconnected
+        are not missed.
+        """
+        connected = True
+        while not self.stop_event.is_set():
+            try:
+                connection = websocket.create_connection(
+                    self.changes_url, timeout=1.0
+                )
+            except Exception as e:
+                if connected:
+                    logger.warning(
+                        f"Failed to connect to {self.changes_url}: {e}"
+                    )
+                connected = False
+                self.stop_event.wait(self.refresh_interval)
+                continue
+
+            if not connected:
+                logger.info("Reconnected to the cue change feed")
+            connected = True
+            self.load()
+            try:
+                while not self.stop_event.is_set():
+                    try:
+                        self.handle_message(connection.recv())
+                    except websocket.WebSocketTimeoutException:
+                        continue
+            except Exception as e:
+                logger.warning(f"Cue change feed disconnected: {e}")
+                connected = False
+            finally:
+                connection.close()
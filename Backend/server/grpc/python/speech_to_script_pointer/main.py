@@ -13,15 +13,24 @@ Logging:
     Configured to log information, warnings, and errors to standard output.
 """
 
+import bisect
 import logging
 import sys
 import os
-import tempfile
-import wave
-import pyaudio
+import time
 import librosa
+import numpy as np
 from faster_whisper import WhisperModel
-from speech_to_script_pointer import ScriptDataHandler, TextSearch, AudioBuffer
+from speech_to_script_pointer import (
+    ScriptDataHandler,
+    TextSearch,
+    AudioBuffer,
+    PointerPredictor,
+    TranscriptFilter,
+    MultiChannelCapture,
+    CueEngine,
+    TranscriptWriter,
+)
 
 # Configure logging for the main script
 logging.basicConfig(
@@ -36,6 +45,8 @@ logger.setLevel(logging.INFO)
 
 SAMPLE_RATE = 16000
 BUFFER_SIZE = 512
+BATCH_GAP_SECONDS = 1.0  # Silence between feeds transcribed in one call
+SHOW_START_TOPIC = "local_server/show/start"
 
 
 def clear_console():
@@ -50,18 +61,28 @@ class SpeechToScriptPointer:
 
     Attributes:
         input_device_index (int): Index of the input audio device.
-        model (WhisperModel): Instance of the WhisperModel for transcription.
+        model (WhisperModel): Instance of the WhisperModel for transcription,
+                              shared by all microphone feeds.
         status_queue (Queue): Queue to send status messages.
         stop (bool): Flag to control the recording loop.
         data_cleanup (ScriptDataHandler): Instance of ScriptDataHandler to
                                           handle text data.
         text_search (TextSearch): Instance of TextSearch to perform text
                                   searching.
+        pointer_predictor (PointerPredictor): Instance of PointerPredictor to
+                                              extrapolate the pointer from
+                                              word timestamps.
+        transcript_filter (TranscriptFilter): Instance of TranscriptFilter to
+                                              drop low-confidence segments.
+        cue_engine (CueEngine): Instance of CueEngine to fire cues as the
+                                pointer passes them.
+        transcript_writer (TranscriptWriter): Instance of TranscriptWriter to
+                                              save transcripts off the
+                                              transcription thread.
         displayed_text (str): Displayed transcribed text.
         full_sentences (str): Full sentences of transcribed text.
-        audio_buffer (AudioBuffer): Instance of AudioBuffer to handle audio
-                                    buffering.
-        temp_dir (str): Directory for temporary files.
+        capture (MultiChannelCapture): Instance of MultiChannelCapture to
+                                       buffer each microphone feed.
     """
 
     def __init__(
@@ -79,7 +100,10 @@ class SpeechToScriptPointer:
             mqtt_controller (MQTTController): Instance of the MQTTController
                                               class.
             status_queue (Queue): Queue to send status messages.
-            settings (dict): Dictionary of settings.
+            settings (dict): Dictionary of settings. Several feeds can be
+                             listed in settings["microphone"]
+                             ["microphone_feeds"] as dicts with a "device"
+                             index and a "channel".
             model_size (str): Size of the Whisper model. Defaults to "tiny.en".
             json_data_file (str): Path to the JSON data file. Defaults to
                                   "output_extracted_data.json".
@@ -93,61 +117,231 @@ class SpeechToScriptPointer:
         self.text_search = TextSearch(
             self.data_cleanup.chunks, mqtt_controller
         )
+        self.pointer_predictor = PointerPredictor(
+            self.data_cleanup.words,
+            self.data_cleanup.word_page_numbers,
+            self.data_cleanup.word_y_coordinates,
+            mqtt_controller,
+        )
+        self.transcript_filter = TranscriptFilter(mqtt_controller)
+        self.cue_engine = CueEngine(
+            mqtt_controller, page_heights=self.data_cleanup.page_heights
+        )
+        self.transcript_writer = TranscriptWriter()
+        if mqtt_controller is not None:
+            mqtt_controller.subscribe(SHOW_START_TOPIC, self.show_started)
 
         self.displayed_text = ""
         self.full_sentences = ""
 
-        self.audio_buffer = AudioBuffer()
-
-        # Ensure the temp_files directory exists
-        self.temp_dir = os.path.join(os.path.dirname(__file__), "temp_files")
-        os.makedirs(self.temp_dir, exist_ok=True)
+        feeds = settings["microphone"].get("microphone_feeds") or [
+            {"device": self.input_device_index, "channel": 0}
+        ]
+        self.capture = MultiChannelCapture(
+            feeds, mqtt_controller=mqtt_controller
+        )
 
-    def text_detected(self, text):
+    def text_detected(self, text, weight=1.0, capture_time=None):
         """
-        Handle the detected text, performing a search and saving the
-        transcript.
+        Handle the detected text, performing a search, firing any cues
+        passed and saving the transcript.
 
         Parameters:
             text (str): The detected text.
+            weight (float, optional): Confidence weight of the text.
+            capture_time (float, optional): Wall-clock time the audio of the
+                                            text ended.
         """
         logger.info("Processed text: %s", text)
-        self.text_search.search_for_line(text)
-        self.save_transcript(text)
+        self.text_search.search_for_line(text, weight)
+        self.cue_engine.update_position(self.text_search.best_match)
+        self.save_transcript(text, weight, capture_time)
+
+    def show_started(self, topic, payload):
+        """
+        Start a new transcript session when a show starts.
+
+        Parameters:
+            topic (str): The MQTT topic.
+            payload (dict or str): The show, with its name under "name", or
+                                   the name itself.
+        """
+        name = payload.get("name") if isinstance(payload, dict) else payload
+        if name:
+            # Keep the name usable as part of a file name
+            name = "".join(
+                c if c.isalnum() or c in "-_" else "_" for c in str(name)
+            )
+            name = f"{name}_{time.strftime('%Y%m%d_%H%M%S')}"
+        logger.info(f"Show started. Rotating transcript to {name}.")
+        self.transcript_writer.start_session(name or None)
 
-    def save_transcript(self, text):
+    def save_transcript(self, text, weight=1.0, capture_time=None):
         """
-        Save the transcribed text to a file.
+        Queue the transcribed text and its matched chunk to be saved.
 
         Parameters:
             text (str): The text to be saved.
+            weight (float, optional): Confidence weight of the text.
+            capture_time (float, optional): Wall-clock time the audio of the
+                                            text ended.
         """
-        transcript_file = "transcript2.txt"
-        with open(transcript_file, "a") as f:
-            f.write(text + "\n")
+        self.transcript_writer.write(
+            text, capture_time, self.text_search.best_match, weight
+        )
 
-    def process_audio(self, audio_array):
+    def transcribe_batch(self, audio_arrays):
         """
-        Transcribe the audio array using the model and search for the most
-        fitting line in the JSON data.
+        Transcribe several audio arrays in a single model call.
+
+        The arrays are joined with a gap of silence and the resulting
+        segments are assigned back to the array they fall in, with times
+        made relative to the start of that array. Decoding is not
+        conditioned on previous text, so one feed's transcript does not
+        prompt the next, and segments straddling a gap are dropped, since
+        their words cannot be told apart reliably.
 
         Parameters:
-            audio_array (np.ndarray): The audio data to be transcribed.
+            audio_arrays (list): The audio arrays to be transcribed.
 
         Returns:
-            None
+            list: A list of segments for each audio array.
         """
-        segments, info = self.model.transcribe(audio_array, language="en")
-        target_string = ""
+        gap = np.zeros(int(BATCH_GAP_SECONDS * SAMPLE_RATE), np.float32)
+        offsets = []
+        pieces = []
+        position = 0
+        for audio_array in audio_arrays:
+            if pieces:
+                pieces.append(gap)
+                position += len(gap)
+            offsets.append(position / SAMPLE_RATE)
+            pieces.append(audio_array)
+            position += len(audio_array)
+
+        segments, info = self.model.transcribe(
+            np.concatenate(pieces),
+            language="en",
+            word_timestamps=True,
+            condition_on_previous_text=False,
+        )
+
+        def feed_index(timestamp):
+            return max(bisect.bisect_right(offsets, timestamp) - 1, 0)
 
+        batch = [[] for _ in audio_arrays]
         for segment in segments:
+            index = feed_index(segment.start)
+            if feed_index(segment.end) != index:
+                logger.debug(
+                    "Dropping segment straddling feeds: %s", segment.text
+                )
+                continue
+            offset = offsets[index]
+            words = [
+                word._replace(
+                    start=max(word.start - offset, 0.0),
+                    end=max(word.end - offset, 0.0),
+                )
+                for word in segment.words or []
+                if feed_index((word.start + word.end) / 2) == index
+            ]
+            batch[index].append(
+                segment._replace(
+                    start=max(segment.start - offset, 0.0),
+                    end=segment.end - offset,
+                    words=words,
+                )
+            )
+        return batch
+
+    def process_audio(self, audio_arrays, capture_end_times=None):
+        """
+        Transcribe the audio arrays using the model and search for the most
+        fitting line in the JSON data. Low-confidence segments are filtered
+        out, and the most confident transcript wins. Its word timestamps are
+        aligned onto the script to update the predicted pointer position.
+
+        Parameters:
+            audio_arrays (list): The audio data of each candidate feed, in
+                                 order of preference.
+            capture_end_times (list, optional): Wall-clock time of the last
+                                                captured frame of each feed.
+                                                Defaults to the current
+                                                time.
+
+        Returns:
+            int: Index of the winning audio array, or None if no transcript
+                 was confident enough to search for.
+        """
+        if capture_end_times is None:
+            capture_end_times = [time.time()] * len(audio_arrays)
+
+        winner = None
+        best_weight = 0.0
+        for index, segments in enumerate(self.transcribe_batch(audio_arrays)):
+            segments, weight = self.transcript_filter.filter(segments)
+            if weight > best_weight:
+                winner, best_weight, best_segments = index, weight, segments
+        self.transcript_filter.publish_stats()
+        if winner is None:
+            logger.info("No confident segments. Skipping search.")
+            return None
+
+        target_string = ""
+        asr_words = []
+
+        for segment in best_segments:
             logger.info(
                 "[%.2fs -> %.2fs] %s", segment.start, segment.end, segment.text
             )
             target_string += segment.text
+            asr_words.extend(
+                (word.word, word.start, word.end) for word in segment.words
+            )
 
         logger.info("Transcribed text: %s", target_string)
-        self.text_detected(target_string)
+        self.text_detected(
+            target_string, best_weight, capture_end_times[winner]
+        )
+
+        if self.pointer_predictor.update(
+            asr_words,
+            capture_end_times[winner],
+            len(audio_arrays[winner]) / SAMPLE_RATE,
+            self.current_chunk(),
+        ):
+            self.pointer_predictor.publish_prediction()
+        return winner
+
+    def current_chunk(self):
+        """
+        Get the chunk of the current best match.
+
+        Returns:
+            dict: The chunk of the best match, or None if nothing has matched
+                  yet.
+        """
+        best_match = self.text_search.best_match
+        if best_match is None:
+            return None
+        return self.data_cleanup.chunks[best_match["chunk_index"]]
+
+    @staticmethod
+    def resample(frames):
+        """
+        Convert captured int16 frames to float audio at the model rate.
+
+        Parameters:
+            frames (list): int16 frames captured at AudioBuffer.RATE.
+
+        Returns:
+            np.ndarray: Float audio at SAMPLE_RATE.
+        """
+        audio = np.concatenate(frames).astype(np.float32) / 32768.0
+        return librosa.resample(
+            audio, orig_sr=AudioBuffer.RATE, target_sr=SAMPLE_RATE
+        )
 
     def start(self):
         """Start the audio recording and processing."""
@@ -158,45 +352,37 @@ class SpeechToScriptPointer:
         clear_console()
         logger.info("Started speech to line process.")
 
-        self.audio_buffer.start()
-
-        with tempfile.NamedTemporaryFile(
-            suffix=".wav", delete=False, dir=self.temp_dir
-        ) as temp_wav_file:
-            self.wave_file_path = temp_wav_file.name
-            audio_buffer = AudioBuffer()
-            audio_buffer.start()
-            audio = pyaudio.PyAudio()
-
-            try:
-                while self.stop is False:
-                    logger.info("\n ##### START #######")
-
-                    with wave.open(self.wave_file_path, "wb") as wave_file:
-                        wave_file.setnchannels(1)
-                        wave_file.setsampwidth(
-                            audio.get_sample_size(pyaudio.paInt16)
-                        )
-                        wave_file.setframerate(AudioBuffer.RATE)
-                        wave_file.writeframes(b"".join(audio_buffer.frames))
-
-                    audio_array, _ = librosa.load(
-                        self.wave_file_path, sr=16_000
-                    )
-                    self.process_audio(audio_array)
-
-            except KeyboardInterrupt:
-                logger.info("KeyboardInterrupt received. Stopping process.")
-            finally:
-                audio_buffer.stop()
-                audio.terminate()
-                os.remove(self.wave_file_path)
-                self.stop_recording()
+        self.transcript_writer.start()
+        self.cue_engine.start()
+        self.capture.start()
+        self.pointer_predictor.start()
+
+        try:
+            while self.stop is False:
+                logger.info("\n ##### START #######")
+
+                candidates = self.capture.select_candidates()
+                winner = self.process_audio(
+                    [self.resample(frames) for _, frames, _, _ in candidates],
+                    [capture_time for _, _, capture_time, _ in candidates],
+                )
+                if winner is not None:
+                    self.capture.record_win(candidates[winner][0])
+                self.capture.publish_stats()
+
+        except KeyboardInterrupt:
+            logger.info("KeyboardInterrupt received. Stopping process.")
+        finally:
+            self.stop_recording()
 
     def stop_recording(self):
         """Stop the audio recording and processing."""
         self.stop = True
-        self.audio_buffer.stop()
+        self.pointer_predictor.stop()
+        self.cue_engine.stop()
+        # Flush the transcript first so it is kept if a capture hangs
+        self.transcript_writer.stop()
+        self.capture.stop()
         if self.status_queue:
             self.status_queue.put("Stopped")
 
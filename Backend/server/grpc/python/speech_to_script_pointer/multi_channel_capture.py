@@ -0,0 +1,229 @@
+"""
+MultiChannelCapture Module
+
+This module provides functionality to capture several microphone feeds, each
+into its own ring buffer, and to select the active speakers by energy.
+
+A feed is one channel of one input device. Feeds on the same device share a
+single stream, and each channel is deinterleaved into a separate buffer.
+
+Classes:
+    MultiChannelCapture - Captures several feeds and selects the active ones.
+
+Logging:
+    Configured to log information, warnings, and errors to standard output.
+"""
+
+import json
+import logging
+import sys
+import threading
+import time
+import numpy as np
+from .audio_buffer import AudioBuffer
+
+# Configure logging for the MultiChannelCapture class
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+# Use the same logger instance
+logger = logging.getLogger("speech_to_script_pointer")
+logger.setLevel(logging.INFO)
+
+# Constants
+CHANNEL_STATS_TOPIC = "local_server/speech/channel_stats"
+ENERGY_WINDOW_SECONDS = 1.0
+ACTIVITY_THRESHOLD_DBFS = -45.0
+MAX_CANDIDATES = 3
+
+
+class MultiChannelCapture:
+    """
+    MultiChannelCapture class to capture several microphone feeds.
+
+    Attributes:
+        feeds (list): Dicts with the "device" and "channel" of each feed.
+        buffers (dict): AudioBuffer per input device index.
+        mqtt_controller (object): MQTT controller for publishing statistics.
+        activity_threshold_dbfs (float): Energy above which a feed is active.
+        max_candidates (int): Maximum number of feeds transcribed per cycle.
+        stats (list): Per-feed statistics.
+    """
+
+    def __init__(
+        self,
+        feeds,
+        max_chunks=200,
+        mqtt_controller=None,
+        activity_threshold_dbfs=ACTIVITY_THRESHOLD_DBFS,
+        max_candidates=MAX_CANDIDATES,
+    ):
+        """
+        Initialize the MultiChannelCapture object.
+
+        Parameters:
+            feeds (list): Dicts with the "device" index and the "channel" of
+                          each feed.
+            max_chunks (int, optional): Maximum number of chunks stored per
+                                        feed.
+            mqtt_controller (object, optional): MQTT controller for
+                                                publishing statistics.
+            activity_threshold_dbfs (float, optional): Energy above which a
+                                                       feed is active.
+            max_candidates (int, optional): Maximum number of feeds
+                                            transcribed per cycle.
+        """
+        self.feeds = feeds
+        self.mqtt_controller = mqtt_controller
+        self.activity_threshold_dbfs = activity_threshold_dbfs
+        self.max_candidates = max_candidates
+        self.lock = threading.Lock()
+
+        channels_per_device = {}
+        for feed in feeds:
+            channels_per_device[feed["device"]] = max(
+                channels_per_device.get(feed["device"], 0),
+                feed.get("channel", 0) + 1,
+            )
+        self.buffers = {
+            device: AudioBuffer(
+                max_chunks, input_device_index=device, channels=channels
+            )
+            for device, channels in channels_per_device.items()
+        }
+        self.stats = [
+            {
+                "device": feed["device"],
+                "channel": feed.get("channel", 0),
+                "energy_dbfs": None,
+                "active_count": 0,
+                "candidate_count": 0,
+                "win_count": 0,
+            }
+            for feed in feeds
+        ]
+
+    def start(self):
+        """Start capturing all feeds and wait until every buffer is full."""
+        for audio_buffer in self.buffers.values():
+            audio_buffer.thread.start()
+        while not all(
+            audio_buffer.is_full() for audio_buffer in self.buffers.values()
+        ):
+            time.sleep(0.1)
+
+    def stop(self):
+        """Stop capturing all feeds."""
+        for audio_buffer in self.buffers.values():
+            audio_buffer.stop()
+
+    def feed_frames(self, index):
+        """
+        Get a snapshot of the frames and capture time of a feed.
+
+        Parameters:
+            index (int): Index of the feed.
+
+        Returns:
+            tuple: List of int16 frames and the wall-clock time of the last
+                   frame.
+        """
+        feed = self.feeds[index]
+        audio_buffer = self.buffers[feed["device"]]
+        frames = audio_buffer.channel_frames[feed.get("channel", 0)]
+        return list(frames), audio_buffer.last_frame_time
+
+    @staticmethod
+    def energy_dbfs(frames):
+        """
+        Compute the RMS energy of the last frames in dBFS.
+
+        Parameters:
+            frames (list): int16 frames, oldest first.
+
+        Returns:
+            float: RMS energy in dBFS.
+        """
+        chunk_count = max(
+            1,
+            int(ENERGY_WINDOW_SECONDS * AudioBuffer.RATE / AudioBuffer.CHUNK),
+        )
+        recent = frames[-chunk_count:]
+        if not recent:
+            return float("-inf")
+        samples = np.concatenate(recent).astype(np.float32) / 32768.0
+        rms = np.sqrt(np.mean(samples**2))
+        return 20 * np.log10(max(rms, 1e-10))
+
+    def select_candidates(self):
+        """
+        Select the feeds to transcribe this cycle.
+
+        Active feeds are sorted by energy, loudest first. If no feed is
+        active, the loudest feed is still returned so that a single feed
+        behaves exactly like a single AudioBuffer.
+
+        Returns:
+            list: Tuples of (feed index, frames, capture time, energy) for
+                  the selected feeds.
+        """
+        snapshots = []
+        with self.lock:
+            for index, stats in enumerate(self.stats):
+                frames, capture_time = self.feed_frames(index)
+                energy = self.energy_dbfs(frames)
+                stats["energy_dbfs"] = round(float(energy), 1)
+                if energy >= self.activity_threshold_dbfs:
+                    stats["active_count"] += 1
+                snapshots.append((index, frames, capture_time, energy))
+
+            snapshots.sort(key=lambda snapshot: snapshot[3], reverse=True)
+            candidates = [
+                snapshot
+                for snapshot in snapshots
+                if snapshot[3] >= self.activity_threshold_dbfs
+            ][: self.max_candidates]
+            if not candidates and snapshots:
+                candidates = snapshots[:1]
+
+            for index, _, _, _ in candidates:
+                self.stats[index]["candidate_count"] += 1
+        return candidates
+
+    def record_win(self, index):
+        """
+        Record that a feed's transcript was used for the script search.
+
+        Parameters:
+            index (int): Index of the feed.
+        """
+        with self.lock:
+            self.stats[index]["win_count"] += 1
+
+    def get_stats(self):
+        """
+        Get a copy of the per-feed statistics.
+
+        Returns:
+            list: Statistics of each feed, including input overflows.
+        """
+        with self.lock:
+            stats = [dict(feed_stats) for feed_stats in self.stats]
+        for feed_stats in stats:
+            audio_buffer = self.buffers[feed_stats["device"]]
+            feed_stats["overflow_count"] = audio_buffer.overflow_count
+        return stats
+
+    def publish_stats(self):
+        """Publish the per-feed statistics to MQTT."""
+        if self.mqtt_controller is None:
+            return
+        try:
+            self.mqtt_controller.publish(
+                CHANNEL_STATS_TOPIC, json.dumps(self.get_stats()), retain=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to publish MQTT message: {e}")
@@ -0,0 +1,274 @@
+"""
+PointerPredictor Module
+
+This module provides functionality to align word-level ASR timestamps onto
+the script and extrapolate the script pointer to the current time.
+
+The transcription of a buffer is only available after the buffer has been
+recorded and the model has run, so the matched position always trails the
+performer. Aligning the last committed words onto script word positions
+gives an anchor (script word, wall-clock time) and a speaking rate, from
+which the current word can be predicted.
+
+Classes:
+    PointerPredictor - Aligns ASR words to script words and publishes the
+                       predicted pointer position.
+
+Logging:
+    Configured to log information, warnings, and errors to standard output.
+"""
+
+import json
+import logging
+import string
+import sys
+import threading
+import time
+from difflib import SequenceMatcher
+
+# Configure logging for the PointerPredictor class
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+# Use the same logger instance
+logger = logging.getLogger("speech_to_script_pointer")
+logger.setLevel(logging.INFO)
+
+# Constants
+PREDICTED_POSITION_TOPIC = "local_server/tracker/predicted_position"
+COMMIT_GUARD_SECONDS = 0.3  # Words ending this close to "now" may change
+MAX_ALIGNED_WORDS = 20  # Number of trailing ASR words to align
+BACKWARD_WORD_MARGIN = 20  # Script words searched before the anchor chunk
+FORWARD_WORD_MARGIN = 40  # Script words searched after the anchor chunk
+MIN_MATCHED_WORDS = 3
+MIN_RATE_SPAN_SECONDS = 1.0
+MIN_WORDS_PER_SECOND = 0.5
+MAX_WORDS_PER_SECOND = 6.0
+DEFAULT_WORDS_PER_SECOND = 2.5
+RATE_SMOOTHING = 0.3  # Weight of the newest rate estimate
+MAX_EXTRAPOLATION_SECONDS = 4.0
+
+
+class PointerPredictor:
+    """
+    PointerPredictor class to predict the current script word from
+    word-level ASR timestamps.
+
+    Attributes:
+        words (list): Script words in reading order.
+        page_numbers (list): Page number of each script word.
+        y_coordinates (list): Y coordinate of each script word.
+        mqtt_controller (object): MQTT controller for publishing predictions.
+        words_per_second (float): Smoothed speaking rate estimate.
+        anchor_word_index (int): Script word index of the last aligned word.
+        anchor_time (float): Wall-clock time the anchor word was spoken.
+        publish_interval (float): Seconds between published predictions.
+    """
+
+    def __init__(
+        self,
+        words,
+        page_numbers,
+        y_coordinates,
+        mqtt_controller=None,
+        publish_interval=0.2,
+    ):
+        """
+        Initialize the PointerPredictor object.
+
+        Parameters:
+            words (list): Script words in reading order.
+            page_numbers (list): Page number of each script word.
+            y_coordinates (list): Y coordinate of each script word.
+            mqtt_controller (object, optional): MQTT controller for
+                                                publishing predictions.
+            publish_interval (float, optional): Seconds between published
+                                                predictions.
+        """
+        self.words = words
+        self.page_numbers = page_numbers
+        self.y_coordinates = y_coordinates
+        self.mqtt_controller = mqtt_controller
+        self.publish_interval = publish_interval
+        self.words_per_second = DEFAULT_WORDS_PER_SECOND
+        self.anchor_word_index = None
+        self.anchor_time = None
+        self.last_published_index = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def clean_word(word):
+        """
+        Clean an ASR word the same way the script text is normalized.
+
+        Parameters:
+            word (str): The word to be cleaned.
+
+        Returns:
+            str: The cleaned word.
+        """
+        word = word.strip().lower()
+        return word.translate(str.maketrans("", "", string.punctuation))
+
+    def update(self, asr_words, capture_end_time, audio_duration, chunk):
+        """
+        Align the last committed ASR words onto the script around the matched
+        chunk and update the anchor and speaking rate.
+
+        Parameters:
+            asr_words (list): Tuples of (word, start, end), with times in
+                              seconds relative to the start of the buffer.
+            capture_end_time (float): Wall-clock time of the last captured
+                                      audio frame in the buffer.
+            audio_duration (float): Duration of the transcribed buffer in
+                                    seconds.
+            chunk (dict): The chunk matched by the text search, used to
+                          narrow the alignment window.
+
+        Returns:
+            bool: True if the anchor was updated, False otherwise.
+        """
+        if not asr_words or chunk is None or not self.words:
+            return False
+
+        buffer_start_time = capture_end_time - audio_duration
+        committed = [
+            (self.clean_word(word), end)
+            for word, start, end in asr_words
+            if end <= audio_duration - COMMIT_GUARD_SECONDS
+        ]
+        committed = [(w, end) for w, end in committed if w]
+        committed = committed[-MAX_ALIGNED_WORDS:]
+        if len(committed) < MIN_MATCHED_WORDS:
+            return False
+
+        first_word_index = chunk.get("first_word_index", 0)
+        region_start = max(0, first_word_index - BACKWARD_WORD_MARGIN)
+        region_end = min(
+            len(self.words), first_word_index + FORWARD_WORD_MARGIN
+        )
+        region = self.words[region_start:region_end]
+        asr_tokens = [w for w, _ in committed]
+
+        matcher = SequenceMatcher(None, region, asr_tokens, autojunk=False)
+        pairs = []
+        for block in matcher.get_matching_blocks():
+            for offset in range(block.size):
+                script_index = region_start + block.a + offset
+                spoken_at = buffer_start_time + committed[block.b + offset][1]
+                pairs.append((spoken_at, script_index))
+
+        if len(pairs) < MIN_MATCHED_WORDS:
+            logger.debug("Too few aligned words (%d)", len(pairs))
+            return False
+
+        with self.lock:
+            self._update_rate(pairs)
+            self.anchor_time, self.anchor_word_index = pairs[-1]
+
+        logger.debug(
+            "Aligned %d words, anchor word %d, rate %.2f words/s",
+            len(pairs),
+            self.anchor_word_index,
+            self.words_per_second,
+        )
+        return True
+
+    def _update_rate(self, pairs):
+        """
+        Update the smoothed speaking rate from aligned (time, word) pairs
+        using a least-squares slope.
+
+        Parameters:
+            pairs (list): Tuples of (wall-clock time, script word index).
+        """
+        times = [t for t, _ in pairs]
+        if times[-1] - times[0] < MIN_RATE_SPAN_SECONDS:
+            return
+
+        mean_t = sum(times) / len(times)
+        mean_i = sum(i for _, i in pairs) / len(pairs)
+        covariance = sum((t - mean_t) * (i - mean_i) for t, i in pairs)
+        variance = sum((t - mean_t) ** 2 for t in times)
+        if variance == 0:
+            return
+
+        rate = covariance / variance
+        rate = min(max(rate, MIN_WORDS_PER_SECOND), MAX_WORDS_PER_SECOND)
+        self.words_per_second = (
+            RATE_SMOOTHING * rate
+            + (1 - RATE_SMOOTHING) * self.words_per_second
+        )
+
+    def predict(self, now=None):
+        """
+        Predict the current script position by extrapolating from the anchor
+        with the estimated speaking rate.
+
+        Parameters:
+            now (float, optional): Wall-clock time to predict for. Defaults
+                                   to the current time.
+
+        Returns:
+            dict: The predicted position, or None if no anchor exists yet.
+        """
+        with self.lock:
+            if self.anchor_word_index is None:
+                return None
+            if now is None:
+                now = time.time()
+            elapsed = min(
+                max(now - self.anchor_time, 0), MAX_EXTRAPOLATION_SECONDS
+            )
+            word_index = min(
+                int(self.anchor_word_index + self.words_per_second * elapsed),
+                len(self.words) - 1,
+            )
+            return {
+                "page_number": self.page_numbers[word_index],
+                "y_coordinate": self.y_coordinates[word_index],
+                "word_index": word_index,
+                "words_per_second": round(self.words_per_second, 2),
+                "timestamp": now,
+            }
+
+    def publish_prediction(self):
+        """
+        Publish the predicted position to MQTT if the predicted word has
+        changed since the last publish.
+        """
+        prediction = self.predict()
+        if prediction is None or self.mqtt_controller is None:
+            return
+        if prediction["word_index"] == self.last_published_index:
+            return
+
+        self.last_published_index = prediction["word_index"]
+        try:
+            self.mqtt_controller.publish(
+                PREDICTED_POSITION_TOPIC, json.dumps(prediction), retain=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to publish MQTT message: {e}")
+
+    def start(self):
+        """Start publishing predictions in a separate thread."""
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._publish_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the prediction publishing thread."""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _publish_loop(self):
+        """Publish predictions at a fixed interval until stopped."""
+        while not self.stop_event.wait(self.publish_interval):
+            self.publish_prediction()
@@ -36,6 +36,11 @@ class ScriptDataHandler:
         json_data_file (str): Path to the JSON data file.
         segments (list): List of text segments loaded from the JSON file.
         chunks (list): List of text chunks created from the segments.
+        words (list): Every script word in reading order.
+        word_page_numbers (list): Page number of each entry in `words`.
+        word_y_coordinates (list): Y coordinate of each entry in `words`.
+        page_heights (dict): Height of each page in PDF points, by page
+                             number, for pages that record it.
     """
 
     def __init__(self, json_data_file):
@@ -48,6 +53,10 @@ class ScriptDataHandler:
         self.json_data_file = json_data_file
         self.segments = []
         self.chunks = []
+        self.words = []
+        self.word_page_numbers = []
+        self.word_y_coordinates = []
+        self.page_heights = {}
         self.load_json_data()
         self.create_chunks()
 
@@ -78,6 +87,10 @@ class ScriptDataHandler:
             with open(self.json_data_file, "r") as json_file:
                 json_data = json.load(json_file)
                 for page in json_data["pages"]:
+                    if page.get("height"):
+                        self.page_heights[page["page_number"]] = page[
+                            "height"
+                        ]
                     for idx, fragment in enumerate(page["fragments"]):
                         normalized_text = self.normalize_text(fragment["text"])
                         if normalized_text.strip():  # Skip empty lines
@@ -102,7 +115,8 @@ class ScriptDataHandler:
         Create chunks of text from the segments.
 
         Chunks are created with a fixed size and overlap for efficient
-        searching.
+        searching. The flat word list and the position of each word are kept
+        so that word-level alignment can map back onto the script.
         """
         words = []
         fragment_ids = []
@@ -137,10 +151,15 @@ class ScriptDataHandler:
                 "last_fragment_id": chunk_fragment_ids[-1],
                 "last_y_coordinate": chunk_coordinates[-1],
                 "last_page_number": chunk_page_numbers[-1],
+                "first_word_index": i,
             }
             self.chunks.append(chunk)
             chunk_id += 1
 
+        self.words = words
+        self.word_page_numbers = page_numbers
+        self.word_y_coordinates = coordinates
+
 
 if __name__ == "__main__":
     data_cleanup = ScriptDataHandler(
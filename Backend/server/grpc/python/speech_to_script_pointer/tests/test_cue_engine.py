@@ -0,0 +1,84 @@
+"""
+Tests for the CueEngine reading positions and cue firing.
+"""
+
+import json
+
+from speech_to_script_pointer.cue_engine import CueEngine
+
+PAGE_HEIGHT = 842
+
+
+def make_cue(cue_id, page, y_from_top, page_height=PAGE_HEIGHT):
+    """
+    Build a cue annotation the way the script editor stores it, with `dy`
+    offset by the height of the cue's page for every page before it.
+    """
+    return {
+        "id": cue_id,
+        "type": "lighting",
+        "title": cue_id,
+        "page": page,
+        "pos": {"dx": 100, "dy": (page - 1) * page_height + y_from_top},
+    }
+
+
+def make_match(page, y_from_top, page_height=PAGE_HEIGHT):
+    """Build a text search match, measured from the bottom of the page."""
+    return {"page_number": page, "y_coordinate": page_height - y_from_top}
+
+
+def make_engine(pages=5):
+    return CueEngine(
+        page_heights={page: PAGE_HEIGHT for page in range(1, pages + 1)}
+    )
+
+
+def test_cue_and_pointer_share_reading_positions():
+    engine = make_engine()
+    for page in (1, 2, 3):
+        assert engine.cue_position(make_cue("cue", page, 300)) == (
+            engine.pointer_position(make_match(page, 300))
+        )
+
+
+def test_cue_on_page_three_fires_when_pointer_reaches_it():
+    engine = make_engine()
+    engine.sync([make_cue("cue_3", 3, 400)])
+
+    engine.update_position(make_match(3, 100))
+    assert engine.update_position(make_match(3, 390)) == []
+
+    fired = engine.update_position(make_match(3, 410))
+    assert [cue["id"] for cue in fired] == ["cue_3"]
+
+
+def test_pages_of_different_heights_are_stacked():
+    engine = CueEngine(page_heights={1: 842, 2: 600, 3: 842})
+    assert engine.page_offset(3) == 842 + 600
+    assert engine.cue_position(make_cue("cue", 2, 50, 600)) == 842 + 50
+
+
+def test_forward_jump_skips_cues_in_between():
+    engine = make_engine()
+    engine.sync([make_cue("cue_2", 2, 400), make_cue("cue_4", 4, 420)])
+
+    engine.update_position(make_match(1, 100))
+    assert engine.update_position(make_match(4, 400)) == []
+
+    fired = engine.update_position(make_match(4, 440))
+    assert [cue["id"] for cue in fired] == ["cue_4"]
+
+
+def test_change_feed_updates_the_index():
+    engine = make_engine()
+    engine.sync([make_cue("cue_1", 1, 400)])
+
+    moved = make_cue("cue_1", 1, 200)
+    engine.handle_message(
+        '{"changes": [{"type": "update", "timestamp": 2, "annotation": %s}]}'
+        % json.dumps(moved)
+    )
+    engine.update_position(make_match(1, 100))
+    fired = engine.update_position(make_match(1, 300))
+    assert [cue["id"] for cue in fired] == ["cue_1"]
@@ -143,12 +143,16 @@ class TextSearch:
                 }
             )
 
-    def search_for_line(self, target_string):
+    def search_for_line(self, target_string, weight=1.0):
         """
         Search for the target string within the current window of chunks.
 
         Parameters:
             target_string (str): The target string to search for.
+            weight (float, optional): Confidence weight of the transcript.
+                                      A failed search of a low-confidence
+                                      transcript counts as a fraction of a
+                                      failed attempt.
 
         Returns:
             dict: The best match found, or None if no match is found.
@@ -219,7 +223,7 @@ class TextSearch:
         else:
             # Increment intermediate_attempts if the score is within the
             # intermediate threshold
-            self.intermediate_attempts += 1
+            self.intermediate_attempts += weight
             self.failed_transcriptions.append(
                 target_string
             )  # Use the original target_string here
@@ -0,0 +1,173 @@
+"""
+TranscriptFilter Module
+
+This module provides functionality to filter Whisper segments by their
+confidence before the transcript is searched for in the script.
+
+Segments that are most likely silence, or that are repetitive hallucinations,
+are dropped. Segments with a low average log probability are kept but
+down-weighted, so that they count less toward triggering a global search.
+
+Classes:
+    TranscriptFilter - Drops or down-weights low-confidence segments and
+                       keeps statistics on what was filtered.
+
+Logging:
+    Configured to log information, warnings, and errors to standard output.
+"""
+
+import json
+import logging
+import sys
+import threading
+
+# Configure logging for the TranscriptFilter class
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+# Use the same logger instance
+logger = logging.getLogger("speech_to_script_pointer")
+logger.setLevel(logging.INFO)
+
+# Constants, following the thresholds Whisper uses for its own fallbacks
+FILTER_STATS_TOPIC = "local_server/speech/filter_stats"
+NO_SPEECH_THRESHOLD = 0.6
+LOG_PROB_THRESHOLD = -1.0
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOW_CONFIDENCE_WEIGHT = 0.5
+
+
+class TranscriptFilter:
+    """
+    TranscriptFilter class to drop or down-weight low-confidence segments.
+
+    Attributes:
+        mqtt_controller (object): MQTT controller for publishing statistics.
+        no_speech_threshold (float): Segments above this no-speech
+                                     probability are considered silence when
+                                     their log probability is also low.
+        log_prob_threshold (float): Segments below this average log
+                                    probability are down-weighted.
+        compression_ratio_threshold (float): Segments above this compression
+                                             ratio are considered repetitive.
+        stats (dict): Counters of segments and transcripts filtered.
+    """
+
+    def __init__(
+        self,
+        mqtt_controller=None,
+        no_speech_threshold=NO_SPEECH_THRESHOLD,
+        log_prob_threshold=LOG_PROB_THRESHOLD,
+        compression_ratio_threshold=COMPRESSION_RATIO_THRESHOLD,
+    ):
+        """
+        Initialize the TranscriptFilter object.
+
+        Parameters:
+            mqtt_controller (object, optional): MQTT controller for
+                                                publishing statistics.
+            no_speech_threshold (float, optional): No-speech probability
+                                                   threshold.
+            log_prob_threshold (float, optional): Average log probability
+                                                  threshold.
+            compression_ratio_threshold (float, optional): Compression ratio
+                                                           threshold.
+        """
+        self.mqtt_controller = mqtt_controller
+        self.no_speech_threshold = no_speech_threshold
+        self.log_prob_threshold = log_prob_threshold
+        self.compression_ratio_threshold = compression_ratio_threshold
+        self.lock = threading.Lock()
+        self.stats = {
+            "segments_total": 0,
+            "segments_kept": 0,
+            "segments_down_weighted": 0,
+            "segments_dropped_no_speech": 0,
+            "segments_dropped_repetitive": 0,
+            "transcripts_total": 0,
+            "transcripts_dropped": 0,
+        }
+
+    def segment_weight(self, segment):
+        """
+        Compute the weight of a single segment.
+
+        Parameters:
+            segment (Segment): A faster-whisper segment.
+
+        Returns:
+            float: 0 if the segment should be dropped, LOW_CONFIDENCE_WEIGHT
+                   if it should be down-weighted, otherwise 1.
+        """
+        if (
+            segment.no_speech_prob > self.no_speech_threshold
+            and segment.avg_logprob < self.log_prob_threshold
+        ):
+            self.stats["segments_dropped_no_speech"] += 1
+            return 0.0
+        if segment.compression_ratio > self.compression_ratio_threshold:
+            self.stats["segments_dropped_repetitive"] += 1
+            return 0.0
+        if segment.avg_logprob < self.log_prob_threshold:
+            self.stats["segments_down_weighted"] += 1
+            return LOW_CONFIDENCE_WEIGHT
+        return 1.0
+
+    def filter(self, segments):
+        """
+        Filter the segments of a transcript.
+
+        Parameters:
+            segments (list): faster-whisper segments of one transcript.
+
+        Returns:
+            tuple: The kept segments and the weight of the transcript, which
+                   is the mean weight of the kept segments weighted by text
+                   length. The weight is 0 if every segment was dropped.
+        """
+        kept = []
+        weighted_length = 0.0
+        total_length = 0
+        with self.lock:
+            self.stats["transcripts_total"] += 1
+            for segment in segments:
+                self.stats["segments_total"] += 1
+                weight = self.segment_weight(segment)
+                if weight == 0:
+                    logger.info("Dropped segment: %s", segment.text)
+                    continue
+                self.stats["segments_kept"] += 1
+                kept.append(segment)
+                length = max(len(segment.text.strip()), 1)
+                weighted_length += weight * length
+                total_length += length
+
+            if not kept:
+                self.stats["transcripts_dropped"] += 1
+                return kept, 0.0
+
+        return kept, weighted_length / total_length
+
+    def get_stats(self):
+        """
+        Get a copy of the filter statistics.
+
+        Returns:
+            dict: The filter statistics.
+        """
+        with self.lock:
+            return dict(self.stats)
+
+    def publish_stats(self):
+        """Publish the filter statistics to MQTT."""
+        if self.mqtt_controller is None:
+            return
+        try:
+            self.mqtt_controller.publish(
+                FILTER_STATS_TOPIC, json.dumps(self.get_stats()), retain=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to publish MQTT message: {e}")
@@ -0,0 +1,226 @@
+"""
+TranscriptWriter Module
+
+This module provides functionality to write transcripts to disk from a
+background thread, so that file I/O never runs on the transcription thread.
+
+Each line is stored as a JSON object with its capture time and the chunk it
+matched. Lines are written in batches to one file per session, and a session
+is split into numbered parts so that a long show never produces one
+unbounded file. A new session can be started at any time, for example when
+a show starts. Parts can be written gzip-compressed for archival.
+
+Classes:
+    TranscriptWriter - Queues transcript lines and writes them in batches.
+
+Logging:
+    Configured to log information, warnings, and errors to standard output.
+"""
+
+import gzip
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+# Configure logging for the TranscriptWriter class
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)],
+)
+
+# Use the same logger instance
+logger = logging.getLogger("speech_to_script_pointer")
+logger.setLevel(logging.INFO)
+
+# Constants
+TRANSCRIPT_FOLDER = "server/storage/transcript_logs"
+MAX_LINES_PER_PART = 5000
+FLUSH_INTERVAL = 1.0
+MAX_QUEUE_SIZE = 10000
+
+
+class TranscriptWriter:
+    """
+    TranscriptWriter class to write transcript lines in a background thread.
+
+    Attributes:
+        folder (str): Folder the session files are written to.
+        compress (bool): Write gzip-compressed parts if True.
+        max_lines_per_part (int): Lines written to a part before rotating.
+        flush_interval (float): Maximum seconds a line waits to be written.
+        session_name (str): Name of the current session.
+        dropped_count (int): Lines dropped because the queue was full.
+    """
+
+    def __init__(
+        self,
+        folder=TRANSCRIPT_FOLDER,
+        compress=False,
+        max_lines_per_part=MAX_LINES_PER_PART,
+        flush_interval=FLUSH_INTERVAL,
+        max_queue_size=MAX_QUEUE_SIZE,
+    ):
+        """
+        Initialize the TranscriptWriter object.
+
+        Parameters:
+            folder (str, optional): Folder the session files are written to.
+            compress (bool, optional): Write gzip-compressed parts if True.
+            max_lines_per_part (int, optional): Lines written to a part
+                                                before rotating.
+            flush_interval (float, optional): Maximum seconds a line waits
+                                              to be written.
+            max_queue_size (int, optional): Maximum number of lines waiting
+                                            to be written.
+        """
+        self.folder = folder
+        self.compress = compress
+        self.max_lines_per_part = max_lines_per_part
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.session_name = None
+        self.dropped_count = 0
+        self.file = None
+        self.part = 0
+        self.part_lines = 0
+        self.thread = None
+
+    def start_session(self, session_name=None):
+        """
+        Start a new session, for example for a new show. Lines written
+        afterwards go to a new file.
+
+        Parameters:
+            session_name (str, optional): Name of the session, for example
+                                          the show. Defaults to the current
+                                          date and time.
+        """
+        if session_name is None:
+            session_name = time.strftime("session_%Y%m%d_%H%M%S")
+        self.queue.put(("session", session_name))
+
+    def write(self, text, capture_time=None, match=None, weight=1.0):
+        """
+        Queue a transcript line without blocking.
+
+        Parameters:
+            text (str): The transcribed text.
+            capture_time (float, optional): Wall-clock time the audio ended.
+            match (dict, optional): The best match of the text search.
+            weight (float, optional): Confidence weight of the text.
+        """
+        record = {
+            "capture_time": capture_time,
+            "text": text,
+            "weight": round(weight, 2),
+        }
+        if match is not None:
+            record.update(
+                {
+                    "chunk_index": match.get("chunk_index"),
+                    "chunk_text": match.get("chunk_text"),
+                    "page_number": match.get("page_number"),
+                    "y_coordinate": match.get("y_coordinate"),
+                    "similarity_score": match.get("similarity_score"),
+                }
+            )
+        try:
+            self.queue.put_nowait(("line", record))
+        except queue.Full:
+            self.dropped_count += 1
+            logger.warning("Transcript queue full. Line dropped.")
+
+    def start(self, session_name=None):
+        """
+        Start the writer thread and a first session.
+
+        Parameters:
+            session_name (str, optional): Name of the first session.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        self.start_session(session_name)
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Write any queued lines, close the file and stop the thread."""
+        if self.thread is None:
+            return
+        self.queue.put(("stop", None))
+        self.thread.join()
+        self.thread = None
+
+    def _open_part(self):
+        """Close the current part and open the next one."""
+        if self.file is not None:
+            file, self.file = self.file, None
+            file.close()
+        self.part += 1
+        self.part_lines = 0
+        extension = "jsonl.gz" if self.compress else "jsonl"
+        path = os.path.join(
+            self.folder, f"{self.session_name}_{self.part:03}.{extension}"
+        )
+        if self.compress:
+            self.file = gzip.open(path, "at", encoding="utf-8")
+        else:
+            self.file = open(path, "a", encoding="utf-8")
+        logger.info(f"Writing transcript to {path}")
+
+    def _write_batch(self, batch):
+        """
+        Write a batch of queued items, rotating sessions and parts as needed.
+
+        Parameters:
+            batch (list): Queued (kind, value) items in order.
+        """
+        for kind, value in batch:
+            if kind == "session":
+                self.session_name = value
+                self.part = 0
+                self._open_part()
+            elif kind == "line":
+                # A part that failed to open is retried on the next line
+                if (
+                    self.file is None
+                    or self.part_lines >= self.max_lines_per_part
+                ):
+                    self._open_part()
+                self.file.write(json.dumps(value) + "\n")
+                self.part_lines += 1
+        if self.file is not None:
+            self.file.flush()
+
+    def _write_loop(self):
+        """Collect queued items and write them in batches until stopped."""
+        running = True
+        while running:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while True:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if ("stop", None) in batch:
+                batch = batch[: batch.index(("stop", None))]
+                running = False
+            if not batch:
+                continue
+            try:
+                self._write_batch(batch)
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to write transcript: {e}")
+
+        if self.file is not None:
+            try:
+                self.file.close()
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to close transcript: {e}")
+            self.file = None
@@ -60,6 +60,7 @@ class PDFViewerState extends State<PDFViewer> {
 
   /// Sends the extracted text to the PDFBloc for further processing.
   void _sendExtractedText() {
+    final pages = _controller.document.pages;
     final jsonTexts = {
       'pages': _pageTexts.entries.map((entry) {
         final index = entry.key;
@@ -67,6 +68,7 @@ class PDFViewerState extends State<PDFViewer> {
         return {
           'page_number':
               index + 1, // assuming index starts from 0 and needs to be 1-based
+          'height': pages[index].height, // page height in PDF points
           ...text.toJson(), // spreading the rest of the text's JSON properties
         };
       }).toList(),